@@ -74,6 +74,8 @@ export const aiGenerationFunction = inngest.createFunction(
           headers: {
             "Content-Type": "application/json",
             Authorization: env.BACKEND_API_KEY,
+            // Retries of this step get the first synthesis back instead of a new one
+            "Idempotency-Key": audioClip.id,
           },
           body: JSON.stringify({
             text: audioClip.text,
@@ -89,6 +91,8 @@ export const aiGenerationFunction = inngest.createFunction(
           headers: {
             "Content-Type": "application/json",
             Authorization: env.BACKEND_API_KEY,
+            // Retries of this step get the first synthesis back instead of a new one
+            "Idempotency-Key": audioClip.id,
           },
           body: JSON.stringify({
             text: audioClip.text,
@@ -1,22 +1,64 @@
+import asyncio
+import json
 import logging
+import math
 import os
 import uuid
-import shutil
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional
 
-from fastapi import Depends, FastAPI, Header, HTTPException, UploadFile, File
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket
 from fastapi.security import APIKeyHeader
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
 
 # Import Gemini TTS API
-from gemini_api import generate_tts, generate_multi_speaker_tts, get_all_voices
-
-logging.basicConfig(level=logging.INFO)
+from chunking import split_turns
+from gemini_api import (
+    GEMINI_STT_MODEL,
+    GEMINI_TTS_MODEL,
+    TTS_CHUNK_CROSSFADE_MS,
+    assemble_wav_files,
+    build_wav_header,
+    close_http_client,
+    WavFileWriter,
+    gemini_backends,
+    generate_multi_speaker_tts_to_file_async,
+    get_all_voices,
+    stream_tts_pcm,
+    synthesize_to_file_async,
+    transcribe_pcm_async,
+    upstream_governor,
+)
+from audio_delivery import HotAudioCache, audio_response, stat_audio_file
+from audio_encoding import STREAMABLE_FORMATS, EncodingError, decode_to_pcm, encode_variant, media_type_for, \
+    negotiate_format, shutdown_executor, validate_options, variant_filename
+from audio_processing import ProcessingError, process_variant, validate_processing
+from idempotency import IDEMPOTENCY_DB, IDEMPOTENCY_KEY_MAX_LENGTH, IdempotencyConflictError, IdempotencyStore, \
+    request_fingerprint
+from jobs import QueueFullError, create_job_manager
+from observability import TracingMiddleware, configure_logging, detail_enabled
+from metrics import MetricsMiddleware, SnapshotPublisher, register_snapshot, render_metrics, set_request_labels, stage
+from singleflight import SingleFlight
+from storage import S3_PRESIGN_EXPIRY, StorageError, create_storage
+from upstream_governor import UpstreamUnavailableError
+from realtime_tts import TtsSession
+from retention import RetentionManager, RetentionPolicy, SharedRetentionManager
+from shared_state import SharedStore, open_shared_store
+from synthesis_backends import create_backends
+from synthesis_cache import CACHE_ENABLED, SynthesisCache, make_cache_key, normalize_text
+from transcription import STT_CACHE_DB, STT_SAMPLE_RATE, TranscriptCache, join_segments, make_transcript_key, \
+    transcribe_windows
+from uploads import UPLOAD_MAX_FILE_BYTES, MultipartFileReader, ReceivedUpload, UploadError, UploadNotFoundError, \
+    UploadOffsetError, UploadSessions, UploadTooLargeError, content_hash_of, hash_file, receive_upload, \
+    upload_extension
+
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Global variables
@@ -34,25 +76,114 @@ OUTPUTS_PREFIX = "seedvc-outputs"
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Retention per prefix: byte quota and TTL since last access (0 disables)
+# Off by default: clients keep the keys of generated clips and uploads, so deleting them is opt-in
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", "0"))
+OUTPUT_TTL = int(os.getenv("OUTPUT_TTL", "0"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", "0"))
+UPLOAD_TTL = int(os.getenv("UPLOAD_TTL", "0"))
+
 # Base URL for accessing files
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 
+# Where uploads and outputs are published; outputs are always produced locally first
+storage = create_storage({UPLOADS_PREFIX: UPLOAD_DIR, OUTPUTS_PREFIX: OUTPUT_DIR}, BASE_URL)
+
+# Output keys known to be in the object store, so repeat hits skip the lookup
+PUBLISHED_CACHE_SIZE = 10000
+published_outputs: "OrderedDict[str, None]" = OrderedDict()
+
+# State shared with the other worker processes under start_server.py, None when running alone
+shared_store = open_shared_store()
+
+# Responses remembered per Idempotency-Key so retried requests are not synthesized twice
+idempotency = IdempotencyStore(shared_store if shared_store is not None else SharedStore(IDEMPOTENCY_DB))
+
+# Sharded layout, access index and janitor for the local directories
+retention_policies = {
+    OUTPUTS_PREFIX: RetentionPolicy("outputs", OUTPUT_DIR, OUTPUT_MAX_BYTES, OUTPUT_TTL),
+    UPLOADS_PREFIX: RetentionPolicy("uploads", UPLOAD_DIR, UPLOAD_MAX_BYTES, UPLOAD_TTL),
+}
+if shared_store is not None:
+    retention = SharedRetentionManager(shared_store, retention_policies)
+else:
+    retention = RetentionManager(retention_policies)
+
+# Resumable uploads in progress, and how often uploads turned out to be files already stored
+upload_sessions = UploadSessions()
+upload_stats = {"stored": 0, "deduplicated": 0}
+
+# Content-addressed cache of synthesized outputs; retention owns eviction
+synthesis_cache = SynthesisCache(OUTPUT_DIR, max_bytes=0, max_age=0,
+                                 shared=shared_store is not None) if CACHE_ENABLED else None
+
+# Recently generated clips kept in memory for the fetch that follows generation
+hot_audio = HotAudioCache()
+
+
+
+def forget_removed_file(prefix: str, filename: str):
+    """Drop in-memory references to a file the janitor removed"""
+    if prefix != OUTPUTS_PREFIX:
+        return
+    hot_audio.discard(filename)
+    if synthesis_cache is not None:
+        synthesis_cache.discard(filename)
+
+
+retention.on_evict(forget_removed_file)
+
+# Synthesis backends /tts can route to, each balanced across its own instances
+synthesis_backends = create_backends()
+GEMINI_BACKEND = gemini_backends.adapter.name
+
+# Identical requests in flight share one upstream call
+inflight_synthesis = SingleFlight()
+
+# Transcripts by the content hash of their audio, and transcriptions in flight
+transcript_cache = TranscriptCache(shared_store if shared_store is not None else SharedStore(STT_CACHE_DB))
+inflight_transcripts = SingleFlight()
+
+# Media types for streamed audio
+STREAM_MEDIA_TYPES = {
+    "wav": "audio/wav",
+    "pcm": "audio/L16;rate=24000;channels=1",
+}
+STREAM_READ_CHUNK = 64 * 1024
+
+# Batch synthesis limits
+TTS_BATCH_MAX_ITEMS = int(os.getenv("TTS_BATCH_MAX_ITEMS", "500"))
+TTS_BATCH_CONCURRENCY = int(os.getenv("TTS_BATCH_CONCURRENCY", "8"))
+
+# Per-turn multi-speaker synthesis
+MULTI_SPEAKER_TURN_GAP_MS = int(os.getenv("MULTI_SPEAKER_TURN_GAP_MS", "300"))  # Default silence between turns
+MULTI_SPEAKER_MAX_GAP_MS = 5000
+MULTI_SPEAKER_TURN_CONCURRENCY = int(os.getenv("MULTI_SPEAKER_TURN_CONCURRENCY", "8"))
+
+# Keep references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+# Per-process component counters for /metrics under multi-process serving
+snapshot_publisher = SnapshotPublisher()
+
 
 async def verify_api_key(authorization: str = Header(None)):
-    if not authorization:
-        logger.warning("No API key provided")
-        raise HTTPException(status_code=401, detail="API key is missing")
+    with stage("auth"):
+        if not authorization:
+            logger.warning("No API key provided")
+            raise HTTPException(status_code=401, detail="API key is missing")
 
-    if authorization.startswith("Bearer "):
-        token = authorization.replace("Bearer ", "")
-    else:
-        token = authorization
+        if authorization.startswith("Bearer "):
+            token = authorization.replace("Bearer ", "")
+        else:
+            token = authorization
 
-    if token != API_KEY:
-        logger.warning(f"Invalid API key provided: {token}, expected: {API_KEY}")
-        raise HTTPException(status_code=401, detail="Invalid API key")
+        # Neither the key given nor the one expected is logged
+        if token != API_KEY:
+            logger.warning("Invalid API key provided")
+            raise HTTPException(status_code=401, detail="Invalid API key")
 
-    return token
+        return token
 
 
 @asynccontextmanager
@@ -69,9 +200,28 @@ async def lifespan(app: FastAPI):
         logger.error(f"Error during startup: {e}")
         raise
 
+    await job_manager.start()
+    await retention.start()
+    await idempotency.start()
+    await upload_sessions.start()
+    await transcript_cache.start()
+    for backend in synthesis_backends.values():
+        await backend.pool.start()
+    await snapshot_publisher.start()
+
     yield
 
     logger.info("Shutting down Gemini TTS API")
+    await snapshot_publisher.stop()
+    for backend in synthesis_backends.values():
+        await backend.pool.stop()
+    await transcript_cache.stop()
+    await upload_sessions.stop()
+    await idempotency.stop()
+    await retention.stop()
+    await job_manager.stop()
+    await close_http_client()
+    shutdown_executor()
 
 app = FastAPI(title="Voice API", lifespan=lifespan)
 
@@ -82,102 +232,433 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Audio-Key", "X-Audio-Url", "Idempotent-Replayed", "Upload-Offset",
+                    "X-Request-ID"],
 )
 
-# Mount static files for serving audio files
-app.mount("/files", StaticFiles(directory=".", html=True), name="files")
+# Request latency and in-flight gauges for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Trace ids and span timings; outermost, so the trace covers the whole request
+app.add_middleware(TracingMiddleware)
 
 # Get all available voices from Gemini API
 AVAILABLE_VOICES = get_all_voices()
 
 
-class TextToSpeechRequest(BaseModel):
+AudioFormat = Literal["wav", "mp3", "opus", "flac"]
+
+
+class PostProcessingOptions(BaseModel):
+    sample_rate: Optional[int] = None  # Resample to e.g. 44100 or 48000
+    loudness: Optional[float] = None  # Target gated RMS loudness in dBFS, e.g. -20
+    trim_silence: bool = False  # Cut leading and trailing silence
+    peak_limit: Optional[float] = None  # Peak ceiling in dBFS, e.g. -1
+
+class OutputFormatOptions(BaseModel):
+    format: AudioFormat = "wav"
+    bitrate: Optional[str] = None  # e.g. "64k", MP3 and Opus only
+    quality: Optional[int] = None  # Encoder quality/compression level
+    post_processing: Optional[PostProcessingOptions] = None  # Applied before encoding
+
+class TextToSpeechRequest(OutputFormatOptions):
     text: str
     voice: str
+    backend: str = "gemini"  # One of the configured synthesis backends, see SYNTHESIS_BACKENDS
+
+class BatchTextToSpeechRequest(BaseModel):
+    items: List[TextToSpeechRequest]
+    stream: bool = False  # Return NDJSON results as they complete
 
 class SpeechToTextRequest(BaseModel):
     audio_key: str
+    language: Optional[str] = None  # Hint of the spoken language, e.g. "English"
+    stream: bool = False  # Return NDJSON segments as windows complete
 
-class MultiSpeakerRequest(BaseModel):
+class MultiSpeakerRequest(OutputFormatOptions):
     text: str
     speakers: Dict[str, str]  # Map of speaker name to voice name
+    mode: Literal["single", "turns"] = "single"  # "turns" synthesizes each speaker turn separately
+    turn_gap_ms: Optional[int] = None  # Silence between turns in "turns" mode
 
+class JobRequest(BaseModel):
+    type: Literal["tts", "multi-speaker"]
+    request: Dict[str, Any]  # Body of the corresponding endpoint
+    priority: Literal["high", "normal", "low"] = "normal"
 
-@app.post("/upload", dependencies=[Depends(verify_api_key)])
-async def upload_audio(file: UploadFile = File(...)):
-    """Upload an audio file and return a key for later reference"""
-    try:
-        # Generate a unique filename
-        audio_id = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1] if file.filename else ".wav"
-        filename = f"{audio_id}{file_extension}"
 
-        # Create full path
-        upload_path = UPLOAD_DIR / filename
+def output_path(output_filename: str, create: bool = False) -> Path:
+    """Return the sharded local path of an output file"""
+    return retention.path_for(OUTPUTS_PREFIX, output_filename, create)
 
-        # Save the file
-        with open(upload_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
 
-        # Return the key that can be used for voice conversion
-        s3_key = f"{UPLOADS_PREFIX}/{filename}"
+def output_response(output_filename: str) -> Dict[str, str]:
+    """Build the audio URL / key pair returned for an output file"""
+    return {
+        "audio_url": f"{BASE_URL}/audio/{output_filename}",
+        "s3_key": f"{OUTPUTS_PREFIX}/{output_filename}"
+    }
 
-        return {
-            "s3_key": s3_key
-        }
+
+async def publish_output(output_filename: str) -> Dict[str, str]:
+    """
+    Return the response for an output, uploading it to object storage if needed
+
+    With a storage backend that hands out direct URLs, the audio_url is a
+    presigned URL so clients download without going through the API.
+    """
+    response = output_response(output_filename)
+    if not storage.direct_urls:
+        return response
+
+    key = response["s3_key"]
+    if key in published_outputs:
+        published_outputs.move_to_end(key)
+    else:
+        if not await storage.exists(key):
+            await storage.put_file(key, output_path(output_filename), media_type_for(output_filename))
+        published_outputs[key] = None
+        if len(published_outputs) > PUBLISHED_CACHE_SIZE:
+            published_outputs.popitem(last=False)
+    response["audio_url"] = await storage.url_for(key)
+    return response
+
+
+def validate_output_format(request: OutputFormatOptions):
+    """Reject unsupported encoding and post-processing options before doing any work"""
+    try:
+        validate_options(request.format, request.bitrate, request.quality)
+        if request.post_processing is not None:
+            options = request.post_processing
+            validate_processing(options.sample_rate, options.loudness, options.peak_limit)
+    except (EncodingError, ProcessingError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def encoded_output(response: Dict[str, str], request: OutputFormatOptions,
+                         publish: bool = True) -> Dict[str, str]:
+    """
+    Return the response for the requested output format
+
+    Post-processed and compressed variants are rendered once next to the WAV
+    source and reused by later requests. Unless publish is False the result
+    is published to storage.
+    """
+    source_filename = response["s3_key"].split("/")[-1]
+    if request.post_processing is not None:
+        options = request.post_processing
+        try:
+            with stage("post_process"):
+                processed_path = await process_variant(output_path(source_filename), options.sample_rate,
+                                                       options.loudness, options.trim_silence, options.peak_limit)
+            retention.add_path(OUTPUTS_PREFIX, processed_path)
+        except ProcessingError as e:
+            logger.error(f"Error post-processing {source_filename}: {e}")
+            raise HTTPException(status_code=500, detail="Error post-processing audio")
+        source_filename = processed_path.name
+
+    if request.format == "wav":
+        return await publish_output(source_filename) if publish else output_response(source_filename)
+
+    try:
+        with stage("encode"):
+            variant_path = await encode_variant(output_path(source_filename), request.format,
+                                                request.bitrate, request.quality)
+        retention.add_path(OUTPUTS_PREFIX, variant_path)
+    except EncodingError as e:
+        logger.error(f"Error encoding {source_filename} as {request.format}: {e}")
+        raise HTTPException(status_code=500, detail="Error encoding audio")
+    return await publish_output(variant_path.name) if publish else output_response(variant_path.name)
+
+
+async def run_idempotent(key: Optional[str], endpoint: str, request: BaseModel,
+                         synthesize: Callable[[], Awaitable[Dict[str, str]]],
+                         http_response: Response) -> Dict[str, str]:
+    """
+    Synthesize once per Idempotency-Key, replaying the stored response for repeats
+
+    Replays are marked with an Idempotent-Replayed header. A stored response
+    whose local file has since been removed is dropped and synthesized again.
+
+    Raises:
+        HTTPException: 400 for a malformed key, 422 if the key was used with a
+            different request
+    """
+    if key is None:
+        return await synthesize()
+    if not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400,
+                            detail=f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+
+    fingerprint = request_fingerprint(endpoint, request.model_dump_json())
+    try:
+        response, replayed = await idempotency.run(key, fingerprint, synthesize)
+        filename = response["s3_key"].split("/")[-1]
+        if replayed and not storage.direct_urls and not output_path(filename).exists():
+            logger.info(f"Output for idempotency key {key} is gone, synthesizing again")
+            await idempotency.forget(key)
+            response, replayed = await idempotency.run(key, fingerprint, synthesize)
+    except IdempotencyConflictError:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+
+    if replayed:
+        http_response.headers["Idempotent-Replayed"] = "true"
+        if storage.direct_urls:
+            # The stored presigned URL may have expired
+            response = await publish_output(response["s3_key"].split("/")[-1])
+    return response
+
+
+def cached_output(cache_key: str):
+    """Return the response for a cached output, or None on a miss"""
+    if synthesis_cache is None:
+        return None
+    with stage("cache_lookup"):
+        entry = synthesis_cache.get(cache_key)
+    if entry is None:
+        return None
+    if detail_enabled():
+        logger.info(f"Synthesis cache hit: {entry.filename}")
+    retention.touch(OUTPUTS_PREFIX, entry.filename)
+    return output_response(entry.filename)
+
+
+def output_filename_for(cache_key: str) -> str:
+    """Return the output filename for a request"""
+    if synthesis_cache is None:
+        return f"{uuid.uuid4()}.wav"
+    return synthesis_cache.filename_for(cache_key)
+
+
+def temporary_path_for(output_path: Path) -> Path:
+    """Return a unique temporary path next to an output file"""
+    return output_path.with_name(f"{output_path.name}.{uuid.uuid4().hex}.tmp")
+
+
+def commit_output(tmp_path: Path, output_filename: str, cache_key: str, size: int):
+    """Move a finished temporary file into place and register it in the cache"""
+    path = output_path(output_filename)
+    os.replace(tmp_path, path)
+    retention.add(OUTPUTS_PREFIX, output_filename, size)
+    hot_audio.load(path)
+
+    if synthesis_cache is not None:
+        synthesis_cache.put(cache_key, size)
+
+    if detail_enabled():
+        logger.info(f"Saved audio file to: {path}")
+
+
+def upstream_unavailable(error: UpstreamUnavailableError) -> HTTPException:
+    """Map an upstream quota/circuit error to a 503 the client can retry"""
+    logger.warning(f"Upstream unavailable: {error} (retry after {error.retry_after:.1f}s)")
+    return HTTPException(
+        status_code=503,
+        detail=f"Speech synthesis temporarily unavailable: {error}",
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+    )
+
+
+async def generate_output(generate: Callable[[Path], Awaitable[Optional[int]]], cache_key: str) -> Optional[str]:
+    """
+    Generate audio into the output directory and return its filename
+
+    The generator writes to a temporary file so readers never see a partial
+    output; None is returned if generation failed.
+
+    Raises:
+        HTTPException: 503 with Retry-After if the upstream is over quota or down
+    """
+    output_filename = output_filename_for(cache_key)
+    tmp_path = temporary_path_for(output_path(output_filename, create=True))
+    try:
+        size = await generate(tmp_path)
+        if not size:
+            return None
+        await run_in_threadpool(commit_output, tmp_path, output_filename, cache_key, size)
+        return output_filename
+    except UpstreamUnavailableError as e:
+        raise upstream_unavailable(e)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+# Room for the multipart boundaries and part headers around a file of the maximum size
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def upload_error(e: UploadError) -> HTTPException:
+    if isinstance(e, UploadTooLargeError):
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, UploadNotFoundError):
+        return HTTPException(status_code=404, detail="Upload not found")
+    if isinstance(e, UploadOffsetError):
+        return HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    return HTTPException(status_code=400, detail=str(e))
+
+
+def check_content_length(request: Request, limit: int):
+    """Refuse a body that declares itself too large before reading any of it"""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_FILE_BYTES} bytes")
+
+
+async def store_upload(upload: ReceivedUpload) -> str:
+    """Publish a received upload under its content hash and return its key"""
+    filename = upload.filename
+    s3_key = f"{UPLOADS_PREFIX}/{filename}"
+    content_type = upload.content_type if (upload.content_type or "").startswith("audio/") \
+        else media_type_for(filename)
+    try:
+        if await storage.exists(s3_key):
+            # The same audio was uploaded before; share its object rather than storing a copy
+            upload_stats["deduplicated"] += 1
+            if not storage.direct_urls:
+                retention.touch(UPLOADS_PREFIX, filename)
+        else:
+            await storage.put_file(s3_key, upload.path, content_type, move=True)
+            upload_stats["stored"] += 1
+            if not storage.direct_urls:
+                retention.add_path(UPLOADS_PREFIX, retention.path_for(UPLOADS_PREFIX, filename))
+    finally:
+        upload.path.unlink(missing_ok=True)
+    return s3_key
+
+
+@app.post("/upload", dependencies=[Depends(verify_api_key)])
+async def upload_audio(request: Request, filename: Optional[str] = None):
+    """
+    Upload an audio file and return a key for later reference
+
+    The file is either the ``file`` field of a multipart form or the raw
+    request body, named by ?filename= or typed by its Content-Type. It is
+    streamed to disk and stored under its SHA-256, so uploading the same
+    audio again returns the same key. Files over UPLOAD_MAX_FILE_BYTES are
+    refused. Large files are better sent through the resumable /uploads API,
+    which survives interrupted connections.
+    """
+    content_type = request.headers.get("content-type", "")
+    multipart = content_type.startswith("multipart/form-data")
+    check_content_length(request, UPLOAD_MAX_FILE_BYTES + (MULTIPART_OVERHEAD if multipart else 0))
+    try:
+        with stage("upload_receive"):
+            if multipart:
+                reader = MultipartFileReader(request.stream(), content_type)
+                upload = await receive_upload(reader.chunks(), UPLOAD_DIR)
+                upload.extension = upload_extension(reader.filename, reader.content_type)
+                upload.content_type = reader.content_type
+            else:
+                upload = await receive_upload(request.stream(), UPLOAD_DIR)
+                upload.extension = upload_extension(filename, content_type)
+                upload.content_type = content_type
+        with stage("upload_store"):
+            s3_key = await store_upload(upload)
+    except UploadError as e:
+        raise upload_error(e)
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
         raise HTTPException(status_code=500, detail="Error uploading file")
 
+    return {
+        "s3_key": s3_key
+    }
 
-@app.post("/tts", dependencies=[Depends(verify_api_key)])
-async def text_to_speech(request: TextToSpeechRequest):
-    """Convert text to speech using Gemini TTS"""
-    try:
-        logger.info(f"Received TTS request - Text: '{request.text[:50]}...', Voice: '{request.voice}'")
 
-        # Validate voice
-        if request.voice not in AVAILABLE_VOICES:
-            logger.error(f"Voice '{request.voice}' not in available voices: {list(AVAILABLE_VOICES.keys())}")
-            raise HTTPException(
-                status_code=400,
-                detail=f"Voice not supported. Choose from: {', '.join(AVAILABLE_VOICES.keys())}"
-            )
+class UploadSessionRequest(BaseModel):
+    length: int  # Total size of the file in bytes
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
 
-        logger.info(f"Converting text to speech using voice: {request.voice}")
 
-        # Generate audio using Gemini TTS
-        audio_data = generate_tts(request.text, request.voice)
+@app.post("/uploads", status_code=201, dependencies=[Depends(verify_api_key)])
+async def create_upload_session(request: UploadSessionRequest):
+    """
+    Start a resumable upload
 
-        if not audio_data:
-            logger.error("generate_tts returned None - check Gemini API logs")
-            raise HTTPException(status_code=500, detail="Failed to generate audio")
+    Send the file's bytes with PATCH /uploads/{upload_id}, each request
+    carrying the offset it starts at in an Upload-Offset header. After an
+    interruption, GET /uploads/{upload_id} tells where to resume. The request
+    that brings the upload to its full length stores it and returns its
+    ``s3_key``.
+    """
+    try:
+        return await asyncio.to_thread(upload_sessions.create, request.length, request.filename,
+                                       request.content_type)
+    except UploadError as e:
+        raise upload_error(e)
 
-        logger.info(f"Generated audio data of size: {len(audio_data)} bytes")
 
-        # Generate a unique filename for output
-        audio_id = str(uuid.uuid4())
-        output_filename = f"{audio_id}.wav"
-        output_path = OUTPUT_DIR / output_filename
+@app.get("/uploads/{upload_id}", dependencies=[Depends(verify_api_key)])
+async def get_upload_session(upload_id: str, http_response: Response):
+    """Get how many bytes of a resumable upload have arrived, and its key once stored"""
+    try:
+        status = await asyncio.to_thread(upload_sessions.status, upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    http_response.headers["Upload-Offset"] = str(status["offset"])
+    return status
+
+
+@app.patch("/uploads/{upload_id}", dependencies=[Depends(verify_api_key)])
+async def append_upload_session(upload_id: str, request: Request, http_response: Response,
+                                upload_offset: int = Header(...)):
+    """Append the request body to a resumable upload at Upload-Offset"""
+    check_content_length(request, UPLOAD_MAX_FILE_BYTES)
+    try:
+        with stage("upload_receive"):
+            status = await upload_sessions.append(upload_id, upload_offset, request.stream())
+        if status["offset"] == status["length"] and "s3_key" not in status:
+            upload = await upload_sessions.complete(upload_id)
+            try:
+                with stage("upload_store"):
+                    s3_key = await store_upload(upload)
+            except Exception:
+                # The received bytes went with the failed attempt; the client starts over
+                await asyncio.to_thread(upload_sessions.discard, upload_id)
+                raise
+            status = await asyncio.to_thread(upload_sessions.stored, upload_id, s3_key)
+    except UploadError as e:
+        raise upload_error(e)
+    except Exception as e:
+        logger.error(f"Error uploading file: {e}")
+        raise HTTPException(status_code=500, detail="Error uploading file")
+    http_response.headers["Upload-Offset"] = str(status["offset"])
+    return status
 
-        # Save the audio data to a file
-        with open(output_path, "wb") as f:
-            f.write(audio_data)
 
-        logger.info(f"Saved audio file to: {output_path}")
+@app.delete("/uploads/{upload_id}", status_code=204, dependencies=[Depends(verify_api_key)])
+async def delete_upload_session(upload_id: str):
+    """Abandon a resumable upload"""
+    try:
+        await asyncio.to_thread(upload_sessions.discard, upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    return Response(status_code=204)
 
-        # Create a key for the output file (similar to S3 key format)
-        output_key = f"{OUTPUTS_PREFIX}/{output_filename}"
 
-        # Generate a URL for accessing the file using the new audio endpoint
-        file_url = f"{BASE_URL}/audio/{output_filename}"
+@app.post("/tts", dependencies=[Depends(verify_api_key)])
+async def text_to_speech(request: TextToSpeechRequest, http_response: Response,
+                         idempotency_key: Optional[str] = Header(None)):
+    """
+    Convert text to speech using Gemini TTS, or another configured backend
+
+    With an Idempotency-Key header, repeats of the request return the first
+    response instead of synthesizing again.
+    """
+    try:
+        if detail_enabled():
+            logger.info(f"Received TTS request - {len(request.text)} characters, Voice: '{request.voice}'")
 
-        logger.info(f"Returning audio URL: {file_url}")
+        validate_tts_request(request)
 
-        return {
-            "audio_url": file_url,
-            "s3_key": output_key
-        }
+        response = await run_idempotent(idempotency_key, "/tts", request, lambda: synthesize_speech(request),
+                                        http_response)
+
+        if detail_enabled():
+            logger.info(f"Returning audio URL: {response['audio_url']}")
+
+        return response
     except HTTPException:
         raise
     except Exception as e:
@@ -185,50 +666,617 @@ async def text_to_speech(request: TextToSpeechRequest):
         raise HTTPException(status_code=500, detail=f"Error in text-to-speech conversion: {str(e)}")
 
 
-@app.post("/multi-speaker", dependencies=[Depends(verify_api_key)])
-async def multi_speaker_tts(request: MultiSpeakerRequest):
-    """Convert text to multi-speaker speech using Gemini TTS"""
-    try:
-        # Validate voices
-        for speaker, voice in request.speakers.items():
-            if voice not in AVAILABLE_VOICES:
+def validate_tts_request(request: TextToSpeechRequest):
+    """Reject unknown backends, unsupported voices and output options with a 400"""
+    with stage("voice_validation"):
+        validate_backend(request.backend)
+        if request.backend == GEMINI_BACKEND:
+            if request.voice not in AVAILABLE_VOICES:
+                logger.error(f"Voice '{request.voice}' not in available voices: {list(AVAILABLE_VOICES.keys())}")
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Voice '{voice}' for speaker '{speaker}' not supported. Choose from: {', '.join(AVAILABLE_VOICES.keys())}"
+                    detail=f"Voice not supported. Choose from: {', '.join(AVAILABLE_VOICES.keys())}"
                 )
+            # Only known voices become label values
+            set_request_labels(voice=request.voice)
+        validate_output_format(request)
 
-        logger.info(f"Converting text to multi-speaker speech")
 
-        # Generate audio using Gemini TTS
-        audio_data = generate_multi_speaker_tts(request.text, request.speakers)
+def validate_backend(backend: str):
+    if backend not in synthesis_backends:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Backend not available. Choose from: {', '.join(synthesis_backends)}"
+        )
 
-        if not audio_data:
-            raise HTTPException(status_code=500, detail="Failed to generate audio")
 
-        # Generate a unique filename for output
-        audio_id = str(uuid.uuid4())
-        output_filename = f"{audio_id}.wav"
-        output_path = OUTPUT_DIR / output_filename
+def synthesis_model(backend: str) -> str:
+    """Model part of the cache key of a backend's output"""
+    return GEMINI_TTS_MODEL if backend == GEMINI_BACKEND else backend
+
+
+async def synthesize_speech(request: TextToSpeechRequest, publish: bool = True) -> Dict[str, str]:
+    """
+    Synthesize a validated TTS request, serving it from the cache when possible
+
+    Args:
+        request: The validated request
+        publish: Publish the output to storage; internal callers that only
+            need the local file can skip it
+
+    Raises:
+        HTTPException: If the upstream failed to generate audio
+    """
+    if request.backend == GEMINI_BACKEND:
+        set_request_labels(voice=request.voice)
+    cache_key = make_cache_key("tts", request.text, synthesis_model(request.backend), voice=request.voice)
+    cached = cached_output(cache_key)
+    if cached:
+        return await encoded_output(cached, request, publish)
+
+    if detail_enabled():
+        logger.info(f"Converting text to speech using {request.backend} voice: {request.voice}")
+
+    # Generate audio on the requested backend, decoding straight to disk
+    backend = synthesis_backends[request.backend]
+    output_filename = await inflight_synthesis.do(cache_key, lambda: generate_output(
+        lambda path: synthesize_to_file_async(backend, request.text, request.voice, path), cache_key
+    ))
+
+    if not output_filename:
+        logger.error(f"{request.backend} synthesis returned no audio - check the backend logs")
+        raise HTTPException(status_code=500, detail="Failed to generate audio")
+
+    return await encoded_output(output_response(output_filename), request, publish)
+
+
+async def synthesize_batch_item(index: int, item: TextToSpeechRequest, semaphore: asyncio.Semaphore) -> Dict:
+    """Synthesize one batch item, reporting failure in the result instead of raising"""
+    async with semaphore:
+        try:
+            return {"index": index, **await synthesize_speech(item)}
+        except HTTPException as e:
+            return {"index": index, "error": e.detail}
+        except Exception as e:
+            logger.error(f"Error in batch item {index}: {e}", exc_info=True)
+            return {"index": index, "error": f"Error in text-to-speech conversion: {str(e)}"}
+
+
+@app.post("/tts/batch", dependencies=[Depends(verify_api_key)])
+async def text_to_speech_batch(request: BatchTextToSpeechRequest):
+    """
+    Convert a batch of texts to speech
+
+    Items run concurrently up to TTS_BATCH_CONCURRENCY and each one reports its
+    own audio_url/s3_key or error. With stream=true the results are sent as
+    NDJSON lines in completion order, otherwise as a list in request order.
+    """
+    if len(request.items) > TTS_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch too large. Maximum is {TTS_BATCH_MAX_ITEMS} items")
+
+    # Validate every backend and voice before doing any work
+    for item in request.items:
+        validate_backend(item.backend)
+    invalid = [i for i, item in enumerate(request.items)
+               if item.backend == GEMINI_BACKEND and item.voice not in AVAILABLE_VOICES]
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Voice not supported for items {invalid}. Choose from: {', '.join(AVAILABLE_VOICES.keys())}"
+        )
+    for item in request.items:
+        validate_output_format(item)
 
-        # Save the audio data to a file
-        with open(output_path, "wb") as f:
-            f.write(audio_data)
+    logger.info(f"Received TTS batch of {len(request.items)} items")
+    semaphore = asyncio.Semaphore(TTS_BATCH_CONCURRENCY)
+    tasks = [asyncio.ensure_future(synthesize_batch_item(i, item, semaphore)) for i, item in enumerate(request.items)]
 
-        # Create a key for the output file (similar to S3 key format)
-        output_key = f"{OUTPUTS_PREFIX}/{output_filename}"
+    if not request.stream:
+        return {"results": await asyncio.gather(*tasks)}
 
-        # Generate a URL for accessing the file using the new audio endpoint
-        file_url = f"{BASE_URL}/audio/{output_filename}"
+    async def results():
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield json.dumps(await next_result) + "\n"
+        finally:
+            # Client went away; stop the remaining items
+            for task in tasks:
+                task.cancel()
 
-        return {
-            "audio_url": file_url,
-            "s3_key": output_key
-        }
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+def parse_file_key(file_key: str):
+    """Split a storage key into its prefix and filename"""
+    prefix, _, filename = file_key.rpartition("/")
+    if prefix not in (UPLOADS_PREFIX, OUTPUTS_PREFIX) or not filename:
+        raise HTTPException(status_code=400, detail="Invalid file key format")
+    return prefix, filename
+
+
+@asynccontextmanager
+async def local_file(file_key: str) -> AsyncIterator[Path]:
+    """Provide a stored file on local disk, downloading it from the object store if needed"""
+    prefix, filename = parse_file_key(file_key)
+    try:
+        path = retention.path_for(prefix, filename)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid file key format")
+    if path.is_file():
+        retention.touch(prefix, filename)
+        yield path
+        return
+
+    if not storage.direct_urls or not await storage.exists(file_key):
+        raise HTTPException(status_code=404, detail="File not found")
+    tmp_path = UPLOAD_DIR / f"{uuid.uuid4().hex}.download.tmp"
+    try:
+        await storage.get_file(file_key, tmp_path)
+        yield tmp_path
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def cached_transcript_events(transcript: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [*({"type": "segment", **segment} for segment in transcript["segments"]),
+            {"type": "transcript", **transcript, "cached": True}]
+
+
+async def transcribe_file(audio_key: str, language: Optional[str]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Transcribe a stored file, yielding each segment and then the whole transcript
+
+    Content-addressed uploads are looked up in the transcript cache by name,
+    before the file is even opened; other files are hashed first.
+    """
+    prefix, filename = parse_file_key(audio_key)
+    audio_hash = content_hash_of(filename) if prefix == UPLOADS_PREFIX else None
+    if audio_hash is not None:
+        transcript = await transcript_cache.get(make_transcript_key(audio_hash, GEMINI_STT_MODEL, language))
+        if transcript is not None:
+            for event in cached_transcript_events(transcript):
+                yield event
+            return
+
+    async with local_file(audio_key) as path:
+        if audio_hash is None:
+            audio_hash = await run_in_threadpool(hash_file, path)
+            transcript = await transcript_cache.get(make_transcript_key(audio_hash, GEMINI_STT_MODEL, language))
+            if transcript is not None:
+                for event in cached_transcript_events(transcript):
+                    yield event
+                return
+
+        pcm_path = UPLOAD_DIR / f"{uuid.uuid4().hex}.stt.tmp"
+        try:
+            with stage("stt_decode"):
+                size = await decode_to_pcm(path, pcm_path, STT_SAMPLE_RATE)
+            if size < 2:
+                raise EncodingError("The file contains no audio")
+
+            segments = []
+            async for segment in transcribe_windows(
+                    pcm_path, lambda pcm: transcribe_pcm_async(pcm, STT_SAMPLE_RATE, language)):
+                segments.append(segment)
+                yield {"type": "segment", **segment}
+        finally:
+            pcm_path.unlink(missing_ok=True)
+
+    transcript = {
+        "text": join_segments(segments),
+        "duration": round(size / 2 / STT_SAMPLE_RATE, 3),
+        "model": GEMINI_STT_MODEL,
+        "segments": segments,
+    }
+    await transcript_cache.put(make_transcript_key(audio_hash, GEMINI_STT_MODEL, language), transcript)
+    yield {"type": "transcript", **transcript, "cached": False}
+
+
+def transcription_error(error: Exception) -> HTTPException:
+    if isinstance(error, HTTPException):
+        return error
+    if isinstance(error, UpstreamUnavailableError):
+        return upstream_unavailable(error)
+    if isinstance(error, EncodingError):
+        return HTTPException(status_code=400, detail=f"Could not decode audio: {error}")
+    logger.error(f"Error transcribing audio: {error}")
+    return HTTPException(status_code=500, detail="Failed to transcribe audio")
+
+
+@app.post("/stt", dependencies=[Depends(verify_api_key)])
+async def speech_to_text(request: SpeechToTextRequest):
+    """
+    Transcribe a stored audio file
+
+    ``audio_key`` is a key returned by /upload or a synthesis endpoint. Long
+    audio is split into overlapping windows of STT_WINDOW_SECONDS that are
+    transcribed concurrently within the upstream quota, then merged into one
+    transcript with the start and end of each segment in seconds.
+    Transcripts are cached by the content hash of the audio. With
+    stream=true the segments are sent as NDJSON lines as soon as they are
+    ready, followed by the complete transcript.
+    """
+    parse_file_key(request.audio_key)
+
+    if not request.stream:
+        async def collect() -> Dict[str, Any]:
+            async for event in transcribe_file(request.audio_key, request.language):
+                if event["type"] == "transcript":
+                    return event
+
+        try:
+            # Identical requests arriving together share one transcription
+            event = await inflight_transcripts.do(f"{request.audio_key}\n{request.language}", collect)
+        except Exception as e:
+            raise transcription_error(e)
+        return {"audio_key": request.audio_key, **{k: v for k, v in event.items() if k != "type"}}
+
+    events = transcribe_file(request.audio_key, request.language)
+    try:
+        # Errors before the first segment, such as a missing file, still get a proper status
+        first = await events.__anext__()
+    except Exception as e:
+        await events.aclose()
+        raise transcription_error(e)
+
+    async def lines():
+        try:
+            yield json.dumps(first) + "\n"
+            async for event in events:
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            error = transcription_error(e)
+            yield json.dumps({"type": "error", "status": error.status_code, "detail": error.detail}) + "\n"
+        finally:
+            # Client went away; stop the remaining windows
+            await events.aclose()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def persist_pcm_stream(chunks: AsyncIterator[bytes], cache_key: str, output_filename: str,
+                             queue: asyncio.Queue):
+    """
+    Write a PCM stream to a WAV output while relaying each chunk through a queue
+
+    Runs independently of the HTTP response so the output is still persisted
+    if the client disconnects. The queue receives PCM chunks, then either None
+    on success or the exception that ended the stream.
+    """
+    tmp_path = temporary_path_for(output_path(output_filename, create=True))
+    try:
+        with WavFileWriter(tmp_path) as writer:
+            async for chunk in chunks:
+                await run_in_threadpool(writer.write, chunk)
+                queue.put_nowait(chunk)
+
+        if writer.data_size == 0:
+            raise RuntimeError("Upstream stream contained no audio")
+
+        await run_in_threadpool(commit_output, tmp_path, output_filename, cache_key, writer.file_size)
+        queue.put_nowait(None)
+    except Exception as e:
+        logger.error(f"Error streaming text-to-speech: {e}")
+        tmp_path.unlink(missing_ok=True)
+        queue.put_nowait(e)
+        return
+
+    try:
+        await publish_output(output_filename)
+    except StorageError as e:
+        logger.error(f"Error publishing streamed output {output_filename}: {e}")
+
+
+async def stream_file(path: Path, offset: int = 0) -> AsyncIterator[bytes]:
+    """Stream a file from disk in fixed-size chunks"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            chunk = await run_in_threadpool(f.read, STREAM_READ_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+@app.post("/tts/stream", dependencies=[Depends(verify_api_key)])
+async def text_to_speech_stream(request: TextToSpeechRequest, format: Literal["wav", "pcm"] = "wav"):
+    """
+    Convert text to speech, streaming audio back while it is synthesized
+
+    The response body is either a WAV header with an open-ended length followed
+    by PCM, or raw 16-bit 24 kHz mono PCM. The output is persisted under the
+    usual key, which is returned in the X-Audio-Key / X-Audio-Url headers.
+    Only the Gemini backend streams.
+    """
+    if request.backend != GEMINI_BACKEND:
+        raise HTTPException(status_code=400, detail=f"Streaming is only available from the {GEMINI_BACKEND} backend")
+    if request.voice not in AVAILABLE_VOICES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Voice not supported. Choose from: {', '.join(AVAILABLE_VOICES.keys())}"
+        )
+
+    cache_key = make_cache_key("tts", request.text, GEMINI_TTS_MODEL, voice=request.voice)
+    cached = cached_output(cache_key)
+    if cached:
+        output_filename = cached["s3_key"].split("/")[-1]
+        cached = await publish_output(output_filename)
+        headers = {"X-Audio-Key": cached["s3_key"], "X-Audio-Url": cached["audio_url"]}
+        offset = 0 if format == "wav" else 44
+        return StreamingResponse(stream_file(output_path(output_filename), offset),
+                                 media_type=STREAM_MEDIA_TYPES[format], headers=headers)
+
+    output_filename = output_filename_for(cache_key)
+    queue: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(persist_pcm_stream(
+        stream_tts_pcm(request.text, request.voice), cache_key, output_filename, queue
+    ))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    # Wait for the first chunk so upstream failures still map to an error status
+    first = await queue.get()
+    if isinstance(first, UpstreamUnavailableError):
+        raise upstream_unavailable(first)
+    if first is None or isinstance(first, Exception):
+        raise HTTPException(status_code=502, detail="Failed to generate audio")
+
+    async def relay():
+        if format == "wav":
+            yield build_wav_header()
+        item = first
+        while item is not None:
+            if isinstance(item, Exception):
+                # Headers are already sent; all we can do is end the body early
+                return
+            yield item
+            item = await queue.get()
+
+    response = output_response(output_filename)
+    if storage.direct_urls:
+        # The object is uploaded once the stream completes; the URL is valid from then on
+        response["audio_url"] = await storage.url_for(response["s3_key"])
+    headers = {"X-Audio-Key": response["s3_key"], "X-Audio-Url": response["audio_url"]}
+    return StreamingResponse(relay(), media_type=STREAM_MEDIA_TYPES[format], headers=headers)
+
+
+async def synthesize_segment_pcm(text: str, voice: str) -> AsyncIterator[bytes]:
+    """Stream PCM for one real-time session segment, from the synthesis cache when it is there"""
+    cached = cached_output(make_cache_key("tts", text, GEMINI_TTS_MODEL, voice=voice))
+    if cached:
+        # Skip the 44 byte WAV header
+        async for chunk in stream_file(output_path(cached["s3_key"].split("/")[-1]), 44):
+            yield chunk
+        return
+    async for chunk in stream_tts_pcm(text, voice):
+        yield chunk
+
+
+@app.websocket("/ws/tts")
+async def text_to_speech_session(websocket: WebSocket, voice: str = "Kore", format: str = "pcm",
+                                 bitrate: Optional[str] = None, window: int = 0):
+    """
+    Real-time TTS session: text fragments in, audio frames out
+
+    Authenticates with the Authorization header or an api_key query parameter
+    (browsers cannot set headers on WebSockets). Send JSON messages of type
+    text, flush, cancel, ack, voice and end; audio comes back as binary
+    frames of raw 16-bit 24 kHz PCM or Ogg Opus, one stream per sentence.
+    See realtime_tts.TtsSession for the protocol.
+    """
+    token = websocket.headers.get("authorization") or websocket.query_params.get("api_key") or ""
+    if token.replace("Bearer ", "", 1) != API_KEY:
+        logger.warning("Rejected WebSocket session with a missing or invalid API key")
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    error = None
+    if voice not in AVAILABLE_VOICES:
+        error = f"Voice not supported. Choose from: {', '.join(AVAILABLE_VOICES.keys())}"
+    elif format != "pcm" and format not in STREAMABLE_FORMATS:
+        error = f"Unsupported format '{format}'. Choose from: pcm, {', '.join(STREAMABLE_FORMATS)}"
+    elif format != "pcm":
+        try:
+            validate_options(format, bitrate)
+        except EncodingError as e:
+            error = str(e)
+    if error is not None:
+        await websocket.send_json({"type": "error", "detail": error})
+        await websocket.close(code=1008)
+        return
+
+    # Have a connection to the upstream open before the first sentence arrives
+    warm_up = asyncio.create_task(gemini_backends.warm_up())
+    background_tasks.add(warm_up)
+    warm_up.add_done_callback(background_tasks.discard)
+
+    session = TtsSession(websocket, synthesize_segment_pcm, AVAILABLE_VOICES, voice, format, bitrate, max(0, window))
+    await session.run()
+
+
+@app.post("/multi-speaker", dependencies=[Depends(verify_api_key)])
+async def multi_speaker_tts(request: MultiSpeakerRequest, http_response: Response,
+                            idempotency_key: Optional[str] = Header(None)):
+    """Convert text to multi-speaker speech using Gemini TTS, honouring an Idempotency-Key header"""
+    try:
+        validate_multi_speaker_request(request)
+        return await run_idempotent(idempotency_key, "/multi-speaker", request,
+                                    lambda: synthesize_multi_speaker(request), http_response)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in multi-speaker conversion: {e}")
         raise HTTPException(status_code=500, detail=f"Error in multi-speaker conversion: {str(e)}")
 
 
+def validate_multi_speaker_request(request: MultiSpeakerRequest):
+    """Reject unsupported voices and output options with a 400"""
+    set_request_labels(voice="multi-speaker")
+    with stage("voice_validation"):
+        for speaker, voice in request.speakers.items():
+            if voice not in AVAILABLE_VOICES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Voice '{voice}' for speaker '{speaker}' not supported. Choose from: {', '.join(AVAILABLE_VOICES.keys())}"
+                )
+        validate_output_format(request)
+
+    if request.mode == "turns":
+        try:
+            split_turns(request.text, request.speakers)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if request.turn_gap_ms is not None and not 0 <= request.turn_gap_ms <= MULTI_SPEAKER_MAX_GAP_MS:
+        raise HTTPException(status_code=400, detail=f"turn_gap_ms must be between 0 and {MULTI_SPEAKER_MAX_GAP_MS}")
+
+
+async def synthesize_multi_speaker(request: MultiSpeakerRequest) -> Dict[str, str]:
+    """
+    Synthesize a validated multi-speaker request, serving it from the cache when possible
+
+    Raises:
+        HTTPException: If the upstream failed to generate audio
+    """
+    if request.mode == "turns":
+        return await synthesize_multi_speaker_turns(request)
+
+    set_request_labels(voice="multi-speaker")
+    cache_key = make_cache_key("multi-speaker", request.text, GEMINI_TTS_MODEL, speakers=request.speakers)
+    cached = cached_output(cache_key)
+    if cached:
+        return await encoded_output(cached, request)
+
+    if detail_enabled():
+        logger.info("Converting text to multi-speaker speech")
+
+    # Generate audio using Gemini TTS, decoding straight to disk
+    output_filename = await inflight_synthesis.do(cache_key, lambda: generate_output(
+        lambda path: generate_multi_speaker_tts_to_file_async(request.text, request.speakers, path), cache_key
+    ))
+
+    if not output_filename:
+        raise HTTPException(status_code=500, detail="Failed to generate audio")
+
+    return await encoded_output(output_response(output_filename), request)
+
+
+async def synthesize_multi_speaker_turns(request: MultiSpeakerRequest) -> Dict[str, str]:
+    """
+    Synthesize a dialogue one speaker turn at a time and join the clips in order
+
+    Turns go through the single-voice path concurrently, so each line is
+    cached on its own and editing one line only re-renders that line.
+
+    Raises:
+        HTTPException: If a turn failed to generate
+    """
+    set_request_labels(voice="multi-speaker")
+    gap_ms = MULTI_SPEAKER_TURN_GAP_MS if request.turn_gap_ms is None else request.turn_gap_ms
+    turns = split_turns(request.text, request.speakers)
+    # Keyed by the parsed turns: the script's line breaks decide how it splits
+    cache_key = make_cache_key("multi-speaker-turns", "", GEMINI_TTS_MODEL, speakers=request.speakers,
+                               turns=[[speaker, normalize_text(text)] for speaker, text in turns], gap_ms=gap_ms)
+    cached = cached_output(cache_key)
+    if cached:
+        return await encoded_output(cached, request)
+
+    if detail_enabled():
+        logger.info(f"Converting {len(turns)} dialogue turns to speech")
+
+    semaphore = asyncio.Semaphore(MULTI_SPEAKER_TURN_CONCURRENCY)
+
+    async def synthesize_turn(speaker: str, text: str) -> Path:
+        async with semaphore:
+            clip = await synthesize_speech(TextToSpeechRequest(text=text, voice=request.speakers[speaker]),
+                                           publish=False)
+        return output_path(clip["s3_key"].split("/")[-1])
+
+    clips = await asyncio.gather(*(synthesize_turn(speaker, text) for speaker, text in turns))
+
+    output_filename = await inflight_synthesis.do(cache_key, lambda: generate_output(
+        lambda path: run_in_threadpool(assemble_wav_files, clips, path, gap_ms, TTS_CHUNK_CROSSFADE_MS), cache_key
+    ))
+
+    if not output_filename:
+        raise HTTPException(status_code=500, detail="Failed to assemble dialogue audio")
+
+    return await encoded_output(output_response(output_filename), request)
+
+
+# Background synthesis jobs, queued in the shared store when several workers serve the API
+job_manager = create_job_manager(
+    {
+        "tts": synthesize_speech,
+        "multi-speaker": synthesize_multi_speaker,
+    },
+    decoders={
+        "tts": TextToSpeechRequest.model_validate_json,
+        "multi-speaker": MultiSpeakerRequest.model_validate_json,
+    },
+    store=shared_store,
+)
+
+# Export component counters alongside the request metrics
+if synthesis_cache is not None:
+    register_snapshot("tts_cache", synthesis_cache.snapshot,
+                      counters=("memory_hits", "disk_hits", "misses", "evictions", "expirations"))
+for prefix, name in ((OUTPUTS_PREFIX, "outputs"), (UPLOADS_PREFIX, "uploads")):
+    register_snapshot(f"retention_{name}", lambda prefix=prefix: retention.snapshot(prefix),
+                      counters=("evictions", "expirations", "tmp_removed"), shared=shared_store is not None)
+register_snapshot("audio_hot", hot_audio.snapshot, counters=("hits", "misses", "evictions"))
+register_snapshot("tts_inflight", inflight_synthesis.snapshot, counters=("leaders", "coalesced"))
+register_snapshot("stt_cache", transcript_cache.snapshot, counters=("hits", "misses"))
+register_snapshot("stt_inflight", inflight_transcripts.snapshot, counters=("leaders", "coalesced"))
+register_snapshot("gemini_governor", lambda: {**upstream_governor.snapshot(),
+                                              "circuit_open": int(upstream_governor.breaker.state != "closed")},
+                  counters=("requests", "retries", "throttled", "rejected", "failures"))
+register_snapshot("tts_jobs", job_manager.snapshot, shared=shared_store is not None)
+register_snapshot("gemini_backends", gemini_backends.snapshot, counters=("ejections", "requests", "failures"))
+for backend_name, backend in synthesis_backends.items():
+    if backend_name != GEMINI_BACKEND:
+        # Prometheus names cannot contain "-"
+        register_snapshot(f"{backend_name.replace('-', '_')}_backends", backend.pool.snapshot,
+                          counters=("ejections", "requests", "failures"))
+register_snapshot("idempotency", idempotency.snapshot, counters=("executed", "replayed", "waited", "conflicts"))
+register_snapshot("uploads", lambda: {**upload_stats, **upload_sessions.snapshot()},
+                  counters=("stored", "deduplicated", "created", "completed", "expired"))
+
+
+@app.post("/jobs", status_code=202, dependencies=[Depends(verify_api_key)])
+async def submit_job(request: JobRequest):
+    """
+    Queue a /tts or /multi-speaker request and return its job id immediately
+
+    Responds 429 with Retry-After when the queue is full.
+    """
+    try:
+        if request.type == "tts":
+            job_request = TextToSpeechRequest(**request.request)
+            validate_tts_request(job_request)
+        else:
+            job_request = MultiSpeakerRequest(**request.request)
+            validate_multi_speaker_request(job_request)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+
+    try:
+        job = await job_manager.submit(request.type, job_request, request.priority)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail="Job queue is full", headers={"Retry-After": str(e.retry_after)})
+
+    return {"job_id": job.id, "status": job.status, "status_url": f"{BASE_URL}/jobs/{job.id}"}
+
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(verify_api_key)])
+async def get_job(job_id: str):
+    """Get the status and, once finished, the result of a job"""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
 @app.get("/voices", dependencies=[Depends(verify_api_key)])
 async def list_voices():
     """Get all available voices with their descriptions"""
@@ -238,66 +1286,163 @@ async def list_voices():
 @app.get("/health", dependencies=[Depends(verify_api_key)])
 async def health_check():
     """Check if the API is healthy"""
-    if os.getenv("GEMINI_API_KEY"):
-        return {"status": "healthy", "api": "ready"}
-    return {"status": "unhealthy", "api": "not configured"}
-
-
-@app.get("/audio/{filename}")
-async def serve_audio_file(filename: str):
-    """Serve audio files with proper CORS headers and MIME type"""
+    upstream = {**upstream_governor.snapshot(), "instances": gemini_backends.instance_status()}
+    backends = {name: backend.pool.instance_status() for name, backend in synthesis_backends.items()
+                if name != GEMINI_BACKEND}
+    if backends:
+        upstream["backends"] = backends
+    if not os.getenv("GEMINI_API_KEY"):
+        return {"status": "unhealthy", "api": "not configured", "upstream": upstream}
+    if upstream["circuit"] != "closed":
+        return {"status": "degraded", "api": "upstream failing", "upstream": upstream}
+    if not gemini_backends.snapshot()["available"]:
+        return {"status": "degraded", "api": "no upstream instance available", "upstream": upstream}
+    return {"status": "healthy", "api": "ready", "upstream": upstream}
+
+
+@app.get("/metrics", dependencies=[Depends(verify_api_key)])
+async def metrics():
+    """Prometheus metrics: per-stage latency, in-flight requests and upstream errors"""
+    return Response(await run_in_threadpool(render_metrics), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+@app.get("/cache/stats", dependencies=[Depends(verify_api_key)])
+async def cache_stats():
+    """Get synthesis cache hit/miss/eviction and request coalescing counters"""
+    # Shared retention stats are SQLite queries
+    retention_stats = await asyncio.to_thread(lambda: {
+        "outputs": retention.snapshot(OUTPUTS_PREFIX),
+        "uploads": retention.snapshot(UPLOADS_PREFIX),
+    })
+    shared = {
+        "inflight": inflight_synthesis.snapshot(),
+        "hot": hot_audio.snapshot(),
+        "retention": retention_stats,
+    }
+    if synthesis_cache is None:
+        return {"enabled": False, **shared}
+    return {"enabled": True, **synthesis_cache.snapshot(), **shared}
+
+
+def load_audio_file(path: Path):
+    """Return a servable description of an output, pulling small files into the hot tier"""
+    return hot_audio.load(path) or stat_audio_file(path)
+
+
+@app.api_route("/audio/{filename}", methods=["GET", "HEAD"])
+async def serve_audio_file(request: Request, filename: str, format: Optional[AudioFormat] = None,
+                           accept: Optional[str] = Header(None)):
+    """
+    Serve audio files with proper CORS headers and MIME type
+
+    A WAV output can be requested in another format with ?format=, or through
+    an Accept header that refuses WAV; the variant is transcoded once and then
+    served from disk.
+    Responses carry a strong ETag and support byte ranges, so seeks and replays
+    only transfer what the player is missing. Recent clips are served from memory.
+    """
     try:
-        # Check if file exists in outputs directory
-        file_path = OUTPUT_DIR / filename
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="Audio file not found")
-
-        # Return the file with proper headers
-        return FileResponse(
-            path=file_path,
-            media_type="audio/wav",
+        with stage("audio_serve"):
+            try:
+                source_path = output_path(filename)
+            except ValueError:
+                raise HTTPException(status_code=404, detail="Audio file not found")
+            file_path = source_path
+            target_format = format or negotiate_format(accept, "wav")
+            if target_format and target_format != "wav" and file_path.suffix == ".wav":
+                file_path = source_path.with_name(variant_filename(filename, target_format))
+
+            audio = hot_audio.get(file_path.name)
+            if audio is None:
+                # The janitor evicts sources and variants separately, so a variant may outlive its WAV
+                variant_on_disk = file_path != source_path and os.path.exists(file_path)
+                # Check if file exists in outputs directory
+                if not variant_on_disk and not os.path.exists(source_path):
+                    key = f"{OUTPUTS_PREFIX}/{filename}"
+                    if storage.direct_urls and await storage.exists(key):
+                        # No local copy left, send the client to the object store
+                        return RedirectResponse(await storage.url_for(key), status_code=307)
+                    raise HTTPException(status_code=404, detail="Audio file not found")
+
+                if file_path != source_path and not variant_on_disk:
+                    try:
+                        with stage("encode"):
+                            file_path = await encode_variant(source_path, target_format)
+                        retention.add_path(OUTPUTS_PREFIX, file_path)
+                    except EncodingError as e:
+                        if format:
+                            raise
+                        # Only negotiated: the stored WAV is still better than no audio
+                        logger.warning(f"Serving {filename} as WAV, encoding {target_format} failed: {e}")
+                        file_path = source_path
+                try:
+                    audio = await run_in_threadpool(load_audio_file, file_path)
+                except FileNotFoundError:
+                    raise HTTPException(status_code=404, detail="Audio file not found")
+
+        retention.touch(OUTPUTS_PREFIX, file_path.name)
+
+        # Sending the body is timed as response_body
+        return audio_response(
+            audio,
+            request.headers,
+            media_type_for(file_path.name),
             headers={
                 "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET",
+                "Access-Control-Allow-Methods": "GET, HEAD",
                 "Access-Control-Allow-Headers": "*",
-                "Cache-Control": "public, max-age=3600"
-            }
+                "Vary": "Accept"
+            },
+            method=request.method,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error serving audio file: {e}")
         raise HTTPException(status_code=500, detail="Error serving audio file")
 
 
-@app.get("/file/{file_key}", dependencies=[Depends(verify_api_key)])
+@app.get("/file/{file_key:path}", dependencies=[Depends(verify_api_key)])
 async def get_file_url(file_key: str):
-    """Get a URL for a file by its key"""
+    """Get a URL for a file by its key (a presigned URL with the S3 backend)"""
     try:
-        if file_key.startswith(UPLOADS_PREFIX):
-            filename = file_key.split("/")[-1]
-            file_path = UPLOAD_DIR / filename
-            prefix = "uploads"
-        elif file_key.startswith(OUTPUTS_PREFIX):
-            filename = file_key.split("/")[-1]
-            file_path = OUTPUT_DIR / filename
-            prefix = "outputs"
-        else:
-            raise HTTPException(status_code=400, detail="Invalid file key format")
+        prefix, filename = parse_file_key(file_key)
 
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="File not found")
+        if prefix == OUTPUTS_PREFIX and storage.direct_urls and output_path(filename).is_file():
+            # Outputs are published lazily; make sure this one is in the bucket
+            return {"url": (await publish_output(filename))["audio_url"], "expires_in": S3_PRESIGN_EXPIRY}
 
-        # Generate a URL for accessing the file
-        file_url = f"{BASE_URL}/files/{prefix}/{filename}"
+        if not await storage.exists(file_key):
+            raise HTTPException(status_code=404, detail="File not found")
 
         return {
-            "url": file_url,
-            "expires_in": 3600  # Simulate S3 presigned URL expiration
+            "url": await storage.url_for(file_key),
+            "expires_in": S3_PRESIGN_EXPIRY
         }
+    except HTTPException:
+        raise
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid file key format")
     except Exception as e:
         logger.error(f"Error getting file URL: {e}")
         raise HTTPException(status_code=500, detail="Error getting file URL")
 
 
+@app.api_route("/files/{prefix}/{filename}", methods=["GET", "HEAD"])
+async def serve_stored_file(request: Request, prefix: str, filename: str):
+    """Serve a file from local storage by key; these are the URLs handed out by the local backend"""
+    if prefix not in (UPLOADS_PREFIX, OUTPUTS_PREFIX):
+        raise HTTPException(status_code=404, detail="File not found")
+    try:
+        audio = await run_in_threadpool(stat_audio_file, retention.path_for(prefix, filename))
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    retention.touch(prefix, filename)
+    return audio_response(audio, request.headers, media_type_for(filename), method=request.method)
+
+
 if __name__ == "__main__":
+    # Single process for development; start_server.py runs several workers
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
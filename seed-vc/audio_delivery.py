@@ -0,0 +1,274 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+# Hot tier of recently generated clips
+AUDIO_HOT_CACHE_BYTES = int(os.getenv("AUDIO_HOT_CACHE_BYTES", str(64 * 1024 * 1024)))  # 64 MiB
+AUDIO_HOT_MAX_FILE = int(os.getenv("AUDIO_HOT_MAX_FILE", str(4 * 1024 * 1024)))  # Larger files stream from disk
+# Outputs never change once written, so clients may keep them for long
+AUDIO_MAX_AGE = int(os.getenv("AUDIO_MAX_AGE", str(24 * 3600)))
+
+# Bytes per read when a file is streamed from disk
+DISK_READ_BLOCK = 256 * 1024
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@dataclass
+class AudioFile:
+    path: Path
+    size: int
+    etag: str
+    last_modified: str
+    data: Optional[bytes] = None  # Set for files held in the hot tier
+
+
+def stat_audio_file(path: Path) -> AudioFile:
+    """
+    Describe a file on disk with its validators
+
+    Outputs are replaced atomically and never modified in place, so inode,
+    mtime and size identify the content and make a strong ETag.
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+    """
+    stat = os.stat(path)
+    return AudioFile(
+        path=Path(path),
+        size=stat.st_size,
+        etag=f'"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+        last_modified=formatdate(stat.st_mtime, usegmt=True),
+    )
+
+
+class HotAudioCache:
+    """
+    Memory-resident LRU of small audio files, bounded by total bytes
+
+    Freshly generated clips are added as they are committed, so the fetch that
+    follows generation is answered from memory.
+    """
+
+    def __init__(self, max_bytes: int = AUDIO_HOT_CACHE_BYTES, max_file: int = AUDIO_HOT_MAX_FILE):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, AudioFile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, name: str) -> Optional[AudioFile]:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(name)
+            self.stats["hits"] += 1
+            return entry
+
+    def load(self, path: Path) -> Optional[AudioFile]:
+        """Read a file into the hot tier if it is small enough (blocking)"""
+        if not self.enabled:
+            return None
+        try:
+            entry = stat_audio_file(path)
+            if entry.size > self.max_file:
+                return None
+            with open(path, "rb") as f:
+                entry.data = f.read()
+        except OSError:
+            return None
+        if len(entry.data) != entry.size:
+            # Replaced while reading; leave it to the next request
+            return None
+
+        with self._lock:
+            previous = self._entries.pop(entry.path.name, None)
+            if previous is not None:
+                self.total_bytes -= previous.size
+            self._entries[entry.path.name] = entry
+            self.total_bytes += entry.size
+            while self.total_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+                self.stats["evictions"] += 1
+        return entry
+
+    def discard(self, name: str):
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self.total_bytes -= entry.size
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "bytes": self.total_bytes}
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single byte range against a file size
+
+    Returns:
+        Inclusive (start, end) offsets, or None to send the whole file (no
+        header, or a multi-range request, which we are allowed to ignore)
+
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    if not header or "," in header:
+        return None
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    elif last:
+        # Suffix range: the final N bytes
+        start = max(0, size - int(last))
+        end = size - 1
+        if int(last) == 0:
+            raise ValueError("Empty suffix range")
+    else:
+        return None
+
+    if start >= size:
+        raise ValueError("Range starts past the end of the file")
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _not_modified(request_headers: Mapping[str, str], audio: AudioFile) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, audio.etag)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(audio.last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class AudioFileResponse(Response):
+    """
+    Send a whole file or one byte range of it
+
+    Bytes come from the hot tier when the file is held there. Otherwise the
+    server's zero-copy send extension is used if it offers one, and large
+    pread() blocks from a worker thread if not.
+    """
+
+    def __init__(self, audio: AudioFile, status_code: int, headers: Dict[str, str],
+                 byte_range: Optional[Tuple[int, int]] = None, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers)
+        self.audio = audio
+        self.start, self.end = byte_range or (0, audio.size - 1)
+        self.send_body = send_body and status_code in (200, 206)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.audio.size == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        count = self.end - self.start + 1
+        if self.audio.data is not None:
+            body = self.audio.data
+            if count != len(body):
+                body = body[self.start:self.end + 1]
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        f = await run_in_threadpool(open, self.audio.path, "rb")
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": f, "offset": self.start, "count": count})
+                return
+
+            offset = self.start
+            remaining = count
+            while remaining > 0:
+                chunk = await run_in_threadpool(os.pread, f.fileno(), min(DISK_READ_BLOCK, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank under us; end the body rather than hang the client
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            f.close()
+
+
+def audio_response(audio: AudioFile, request_headers: Mapping[str, str], media_type: str,
+                   headers: Optional[Dict[str, str]] = None, method: str = "GET") -> Response:
+    """
+    Build the response for an audio file, honouring conditional and range requests
+
+    Args:
+        audio: The file to send
+        request_headers: Incoming request headers
+        media_type: Content type of the file
+        headers: Extra response headers (CORS, Vary, ...)
+        method: GET or HEAD
+
+    Returns:
+        A 200, 206, 304 or 416 response
+    """
+    response_headers = {
+        **(headers or {}),
+        "ETag": audio.etag,
+        "Last-Modified": audio.last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"public, max-age={AUDIO_MAX_AGE}",
+    }
+
+    if _not_modified(request_headers, audio):
+        return Response(status_code=304, headers=response_headers)
+
+    byte_range = None
+    if_range = request_headers.get("if-range")
+    if if_range is None or if_range.strip() == audio.etag:
+        try:
+            byte_range = parse_range(request_headers.get("range"), audio.size)
+        except ValueError:
+            response_headers["Content-Range"] = f"bytes */{audio.size}"
+            return Response(status_code=416, headers=response_headers)
+
+    response_headers["Content-Type"] = media_type
+    send_body = method != "HEAD"
+    if byte_range is None:
+        response_headers["Content-Length"] = str(audio.size)
+        return AudioFileResponse(audio, 200, response_headers, send_body=send_body)
+
+    start, end = byte_range
+    response_headers["Content-Length"] = str(end - start + 1)
+    response_headers["Content-Range"] = f"bytes {start}-{end}/{audio.size}"
+    return AudioFileResponse(audio, 206, response_headers, byte_range, send_body=send_body)
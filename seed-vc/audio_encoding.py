@@ -0,0 +1,358 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import subprocess
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from observability import detail_enabled
+
+logger = logging.getLogger(__name__)
+
+# Encoder configuration
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+ENCODER_WORKERS = int(os.getenv("ENCODER_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+# Supported output formats: media type and file extension
+AUDIO_FORMATS = {
+    "wav": ("audio/wav", ".wav"),
+    "mp3": ("audio/mpeg", ".mp3"),
+    "opus": ("audio/ogg", ".opus"),
+    "flac": ("audio/flac", ".flac"),
+}
+
+# Other names clients use for WAV
+_MEDIA_TYPE_ALIASES = {
+    "audio/x-wav": "audio/wav",
+    "audio/wave": "audio/wav",
+    "audio/vnd.wave": "audio/wav",
+}
+
+DEFAULT_BITRATES = {
+    "mp3": "64k",
+    "opus": "32k",
+}
+
+# Valid quality ranges per format (ffmpeg -q:a for MP3, -compression_level otherwise)
+QUALITY_RANGES = {
+    "mp3": (0, 9),
+    "opus": (0, 10),
+    "flac": (0, 12),
+}
+
+# Formats whose container can be written and played incrementally
+STREAMABLE_FORMATS = ("opus", "mp3")
+# Bytes read from the encoder per output frame when streaming
+STREAM_ENCODE_READ = 4096
+
+_BITRATE_PATTERN = re.compile(r"^[1-9][0-9]{0,2}k$")
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Variants currently being encoded, so concurrent requests share one transcode
+_pending: Dict[Path, "asyncio.Future[Path]"] = {}
+
+
+class EncodingError(Exception):
+    """Raised when an encoding request is invalid or ffmpeg fails"""
+
+
+def media_type_for(filename: str) -> str:
+    """Return the media type for an audio file based on its extension"""
+    extension = os.path.splitext(filename)[1].lower()
+    for media_type, format_extension in AUDIO_FORMATS.values():
+        if extension == format_extension:
+            return media_type
+    return "application/octet-stream"
+
+
+def validate_options(audio_format: str, bitrate: Optional[str] = None, quality: Optional[int] = None):
+    """
+    Validate encoding options
+
+    Raises:
+        EncodingError: If the combination is not supported
+    """
+    if audio_format not in AUDIO_FORMATS:
+        raise EncodingError(f"Unsupported format '{audio_format}'. Choose from: {', '.join(AUDIO_FORMATS)}")
+    if bitrate is not None:
+        if audio_format not in DEFAULT_BITRATES:
+            raise EncodingError(f"Bitrate is not configurable for {audio_format}")
+        if not _BITRATE_PATTERN.match(bitrate):
+            raise EncodingError(f"Invalid bitrate '{bitrate}'. Use a value such as '64k'")
+    if quality is not None:
+        if audio_format not in QUALITY_RANGES:
+            raise EncodingError(f"Quality is not configurable for {audio_format}")
+        low, high = QUALITY_RANGES[audio_format]
+        if not low <= quality <= high:
+            raise EncodingError(f"Quality for {audio_format} must be between {low} and {high}")
+
+
+def variant_filename(source_filename: str, audio_format: str, bitrate: Optional[str] = None,
+                     quality: Optional[int] = None) -> str:
+    """
+    Return the filename of an encoded variant stored next to its WAV source
+
+    The options are part of the name so that each distinct encoding is only
+    produced once.
+    """
+    stem = os.path.splitext(source_filename)[0]
+    if audio_format == "wav":
+        return f"{stem}.wav"
+
+    tag = ""
+    if bitrate is not None:
+        tag += f".{bitrate}"
+    if quality is not None:
+        tag += f".q{quality}"
+    return f"{stem}{tag}{AUDIO_FORMATS[audio_format][1]}"
+
+
+def _ffmpeg_arguments(audio_format: str, bitrate: Optional[str], quality: Optional[int]) -> list:
+    if audio_format == "mp3":
+        args = ["-c:a", "libmp3lame", "-f", "mp3"]
+        if quality is not None:
+            args += ["-q:a", str(quality)]
+        else:
+            args += ["-b:a", bitrate or DEFAULT_BITRATES["mp3"]]
+        return args
+    if audio_format == "opus":
+        args = ["-c:a", "libopus", "-f", "ogg", "-b:a", bitrate or DEFAULT_BITRATES["opus"]]
+        if quality is not None:
+            args += ["-compression_level", str(quality)]
+        return args
+    if audio_format == "flac":
+        args = ["-c:a", "flac", "-f", "flac"]
+        if quality is not None:
+            args += ["-compression_level", str(quality)]
+        return args
+    raise EncodingError(f"Unsupported format '{audio_format}'")
+
+
+def encode_file(source: str, destination: str, audio_format: str, bitrate: Optional[str] = None,
+                quality: Optional[int] = None) -> int:
+    """
+    Encode a WAV file with ffmpeg (runs inside an encoder worker process)
+
+    Returns:
+        Size of the encoded file in bytes
+    """
+    tmp_destination = f"{destination}.{uuid.uuid4().hex}.tmp"
+    command = [FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-y", "-i", source,
+               *_ffmpeg_arguments(audio_format, bitrate, quality), tmp_destination]
+    try:
+        result = subprocess.run(command, capture_output=True)
+        if result.returncode != 0:
+            raise EncodingError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+        os.replace(tmp_destination, destination)
+    finally:
+        if os.path.exists(tmp_destination):
+            os.unlink(tmp_destination)
+    return os.path.getsize(destination)
+
+
+def decode_file(source: str, destination: str, sample_rate: int) -> int:
+    """
+    Decode any audio file to raw 16-bit mono PCM with ffmpeg (runs inside an encoder worker process)
+
+    Returns:
+        Size of the decoded PCM in bytes
+    """
+    command = [FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-y", "-i", source,
+               "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-ac", "1", destination]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise EncodingError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    return os.path.getsize(destination)
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Return the shared encoder process pool"""
+    global _executor
+    if _executor is None:
+        # Spawn rather than fork: the server process runs threads
+        _executor = ProcessPoolExecutor(
+            max_workers=ENCODER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the encoder process pool"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def encode_variant(source_path: Path, audio_format: str, bitrate: Optional[str] = None,
+                         quality: Optional[int] = None) -> Path:
+    """
+    Return the encoded variant of a WAV file, transcoding it if needed
+
+    Encoding runs in the process pool so it never blocks the event loop, and
+    concurrent requests for the same variant wait on a single transcode.
+
+    Raises:
+        EncodingError: If the options are invalid or encoding fails
+    """
+    validate_options(audio_format, bitrate, quality)
+    destination = source_path.with_name(variant_filename(source_path.name, audio_format, bitrate, quality))
+    if destination == source_path or destination.exists():
+        return destination
+
+    pending = _pending.get(destination)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending[destination] = future
+    try:
+        size = await loop.run_in_executor(
+            get_executor(), encode_file, str(source_path), str(destination), audio_format, bitrate, quality
+        )
+        if detail_enabled():
+            logger.info(f"Encoded {source_path.name} to {destination.name} ({size} bytes)")
+        future.set_result(destination)
+        return destination
+    except Exception as e:
+        error = e if isinstance(e, EncodingError) else EncodingError(str(e))
+        future.set_exception(error)
+        # Mark the exception as retrieved in case nobody else was waiting
+        future.exception()
+        raise error
+    finally:
+        if not future.done():
+            future.cancel()
+        _pending.pop(destination, None)
+
+
+async def decode_to_pcm(source_path: Path, destination: Path, sample_rate: int) -> int:
+    """
+    Decode an audio file to raw 16-bit mono PCM at ``sample_rate`` in the process pool
+
+    Returns:
+        Size of the decoded PCM in bytes
+
+    Raises:
+        EncodingError: If ffmpeg cannot decode the file
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_executor(), decode_file, str(source_path), str(destination),
+                                          sample_rate)
+    except EncodingError:
+        raise
+    except Exception as e:
+        raise EncodingError(str(e))
+
+
+async def encode_pcm_stream(chunks: AsyncIterator[bytes], audio_format: str, bitrate: Optional[str] = None,
+                            sample_rate: int = 24000) -> AsyncIterator[bytes]:
+    """
+    Encode a 16-bit mono PCM stream on the fly with an ffmpeg subprocess
+
+    Encoded bytes are yielded as soon as ffmpeg emits them, so playback can
+    start before the input ends. An exception raised by ``chunks`` ends the
+    encoder and is re-raised once its output has been drained.
+
+    Raises:
+        EncodingError: If the format cannot be streamed or ffmpeg fails
+    """
+    if audio_format not in STREAMABLE_FORMATS:
+        raise EncodingError(f"Format '{audio_format}' cannot be streamed. Choose from: {', '.join(STREAMABLE_FORMATS)}")
+    validate_options(audio_format, bitrate)
+
+    # Small Ogg pages keep the encoder from holding audio back
+    container = ["-page_duration", "20000"] if audio_format == "opus" else []
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-f", "s16le", "-ar", str(sample_rate), "-ac", "1",
+        "-i", "pipe:0", *_ffmpeg_arguments(audio_format, bitrate, None), *container, "-flush_packets", "1",
+        "pipe:1",
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+    async def feed():
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        finally:
+            process.stdin.close()
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            data = await process.stdout.read(STREAM_ENCODE_READ)
+            if not data:
+                break
+            yield data
+        await feeder
+        if await process.wait() != 0:
+            stderr = await process.stderr.read()
+            raise EncodingError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+    finally:
+        feeder.cancel()
+        await asyncio.gather(feeder, return_exceptions=True)
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+def _accept_quality(ranges: List[Tuple[str, float]], media_type: str) -> float:
+    """Return the q an Accept header gives a media type, from its most specific matching range"""
+    wildcard = media_type.split("/")[0] + "/*"
+    best_specificity, best_q = -1, 0.0
+    for range_type, q in ranges:
+        if range_type == media_type:
+            specificity = 2
+        elif range_type == wildcard:
+            specificity = 1
+        elif range_type == "*/*":
+            specificity = 0
+        else:
+            continue
+        if specificity > best_specificity:
+            best_specificity, best_q = specificity, q
+    return best_q
+
+
+def negotiate_format(accept: Optional[str], stored_format: str = "wav") -> Optional[str]:
+    """
+    Pick the format to serve for an Accept header
+
+    The stored format is served whenever the client accepts it at all, so
+    media elements listing several audio types never cause a transcode.
+    Only when it is refused is the accepted supported format with the
+    highest q chosen. None means serve the stored file.
+    """
+    if not accept:
+        return None
+
+    ranges = []
+    for entry in accept.split(","):
+        media_type, *params = [piece.strip() for piece in entry.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        media_type = media_type.lower()
+        ranges.append((_MEDIA_TYPE_ALIASES.get(media_type, media_type), q))
+
+    if _accept_quality(ranges, AUDIO_FORMATS[stored_format][0]) > 0:
+        return None
+
+    best_format, best_q = None, 0.0
+    for audio_format, (format_media_type, _) in AUDIO_FORMATS.items():
+        q = _accept_quality(ranges, format_media_type)
+        if q > best_q:
+            best_format, best_q = audio_format, q
+    return best_format
@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import math
+import os
+import uuid
+import wave
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from audio_encoding import get_executor
+from observability import detail_enabled
+
+logger = logging.getLogger(__name__)
+
+# Post-processing configuration
+SUPPORTED_SAMPLE_RATES = (16000, 22050, 24000, 44100, 48000)
+LOUDNESS_RANGE = (-40.0, -6.0)  # Allowed loudness targets, dBFS
+PEAK_LIMIT_RANGE = (-20.0, 0.0)  # Allowed peak ceilings, dBFS
+SILENCE_THRESHOLD_DB = float(os.getenv("SILENCE_THRESHOLD_DB", "-50"))  # Frames quieter than this are silence
+SILENCE_PAD_MS = int(os.getenv("SILENCE_PAD_MS", "50"))  # Silence kept before the first and after the last sound
+LIMITER_ATTACK_MS = 5.0
+LIMITER_RELEASE_MS = 50.0
+
+# Half-length of the resampling filter in multiples of the rate ratio (longer is sharper and slower)
+_RESAMPLE_HALF_TAPS = 10
+_RESAMPLE_KAISER_BETA = 5.0
+# Output samples computed per vectorized step, bounding the gather buffer
+_RESAMPLE_BLOCK = 16384
+
+# Processed variants currently being rendered, so concurrent requests share one pass
+_pending: Dict[Path, "asyncio.Future[Path]"] = {}
+
+
+class ProcessingError(Exception):
+    """Raised when post-processing options are invalid or a file cannot be processed"""
+
+
+def validate_processing(sample_rate: Optional[int] = None, loudness: Optional[float] = None,
+                        peak_limit: Optional[float] = None):
+    """
+    Validate post-processing options
+
+    Raises:
+        ProcessingError: If an option is out of range
+    """
+    if sample_rate is not None and sample_rate not in SUPPORTED_SAMPLE_RATES:
+        raise ProcessingError(f"Unsupported sample rate {sample_rate}. "
+                              f"Choose from: {', '.join(map(str, SUPPORTED_SAMPLE_RATES))}")
+    if loudness is not None and not LOUDNESS_RANGE[0] <= loudness <= LOUDNESS_RANGE[1]:
+        raise ProcessingError(f"Loudness must be between {LOUDNESS_RANGE[0]:g} and {LOUDNESS_RANGE[1]:g} dBFS")
+    if peak_limit is not None and not PEAK_LIMIT_RANGE[0] <= peak_limit <= PEAK_LIMIT_RANGE[1]:
+        raise ProcessingError(f"Peak limit must be between {PEAK_LIMIT_RANGE[0]:g} and {PEAK_LIMIT_RANGE[1]:g} dBFS")
+
+
+def processed_filename(source_filename: str, sample_rate: Optional[int] = None, loudness: Optional[float] = None,
+                       trim_silence: bool = False, peak_limit: Optional[float] = None) -> str:
+    """
+    Return the filename of a processed WAV variant stored next to its source
+
+    The options are part of the name so that each distinct chain is only
+    rendered once, and encoded variants of it derive their names from it.
+    """
+    stem = os.path.splitext(source_filename)[0]
+    tag = ""
+    if trim_silence:
+        tag += ".trim"
+    if loudness is not None:
+        tag += f".lufs{loudness:g}"
+    if sample_rate is not None:
+        tag += f".sr{sample_rate}"
+    if peak_limit is not None:
+        tag += f".peak{peak_limit:g}"
+    return f"{stem}{tag}.wav"
+
+
+def read_wav(path: str) -> Tuple[np.ndarray, int]:
+    """Read a 16-bit WAV file as float32 samples shaped (frames, channels)"""
+    try:
+        with wave.open(path, "rb") as wav:
+            if wav.getsampwidth() != 2:
+                raise ProcessingError(f"Unsupported sample width {wav.getsampwidth()}")
+            channels = wav.getnchannels()
+            rate = wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise ProcessingError(f"Unreadable WAV file: {e}")
+    samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768.0
+    return samples.reshape(-1, channels), rate
+
+
+def write_wav(path: str, samples: np.ndarray, rate: int):
+    pcm = np.clip(np.round(samples * 32768.0), -32768, 32767).astype("<i2")
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(samples.shape[1])
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+
+
+def trim_silence(samples: np.ndarray, rate: int, threshold_db: float = SILENCE_THRESHOLD_DB,
+                 pad_ms: int = SILENCE_PAD_MS, frame_ms: int = 10) -> np.ndarray:
+    """Cut leading and trailing frames whose RMS is below ``threshold_db``"""
+    frame = max(1, rate * frame_ms // 1000)
+    count = len(samples) // frame
+    if count == 0:
+        return samples
+    rms = np.sqrt(np.mean(samples[:count * frame].reshape(count, frame, -1) ** 2, axis=(1, 2)))
+    loud = np.flatnonzero(rms > 10 ** (threshold_db / 20))
+    if loud.size == 0:
+        # Nothing but silence; leave it for the caller to notice
+        return samples
+    pad = rate * pad_ms // 1000
+    start = max(0, loud[0] * frame - pad)
+    end = min(len(samples), (loud[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def measure_loudness(samples: np.ndarray, rate: int) -> Optional[float]:
+    """
+    Gated RMS loudness in dBFS
+
+    Uses the BS.1770 block structure (400 ms blocks every 100 ms, an absolute
+    gate at -70 and a relative gate 10 dB below the ungated level) without the
+    K-weighting filter, so pauses between sentences do not drag the level
+    down. Returns None for silence.
+    """
+    hop = max(1, rate // 10)
+    count = len(samples) // hop
+    if count >= 4:
+        power = np.mean(samples[:count * hop].reshape(count, hop, -1) ** 2, axis=(1, 2))
+        blocks = np.convolve(power, np.full(4, 0.25), mode="valid")
+    else:
+        blocks = np.array([np.mean(samples ** 2)]) if samples.size else np.zeros(0)
+
+    blocks = blocks[blocks > 10 ** (-70 / 10)]
+    if blocks.size == 0:
+        return None
+    relative_gate = np.mean(blocks) * 10 ** (-10 / 10)
+    blocks = blocks[blocks > relative_gate]
+    return float(10 * np.log10(np.mean(blocks)))
+
+
+def normalize_loudness(samples: np.ndarray, rate: int, target_db: float) -> np.ndarray:
+    """Scale the signal so its gated RMS loudness is ``target_db``"""
+    measured = measure_loudness(samples, rate)
+    if measured is None:
+        return samples
+    return samples * np.float32(10 ** ((target_db - measured) / 20))
+
+
+@lru_cache(maxsize=16)
+def _polyphase_filter(up: int, down: int) -> Tuple[np.ndarray, int]:
+    """
+    Kaiser-windowed sinc low-pass split into ``up`` phases
+
+    Returns the (up, taps per phase) filter bank and the filter delay in
+    samples of the upsampled signal.
+    """
+    ratio = max(up, down)
+    half = _RESAMPLE_HALF_TAPS * ratio
+    n = np.arange(-half, half + 1)
+    taps = np.sinc(n / ratio) / ratio * np.kaiser(2 * half + 1, _RESAMPLE_KAISER_BETA) * up
+    per_phase = math.ceil(len(taps) / up)
+    taps = np.concatenate([taps, np.zeros(per_phase * up - len(taps))])
+    # bank[p, j] is taps[p + j * up]
+    bank = taps.reshape(per_phase, up).T.astype(np.float32)
+    return bank, half
+
+
+def resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """
+    Polyphase resampling by the rational factor ``target_rate / source_rate``
+
+    Only the filter taps that line up with input samples are evaluated for
+    each output sample, so the cost scales with the output length rather than
+    with the upsampled length. Output samples are computed a block at a time
+    with one gather and one contraction each.
+    """
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    divisor = math.gcd(source_rate, target_rate)
+    up, down = target_rate // divisor, source_rate // divisor
+    bank, delay = _polyphase_filter(up, down)
+    per_phase = bank.shape[1]
+
+    padded = np.concatenate([
+        np.zeros((per_phase, samples.shape[1]), dtype=np.float32),
+        samples,
+        np.zeros((per_phase + 1, samples.shape[1]), dtype=np.float32),
+    ])
+    output_length = math.ceil(len(samples) * up / down)
+    output = np.empty((output_length, samples.shape[1]), dtype=np.float32)
+    offsets = per_phase - np.arange(per_phase)
+
+    for start in range(0, output_length, _RESAMPLE_BLOCK):
+        # Position of each output sample on the upsampled time axis, delay compensated
+        position = np.arange(start, min(start + _RESAMPLE_BLOCK, output_length)) * down + delay
+        phase, base = position % up, position // up
+        window = padded[base[:, None] + offsets[None, :]]
+        output[start:start + len(position)] = np.einsum("bj,bjc->bc", bank[phase], window)
+    return output
+
+
+def limit_peaks(samples: np.ndarray, rate: int, ceiling_db: float, attack_ms: float = LIMITER_ATTACK_MS,
+                release_ms: float = LIMITER_RELEASE_MS) -> np.ndarray:
+    """
+    Keep peaks under ``ceiling_db`` with a smoothed gain envelope
+
+    Gain is computed per 1 ms block, ramped down ahead of each peak over the
+    attack time and back up over the release time. Both ramps are running
+    minima, so there is no per-sample loop.
+    """
+    ceiling = 10 ** (ceiling_db / 20)
+    block = max(1, rate // 1000)
+    count = math.ceil(len(samples) / block)
+    if count == 0:
+        return samples
+    padded = np.zeros((count * block, samples.shape[1]), dtype=np.float32)
+    padded[:len(samples)] = samples
+    peaks = np.max(np.abs(padded.reshape(count, block, -1)), axis=(1, 2))
+    gain = np.minimum(1.0, ceiling / np.maximum(peaks, 1e-9))
+
+    index = np.arange(count)
+    # Release: gain[i] = min over j <= i of gain[j] + (i - j) * step
+    release_step = 1.0 / max(1.0, release_ms)
+    gain = np.minimum.accumulate(gain - index * release_step) + index * release_step
+    # Attack: the same running minimum taken backwards, so the gain falls before the peak arrives
+    attack_step = 1.0 / max(1.0, attack_ms)
+    reverse = gain[::-1]
+    gain = (np.minimum.accumulate(reverse - index * attack_step) + index * attack_step)[::-1]
+    gain = np.minimum(gain, 1.0)
+
+    centers = index * block + (block - 1) / 2
+    envelope = np.interp(np.arange(len(samples)), centers, gain).astype(np.float32)
+    return np.clip(samples * envelope[:, None], -ceiling, ceiling)
+
+
+def process_file(source: str, destination: str, sample_rate: Optional[int] = None, loudness: Optional[float] = None,
+                 trim_silence_enabled: bool = False, peak_limit: Optional[float] = None) -> int:
+    """
+    Run the post-processing chain on a WAV file (runs inside an encoder worker process)
+
+    The order is trim, loudness, resample, limit: measuring loudness after
+    trimming keeps silence out of the measurement, and limiting last catches
+    overshoot introduced by the gain change and the resampling filter.
+
+    Returns:
+        Size of the processed file in bytes
+    """
+    samples, rate = read_wav(source)
+    if trim_silence_enabled:
+        samples = trim_silence(samples, rate)
+    if loudness is not None:
+        samples = normalize_loudness(samples, rate, loudness)
+    if sample_rate is not None:
+        samples = resample(samples, rate, sample_rate)
+        rate = sample_rate
+    if peak_limit is not None:
+        samples = limit_peaks(samples, rate, peak_limit)
+
+    tmp_destination = f"{destination}.{uuid.uuid4().hex}.tmp"
+    try:
+        write_wav(tmp_destination, samples, rate)
+        os.replace(tmp_destination, destination)
+    finally:
+        if os.path.exists(tmp_destination):
+            os.unlink(tmp_destination)
+    return os.path.getsize(destination)
+
+
+async def process_variant(source_path: Path, sample_rate: Optional[int] = None, loudness: Optional[float] = None,
+                          trim_silence: bool = False, peak_limit: Optional[float] = None) -> Path:
+    """
+    Return the post-processed variant of a WAV file, rendering it if needed
+
+    Processing runs in the encoder process pool so it never blocks the event
+    loop, and concurrent requests for the same variant wait on a single pass.
+
+    Raises:
+        ProcessingError: If the options are invalid or processing fails
+    """
+    validate_processing(sample_rate, loudness, peak_limit)
+    destination = source_path.with_name(
+        processed_filename(source_path.name, sample_rate, loudness, trim_silence, peak_limit)
+    )
+    if destination == source_path or destination.exists():
+        return destination
+
+    pending = _pending.get(destination)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending[destination] = future
+    try:
+        size = await loop.run_in_executor(
+            get_executor(), process_file, str(source_path), str(destination), sample_rate, loudness, trim_silence,
+            peak_limit
+        )
+        if detail_enabled():
+            logger.info(f"Processed {source_path.name} to {destination.name} ({size} bytes)")
+        future.set_result(destination)
+        return destination
+    except Exception as e:
+        error = e if isinstance(e, ProcessingError) else ProcessingError(str(e))
+        future.set_exception(error)
+        # Mark the exception as retrieved in case nobody else was waiting
+        future.exception()
+        raise error
+    finally:
+        if not future.done():
+            future.cancel()
+        _pending.pop(destination, None)
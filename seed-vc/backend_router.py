@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Collection, Dict, List, Optional, Type
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Health checking and outlier ejection
+BACKEND_PROBE_INTERVAL = float(os.getenv("BACKEND_PROBE_INTERVAL", "10"))  # Seconds between active probes
+BACKEND_PROBE_TIMEOUT = float(os.getenv("BACKEND_PROBE_TIMEOUT", "2"))
+BACKEND_EJECT_FAILURES = int(os.getenv("BACKEND_EJECT_FAILURES", "3"))  # Consecutive failures before ejection
+BACKEND_EJECT_TIME = float(os.getenv("BACKEND_EJECT_TIME", "30"))  # First ejection, doubled on each repeat
+BACKEND_EJECT_MAX_TIME = float(os.getenv("BACKEND_EJECT_MAX_TIME", "300"))
+# Never eject more than this share of a pool, so a bad request pattern cannot empty it
+BACKEND_MAX_EJECTED_PERCENT = int(os.getenv("BACKEND_MAX_EJECTED_PERCENT", "50"))
+
+
+class BackendAdapter(ABC):
+    """
+    One kind of synthesis backend behind a common interface.
+
+    ``synthesize`` turns text spoken in a voice into 16-bit mono PCM at
+    ``sample_rate``, handed to ``sink`` in playback order, and routes the
+    request through ``pool`` to one of the backend's instances. Adapters
+    also tell the pool how to probe an instance.
+    """
+
+    name = ""
+    sample_rate = 24000
+
+    def __init__(self):
+        # Set by the pool built for the adapter
+        self.pool: Optional["BackendPool"] = None
+
+    @abstractmethod
+    async def synthesize(self, text: str, voice: str, sink: Callable[[bytes], None]) -> bool:
+        """Synthesize text into sink; False if synthesis failed"""
+
+    def probe_url(self, base_url: str, api_key: str) -> str:
+        """URL fetched by the active health probe"""
+        return base_url
+
+    def probe_healthy(self, response: httpx.Response) -> bool:
+        # Rate limits and auth errors still prove the instance is serving
+        return response.status_code < 500
+
+
+_adapters: Dict[str, Type[BackendAdapter]] = {}
+
+
+def register_adapter(adapter: Type[BackendAdapter]) -> Type[BackendAdapter]:
+    """Register a backend adapter class under its name (usable as a decorator)"""
+    _adapters[adapter.name] = adapter
+    return adapter
+
+
+def get_adapter(name: str) -> BackendAdapter:
+    try:
+        return _adapters[name]()
+    except KeyError:
+        raise ValueError(f"Unknown synthesis backend '{name}'. Available: {', '.join(_adapters)}")
+
+
+class BackendInstance:
+    """One instance of a backend and its routing state"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True  # Last active probe result
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_probe = 0.0
+
+    def ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+    def available(self, now: float) -> bool:
+        return self.healthy and not self.ejected(now)
+
+
+class BackendPool:
+    """
+    Routes requests across the instances of one backend.
+
+    Each request goes to the available instance with the fewest requests
+    outstanding from this process, ties broken at random. Instances leave
+    rotation when an active probe fails or when passive outlier detection
+    sees ``eject_failures`` consecutive failed requests; ejections last
+    longer each time they repeat. Callers exclude instances that already
+    failed a request so retries fail over. If nothing is available the pool
+    still hands out an instance rather than refusing outright.
+    """
+
+    def __init__(self, adapter: BackendAdapter, urls: List[str], client_factory: Callable[[], httpx.AsyncClient],
+                 api_key: Callable[[], Optional[str]] = lambda: "", probe_interval: float = BACKEND_PROBE_INTERVAL,
+                 eject_failures: int = BACKEND_EJECT_FAILURES, eject_time: float = BACKEND_EJECT_TIME):
+        if not urls:
+            raise ValueError(f"No instances configured for backend '{adapter.name}'")
+        self.adapter = adapter
+        adapter.pool = self
+        self.instances = [BackendInstance(url) for url in urls]
+        self.client_factory = client_factory
+        self.api_key = api_key
+        self.probe_interval = probe_interval
+        self.eject_failures = eject_failures
+        self.eject_time = eject_time
+        self._task: Optional[asyncio.Task] = None
+
+    def acquire(self, exclude: Collection[BackendInstance] = ()) -> BackendInstance:
+        """Pick the instance for the next request and count it as outstanding"""
+        now = time.monotonic()
+        candidates = [i for i in self.instances if i.available(now) and i not in exclude]
+        if not candidates:
+            # Retry on an instance that already failed this request before giving up on health
+            candidates = [i for i in self.instances if i.available(now)] or \
+                         [i for i in self.instances if i not in exclude] or self.instances
+        fewest = min(instance.outstanding for instance in candidates)
+        instance = random.choice([i for i in candidates if i.outstanding == fewest])
+        instance.outstanding += 1
+        instance.requests += 1
+        return instance
+
+    def can_fail_over(self, tried: Collection[BackendInstance]) -> bool:
+        """Tell whether an available instance has not been tried yet"""
+        now = time.monotonic()
+        return any(i.available(now) and i not in tried for i in self.instances)
+
+    def release(self, instance: BackendInstance, ok: Optional[bool]):
+        """
+        Finish a request on an instance
+
+        ``ok`` is None when the outcome says nothing about the instance (a
+        rejected request, a quota response).
+        """
+        instance.outstanding -= 1
+        if ok:
+            instance.consecutive_failures = 0
+        elif ok is False:
+            instance.failures += 1
+            instance.consecutive_failures += 1
+            if instance.consecutive_failures >= self.eject_failures:
+                self._eject(instance)
+
+    def _eject(self, instance: BackendInstance):
+        now = time.monotonic()
+        if instance.ejected(now):
+            return
+        ejected = sum(1 for i in self.instances if i.ejected(now))
+        if (ejected + 1) * 100 > BACKEND_MAX_EJECTED_PERCENT * len(self.instances) and ejected > 0:
+            return
+        duration = min(BACKEND_EJECT_MAX_TIME, self.eject_time * 2 ** instance.ejections)
+        instance.ejections += 1
+        instance.ejected_until = now + duration
+        instance.consecutive_failures = 0
+        logger.warning(f"Ejected {self.adapter.name} instance {instance.url} for {duration:.0f}s")
+
+    async def probe(self, instance: BackendInstance):
+        instance.last_probe = time.monotonic()
+        try:
+            response = await self.client_factory().get(
+                self.adapter.probe_url(instance.url, self.api_key() or ""), timeout=BACKEND_PROBE_TIMEOUT
+            )
+            healthy = self.adapter.probe_healthy(response)
+        except httpx.HTTPError:
+            healthy = False
+        if healthy != instance.healthy:
+            logger.warning(f"{self.adapter.name} instance {instance.url} is {'up' if healthy else 'down'}")
+        instance.healthy = healthy
+
+    async def warm_up(self):
+        """Open pooled connections to instances not probed recently, ahead of latency-sensitive requests"""
+        cutoff = time.monotonic() - self.probe_interval
+        await asyncio.gather(*(self.probe(i) for i in self.instances if i.last_probe < cutoff),
+                             return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.gather(*(self.probe(instance) for instance in self.instances), return_exceptions=True)
+            await asyncio.sleep(self.probe_interval)
+
+    async def start(self):
+        # A single instance is used regardless of health, so probing it is wasted effort
+        if len(self.instances) > 1 and self.probe_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> Dict[str, int]:
+        now = time.monotonic()
+        return {
+            "instances": len(self.instances),
+            "available": sum(1 for i in self.instances if i.available(now)),
+            "ejected": sum(1 for i in self.instances if i.ejected(now)),
+            "outstanding": sum(i.outstanding for i in self.instances),
+            "ejections": sum(i.ejections for i in self.instances),
+            "requests": sum(i.requests for i in self.instances),
+            "failures": sum(i.failures for i in self.instances),
+        }
+
+    def instance_status(self) -> List[Dict]:
+        now = time.monotonic()
+        return [{
+            "url": i.url,
+            "healthy": i.healthy,
+            "ejected_for": max(0.0, round(i.ejected_until - now, 1)),
+            "outstanding": i.outstanding,
+            "requests": i.requests,
+            "failures": i.failures,
+        } for i in self.instances]
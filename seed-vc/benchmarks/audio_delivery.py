@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Throughput of /audio delivery, old FileResponse path vs the range/ETag/hot tier path
+
+Starts a uvicorn server per implementation on localhost and replays the
+player's access pattern against one generated clip:
+
+  fetch    full GET right after generation
+  seek     64 KiB byte-range reads at random offsets (scrubbing)
+  replay   revalidation with If-None-Match (the browser already has the clip)
+
+The old path has no validators or range support, so seek and replay
+transfer the whole file every time.
+
+Usage:
+    python benchmarks/audio_delivery.py --seconds 30 --concurrency 16 --duration 5
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from audio_delivery import HotAudioCache, audio_response, stat_audio_file  # noqa: E402
+from gemini_api import build_wav_header  # noqa: E402
+
+SAMPLE_RATE = 24000
+SEEK_BYTES = 64 * 1024
+
+
+def legacy_app(directory: Path) -> FastAPI:
+    """The handler as it was before range/ETag support"""
+    app = FastAPI()
+
+    @app.get("/audio/{filename}")
+    async def serve_audio_file(filename: str):
+        file_path = directory / filename
+        if not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        return FileResponse(path=file_path, media_type="audio/wav",
+                            headers={"Cache-Control": "public, max-age=3600"})
+
+    return app
+
+
+def current_app(directory: Path) -> FastAPI:
+    """The same route served through audio_delivery"""
+    app = FastAPI()
+    hot = HotAudioCache()
+
+    @app.api_route("/audio/{filename}", methods=["GET", "HEAD"])
+    async def serve_audio_file(request: Request, filename: str):
+        audio = hot.get(filename)
+        if audio is None:
+            path = directory / filename
+            if not os.path.exists(path):
+                raise HTTPException(status_code=404, detail="Audio file not found")
+            audio = hot.load(path) or stat_audio_file(path)
+        return audio_response(audio, request.headers, "audio/wav", method=request.method)
+
+    return app
+
+
+def start_server(app: FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+async def run_scenario(url: str, scenario: str, size: int, concurrency: int, duration: float):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        etag = (await client.get(url)).headers.get("etag", '"none"')
+        requests = 0
+        transferred = 0
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal requests, transferred
+            while time.perf_counter() < deadline:
+                headers = {}
+                if scenario == "seek":
+                    start = random.randrange(0, max(1, size - SEEK_BYTES))
+                    headers["Range"] = f"bytes={start}-{start + SEEK_BYTES - 1}"
+                elif scenario == "replay":
+                    headers["If-None-Match"] = etag
+                response = await client.get(url, headers=headers)
+                assert response.status_code in (200, 206, 304), response.status_code
+                requests += 1
+                transferred += len(response.content)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return requests / elapsed, transferred / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=30, help="Clip length")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent client connections")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds per scenario")
+    parser.add_argument("--port", type=int, default=8750, help="First local port to use")
+    args = parser.parse_args()
+
+    # Keep per-request log lines out of the measurement
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        pcm = os.urandom(int(args.seconds * SAMPLE_RATE) * 2)
+        clip = directory / "clip.wav"
+        clip.write_bytes(build_wav_header(len(pcm)) + pcm)
+        size = clip.stat().st_size
+
+        servers = {
+            "old": start_server(legacy_app(directory), args.port),
+            "new": start_server(current_app(directory), args.port + 1),
+        }
+        ports = {"old": args.port, "new": args.port + 1}
+
+        print(f"clip {size / 1e6:.1f}MB, {args.concurrency} connections, {args.duration:.0f}s per scenario")
+        print(f"{'scenario':>8} {'path':>5} {'req/s':>10} {'MB/s':>10}")
+        for scenario in ("fetch", "seek", "replay"):
+            for name in ("old", "new"):
+                url = f"http://127.0.0.1:{ports[name]}/audio/clip.wav"
+                rate, throughput = await run_scenario(url, scenario, size, args.concurrency, args.duration)
+                print(f"{scenario:>8} {name:>5} {rate:>10.0f} {throughput / 1e6:>10.1f}")
+
+        for server in servers.values():
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Peak memory of decoding a generateContent response, old path vs streaming path
+
+Feeds a synthetic response of a given clip length through an in-process
+transport and reports the tracemalloc peak for:
+
+  buffered   response.json() -> base64 decode -> convert_pcm_to_wav -> write
+  streaming  generate_tts_to_file_async (incremental decode into a WAV file)
+
+Usage:
+    python benchmarks/decode_memory.py --seconds 10 60 300
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import gemini_api  # noqa: E402
+
+SAMPLE_RATE = 24000
+# Bytes of PCM per generated response chunk (multiple of 3 so base64 splits cleanly)
+BODY_CHUNK = 48 * 1024
+
+
+def response_body(seconds: float):
+    """Yield a generateContent JSON response without materializing it"""
+    pcm_block = os.urandom(BODY_CHUNK)
+    total = int(seconds * SAMPLE_RATE) * 2
+    yield b'{"candidates": [{"content": {"role": "model", "parts": [{"inlineData": ' \
+          b'{"mimeType": "audio/L16;codec=pcm;rate=24000", "data": "'
+    sent = 0
+    while sent < total:
+        size = min(BODY_CHUNK, total - sent)
+        yield base64.b64encode(pcm_block[:size])
+        sent += size
+    yield b'"}}]}, "finishReason": "STOP"}]}'
+
+
+def install_transport(seconds: float):
+    async def body():
+        for chunk in response_body(seconds):
+            yield chunk
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=body(), headers={"Content-Type": "application/json"})
+
+    gemini_api._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    gemini_api._http_semaphore = asyncio.Semaphore(gemini_api.GEMINI_MAX_CONCURRENCY)
+    gemini_api._http_loop = asyncio.get_running_loop()
+
+
+async def buffered(path: Path):
+    """The pre-streaming implementation"""
+    response = await gemini_api._http_client.post("http://mock/generateContent", json={})
+    response_json = response.json()
+    data = response_json["candidates"][0]["content"]["parts"][0]["inlineData"]["data"]
+    audio = gemini_api.convert_pcm_to_wav(base64.b64decode(data))
+    with open(path, "wb") as f:
+        f.write(audio)
+
+
+async def streaming(path: Path):
+    size = await gemini_api.generate_tts_to_file_async("benchmark", "Kore", path)
+    assert size, "streaming decode failed"
+
+
+async def measure(name: str, fn, seconds: float, directory: Path):
+    install_transport(seconds)
+    path = directory / f"{name}.wav"
+    tracemalloc.start()
+    start = time.perf_counter()
+    await fn(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await gemini_api.close_http_client()
+    size = path.stat().st_size
+    path.unlink()
+    return peak, elapsed, size
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, nargs="+", default=[10, 60, 300], help="Clip lengths to test")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    # Keep per-request log lines out of the measurement
+    gemini_api.logger.disabled = True
+
+    print(f"{'clip':>8} {'path':>10} {'wav size':>12} {'peak alloc':>12} {'time':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for seconds in args.seconds:
+            for name, fn in (("buffered", buffered), ("streaming", streaming)):
+                peak, elapsed, size = await measure(name, fn, seconds, Path(tmp))
+                print(f"{seconds:>7.0f}s {name:>10} {size / 1e6:>10.1f}MB {peak / 1e6:>10.1f}MB {elapsed:>7.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Load test the API against the local mock Gemini server
+
+Drives each endpoint with a fixed number of concurrent clients for a while
+and reports throughput and latency percentiles:
+
+  tts            POST /tts with unique text, so every request synthesizes
+  multi-speaker  POST /multi-speaker with a two-speaker script
+  upload         POST /upload of a generated WAV file
+  audio          GET /audio of a clip generated once up front
+
+By default the mock upstream and the API are started as subprocesses in a
+scratch directory; pass --url to load an already running server instead.
+Results can be saved as a baseline and later runs compared against it, with a
+non-zero exit when throughput drops or p95 latency rises past --tolerance.
+
+Usage:
+    python benchmarks/load_driver.py --concurrency 1 8 32 --duration 10
+    python benchmarks/load_driver.py --workers 4 --save-baseline baseline.json
+    python benchmarks/load_driver.py --workers 4 --baseline baseline.json --tolerance 0.15
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from gemini_api import build_wav_header  # noqa: E402
+
+ENDPOINTS = ("tts", "multi-speaker", "upload", "audio")
+SAMPLE_RATE = 24000
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LoadClient:
+    """Issues one request per call for an endpoint and raises on a bad status"""
+
+    def __init__(self, client: httpx.AsyncClient, text: str, upload_bytes: bytes):
+        self.client = client
+        self.text = text
+        self.upload_bytes = upload_bytes
+        self.audio_path: Optional[str] = None
+
+    async def prepare(self):
+        response = await self.client.post("/tts", json={"text": self.text, "voice": "Kore"})
+        response.raise_for_status()
+        self.audio_path = httpx.URL(response.json()["audio_url"]).path
+
+    def unique_text(self) -> str:
+        # A fresh suffix keeps the synthesis cache and request coalescing out of the measurement
+        return f"{self.text} ({uuid.uuid4().hex[:8]})"
+
+    async def request(self, endpoint: str):
+        if endpoint == "tts":
+            response = await self.client.post("/tts", json={"text": self.unique_text(), "voice": "Kore"})
+        elif endpoint == "multi-speaker":
+            text = f"Joe: {self.unique_text()}\nJane: {self.text}"
+            response = await self.client.post("/multi-speaker",
+                                              json={"text": text, "speakers": {"Joe": "Kore", "Jane": "Puck"}})
+        elif endpoint == "upload":
+            # Unique trailing samples, otherwise every upload after the first is deduplicated
+            body = self.upload_bytes[:-16] + uuid.uuid4().bytes
+            files = {"file": ("sample.wav", body, "audio/wav")}
+            response = await self.client.post("/upload", files=files)
+        else:
+            response = await self.client.get(self.audio_path)
+        response.raise_for_status()
+        # Read the whole body so /audio timings include the transfer
+        return len(response.content)
+
+
+async def run_level(load: LoadClient, endpoint: str, concurrency: int, duration: float) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await load.request(endpoint)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """List the scenarios that got slower than the baseline by more than ``tolerance``"""
+    regressions = []
+    for scenario, current in results.items():
+        previous = baseline.get(scenario)
+        if previous is None:
+            continue
+        if current["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"{scenario}: throughput {previous['throughput']:.1f} -> {current['throughput']:.1f}"
+                               " req/s")
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {previous['p95_ms']:.0f} -> {current['p95_ms']:.0f} ms")
+    return regressions
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60, headers=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server for {url} exited with status {process.returncode}")
+        try:
+            httpx.get(url, headers=headers, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise SystemExit(f"Server for {url} did not start within {timeout:.0f}s")
+
+
+def spawn_servers(args, workdir: Path) -> List[subprocess.Popen]:
+    """Start the mock upstream and the API with their state in ``workdir``"""
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(ROOT),
+        "MOCK_LATENCY": str(args.mock_latency),
+        "MOCK_LATENCY_DIST": args.mock_latency_dist,
+        "MOCK_LATENCY_SPREAD": str(args.mock_latency_spread),
+        "MOCK_ERROR_RATE": str(args.mock_error_rate),
+        "MOCK_RATE_LIMIT_RATE": str(args.mock_rate_limit_rate),
+        "MOCK_AUDIO_SECONDS": str(args.mock_audio_seconds),
+        "GEMINI_API_URLS": ",".join(f"http://127.0.0.1:{args.mock_port + index}/v1beta/models"
+                                    for index in range(args.mock_instances)),
+        "GEMINI_API_KEY": "mock",
+        # The mock has no quota to protect
+        "GEMINI_REQUESTS_PER_MINUTE": "0",
+        "API_KEY": args.api_key,
+        "STATE_DIR": str(workdir / "state"),
+    }
+    quiet = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL} if not args.verbose else {}
+
+    mocks = []
+    for index in range(args.mock_instances):
+        port = args.mock_port + index
+        mock = subprocess.Popen([sys.executable, str(ROOT / "mock_gemini.py")], cwd=workdir,
+                                env={**env, "MOCK_PORT": str(port)}, **quiet)
+        mocks.append(mock)
+        wait_until_ready(f"http://127.0.0.1:{port}/docs", mock)
+
+    api = subprocess.Popen([sys.executable, str(ROOT / "start_server.py"), "--host", "127.0.0.1",
+                            "--port", str(args.port), "--workers", str(args.workers)],
+                           cwd=workdir, env=env, **quiet)
+    wait_until_ready(f"http://127.0.0.1:{args.port}/health", api,
+                     headers={"Authorization": f"Bearer {args.api_key}"})
+    return [api, *mocks]
+
+
+async def run(args, url: str) -> Dict[str, Dict]:
+    pcm = bytes(int(args.upload_seconds * SAMPLE_RATE) * 2)
+    upload_bytes = build_wav_header(len(pcm)) + pcm
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    headers = {"Authorization": f"Bearer {args.api_key}"}
+
+    results = {}
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=args.timeout) as client:
+        load = LoadClient(client, args.text, upload_bytes)
+        if "audio" in args.endpoints:
+            await load.prepare()
+
+        print(f"{'endpoint':>14} {'conc':>5} {'reqs':>7} {'errors':>7} {'req/s':>9} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                result = await run_level(load, endpoint, concurrency, args.duration)
+                results[f"{endpoint}@{concurrency}"] = result
+                print(f"{endpoint:>14} {concurrency:>5} {result['requests']:>7} {result['errors']:>7} "
+                      f"{result['throughput']:>9.1f} {result['p50_ms']:>8.0f} {result['p95_ms']:>8.0f} "
+                      f"{result['p99_ms']:>8.0f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Load a running server instead of starting one")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY", "123456789"))
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32], help="Concurrency levels")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per endpoint and level")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout")
+    parser.add_argument("--text", default="The quick brown fox jumps over the lazy dog.")
+    parser.add_argument("--upload-seconds", type=float, default=5, help="Length of the uploaded WAV file")
+    parser.add_argument("--save-baseline", type=Path, help="Write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="Compare the results against this file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the spawned servers' output")
+
+    spawned = parser.add_argument_group("spawned servers")
+    spawned.add_argument("--port", type=int, default=8760)
+    spawned.add_argument("--workers", type=int, default=1, help="API worker processes")
+    spawned.add_argument("--mock-port", type=int, default=8761, help="Port of the first mock instance")
+    spawned.add_argument("--mock-instances", type=int, default=1, help="Mock upstream instances to balance across")
+    spawned.add_argument("--mock-latency", type=float, default=0.2, help="Upstream time to first byte")
+    spawned.add_argument("--mock-latency-dist", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    spawned.add_argument("--mock-latency-spread", type=float, default=0.5)
+    spawned.add_argument("--mock-error-rate", type=float, default=0.0, help="Fraction of upstream 500s")
+    spawned.add_argument("--mock-rate-limit-rate", type=float, default=0.0, help="Fraction of upstream 429s")
+    spawned.add_argument("--mock-audio-seconds", type=float, default=5, help="Clip length, 0 scales with text")
+    args = parser.parse_args()
+
+    # Keep per-request log lines out of the measurement
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            url = args.url
+            if url is None:
+                processes = spawn_servers(args, Path(tmp))
+                url = f"http://127.0.0.1:{args.port}"
+            results = asyncio.run(run(args, url))
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=2))
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
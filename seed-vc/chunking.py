@@ -0,0 +1,213 @@
+import re
+from array import array
+from typing import Iterable, List, Tuple
+
+# Sentence ends, including CJK full-width punctuation
+_SENTENCE_END = re.compile(r"(?<=[.!?;。！？])\s+")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_CLAUSE_BREAK = re.compile(r"(?<=[,:、，])\s+")
+
+
+def _split_oversized(piece: str, max_chars: int) -> List[str]:
+    """Split a single sentence that is longer than max_chars"""
+    parts = []
+    for clause in _CLAUSE_BREAK.split(piece):
+        while len(clause) > max_chars:
+            # Prefer the last space before the limit, otherwise hard split
+            cut = clause.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            parts.append(clause[:cut].strip())
+            clause = clause[cut:].strip()
+        if clause:
+            parts.append(clause)
+    return parts
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """
+    Split text into chunks of at most max_chars characters
+
+    Chunks break at paragraph boundaries first, then sentence boundaries, and
+    only fall back to clause or word boundaries for overlong sentences.
+    Consecutive sentences within a paragraph are packed into the same chunk.
+
+    Args:
+        text: The text to split
+        max_chars: Maximum chunk length in characters
+
+    Returns:
+        List of non-empty chunks in reading order
+    """
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+
+    chunks = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        current = ""
+        for sentence in _SENTENCE_END.split(paragraph.strip()):
+            sentence = " ".join(sentence.split())
+            if not sentence:
+                continue
+            for piece in ([sentence] if len(sentence) <= max_chars else _split_oversized(sentence, max_chars)):
+                if current and len(current) + 1 + len(piece) > max_chars:
+                    chunks.append(current)
+                    current = piece
+                else:
+                    current = f"{current} {piece}" if current else piece
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def take_sentences(buffer: str, max_chars: int, flush: bool = False) -> Tuple[List[str], str]:
+    """
+    Take the complete sentences off the front of incrementally received text
+
+    A sentence is complete once its closing punctuation is followed by
+    whitespace, since "3." may still become "3.5". Text longer than max_chars
+    without a sentence end is split at clause or word boundaries instead of
+    waiting for more.
+
+    Args:
+        buffer: Text received so far and not yet taken
+        max_chars: Longest sentence to hold back
+        flush: Take the remainder too, complete or not
+
+    Returns:
+        The complete sentences in order, and the text to keep buffering
+    """
+    pieces = _SENTENCE_END.split(buffer)
+    rest = "" if flush else pieces.pop()
+    sentences = []
+    for piece in pieces:
+        piece = " ".join(piece.split())
+        if piece:
+            sentences.extend([piece] if len(piece) <= max_chars else _split_oversized(piece, max_chars))
+    if len(rest) > max_chars:
+        parts = _split_oversized(" ".join(rest.split()), max_chars)
+        sentences.extend(parts[:-1])
+        # Keep a trailing space so the next fragment does not run into the last word
+        rest = parts[-1] + (" " if rest[-1].isspace() else "")
+    return sentences, rest
+
+
+def split_turns(text: str, speakers: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    Split an annotated dialogue into speaker turns
+
+    A line starting with "<speaker>:" for one of the given speakers starts a
+    new turn; any other non-blank line continues the current turn.
+
+    Args:
+        text: Dialogue with one "Speaker: line" per turn
+        speakers: Speaker names to recognise
+
+    Returns:
+        List of (speaker, text) turns in script order
+
+    Raises:
+        ValueError: If text appears before the first turn or no turn is found
+    """
+    # Longest names first so "Ann" does not shadow "Anna"
+    names = sorted(speakers, key=len, reverse=True)
+    if not names:
+        raise ValueError("No speakers given")
+    turn_start = re.compile(r"^\s*(" + "|".join(re.escape(name) for name in names) + r")\s*:\s*(.*)$")
+
+    turns = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = turn_start.match(line)
+        if match:
+            turns.append([match.group(1), match.group(2).strip()])
+        elif turns:
+            turns[-1][1] = f"{turns[-1][1]} {line.strip()}".strip()
+        else:
+            raise ValueError(f"Text before the first speaker turn: '{line.strip()[:50]}'")
+
+    turns = [(speaker, line) for speaker, line in turns if line]
+    if not turns:
+        raise ValueError("No speaker turns found")
+    return turns
+
+
+class PcmStitcher:
+    """
+    Incrementally join 16-bit mono PCM segments in order
+
+    Only the last crossfade_ms of audio is held back between segments, so the
+    stitched result can be written out as each segment arrives.
+
+    Args:
+        sample_rate: Sample rate in Hz
+        pad_ms: Silence inserted between segments
+        crossfade_ms: Length of the linear fade applied at each join. With
+            padding the segments fade out/in around the silence, otherwise
+            they overlap by this amount.
+    """
+
+    def __init__(self, sample_rate: int = 24000, pad_ms: int = 0, crossfade_ms: int = 0):
+        self.fade = int(sample_rate * crossfade_ms / 1000)
+        self.pad = bytes(2 * int(sample_rate * pad_ms / 1000))
+        self._tail = array("h")
+        self._started = False
+
+    def add(self, segment: bytes) -> bytes:
+        """Add the next segment and return the PCM that is now final"""
+        samples = array("h")
+        samples.frombytes(segment[:len(segment) - len(segment) % 2])
+
+        if not self._started:
+            self._started = True
+            out = b""
+        else:
+            tail = self._tail
+            n = min(len(tail), len(samples))
+            if n and self.pad:
+                # Fade out the previous tail and fade in the next head around the gap
+                for i in range(n):
+                    tail[len(tail) - n + i] = int(tail[len(tail) - n + i] * (n - i) / n)
+                    samples[i] = int(samples[i] * i / n)
+                out = tail.tobytes() + self.pad
+            elif n:
+                # Overlap the tail of the previous segment with the head of the next
+                start = len(tail) - n
+                for i in range(n):
+                    mixed = tail[start + i] * (n - i) / n + samples[i] * i / n
+                    samples[i] = max(-32768, min(32767, int(mixed)))
+                out = tail[:start].tobytes()
+            else:
+                out = tail.tobytes() + self.pad
+
+        # Hold back the end of this segment for the next join
+        keep = min(self.fade, len(samples))
+        self._tail = samples[len(samples) - keep:]
+        return out + samples[:len(samples) - keep].tobytes()
+
+    def finish(self) -> bytes:
+        """Return the remaining held back PCM"""
+        out = self._tail.tobytes()
+        self._tail = array("h")
+        return out
+
+
+def stitch_pcm(segments: List[bytes], sample_rate: int = 24000, pad_ms: int = 0, crossfade_ms: int = 0) -> bytes:
+    """
+    Join 16-bit mono PCM segments in order
+
+    Args:
+        segments: PCM segments in playback order
+        sample_rate: Sample rate in Hz
+        pad_ms: Silence inserted between segments
+        crossfade_ms: Length of the linear fade applied at each join
+
+    Returns:
+        The joined PCM
+    """
+    stitcher = PcmStitcher(sample_rate, pad_ms, crossfade_ms)
+    parts = [stitcher.add(segment) for segment in segments]
+    parts.append(stitcher.finish())
+    return b"".join(parts)
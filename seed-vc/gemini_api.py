@@ -1,20 +1,60 @@
 import os
+import asyncio
 import logging
 import base64
-import requests
 import struct
 import wave
 import io
-from typing import Optional, Dict
+import json
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
 from enum import Enum
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+import httpx
+
+from backend_router import BackendAdapter, BackendPool, register_adapter
+from chunking import PcmStitcher, split_text
+from observability import detail_enabled
+from metrics import UPSTREAM_ERRORS, UPSTREAM_REQUESTS, StageTimer, observe_stage, stage
+from upstream_governor import RETRYABLE_STATUS_CODES, UpstreamGovernor, UpstreamUnavailableError, parse_retry_after
+
 logger = logging.getLogger(__name__)
 
 # Gemini API configuration
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+GEMINI_API_URL = os.getenv("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models")
+# Comma separated instances to balance across (regional endpoints, proxies, mock servers)
+GEMINI_API_URLS = [url.strip() for url in os.getenv("GEMINI_API_URLS", GEMINI_API_URL).split(",") if url.strip()]
 GEMINI_TTS_MODEL = "gemini-2.5-flash-preview-tts"
+GEMINI_STT_MODEL = os.getenv("GEMINI_STT_MODEL", "gemini-2.5-flash")  # Model that transcribes audio
+
+# Upstream HTTP client configuration
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "10"))
+GEMINI_READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", "120"))
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "20"))
+GEMINI_KEEPALIVE_EXPIRY = float(os.getenv("GEMINI_KEEPALIVE_EXPIRY", "60"))
+# Maximum number of upstream requests in flight per process
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+# Long text chunking configuration
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "1500"))  # Maximum characters per upstream request
+TTS_CHUNK_WORKERS = int(os.getenv("TTS_CHUNK_WORKERS", "4"))  # Chunks synthesized concurrently per request
+TTS_CHUNK_PAD_MS = int(os.getenv("TTS_CHUNK_PAD_MS", "120"))  # Silence between chunks
+TTS_CHUNK_CROSSFADE_MS = int(os.getenv("TTS_CHUNK_CROSSFADE_MS", "10"))  # Fade at each join
+
+# Base64 characters decoded at a time while streaming a response (multiple of 4)
+DECODE_BLOCK_SIZE = 64 * 1024
+
+# Quota, retry and circuit breaker state shared by all upstream requests
+upstream_governor = UpstreamGovernor()
+
+# Shared client and concurrency limit, bound to the event loop that created them
+_http_client: Optional[httpx.AsyncClient] = None
+_http_semaphore: Optional[asyncio.Semaphore] = None
+_http_loop: Optional[asyncio.AbstractEventLoop] = None
 
 def get_api_key():
     """Get the Gemini API key from environment variables"""
@@ -33,23 +73,199 @@ def convert_pcm_to_wav(pcm_data: bytes, sample_rate: int = 24000, channels: int
     Returns:
         WAV formatted audio data as bytes
     """
-    # Create a BytesIO buffer to write WAV data
-    wav_buffer = io.BytesIO()
+    with stage("convert_pcm_to_wav"):
+        # Create a BytesIO buffer to write WAV data
+        wav_buffer = io.BytesIO()
 
-    # Create a wave file writer
-    with wave.open(wav_buffer, 'wb') as wav_file:
-        wav_file.setnchannels(channels)
-        wav_file.setsampwidth(sample_width)
-        wav_file.setframerate(sample_rate)
-        wav_file.writeframes(pcm_data)
+        # Create a wave file writer
+        with wave.open(wav_buffer, 'wb') as wav_file:
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(sample_width)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(pcm_data)
 
-    # Get the WAV data
-    wav_data = wav_buffer.getvalue()
-    wav_buffer.close()
+        # Get the WAV data
+        wav_data = wav_buffer.getvalue()
+        wav_buffer.close()
 
-    logger.info(f"Converted PCM data ({len(pcm_data)} bytes) to WAV format ({len(wav_data)} bytes)")
     return wav_data
 
+def build_wav_header(data_size: int = 0xFFFFFFFF, sample_rate: int = 24000, channels: int = 1,
+                     sample_width: int = 2) -> bytes:
+    """
+    Build a 44 byte RIFF/WAVE header
+
+    Args:
+        data_size: Size of the PCM payload in bytes. The default marks the
+            length as unknown, which players accept for streamed audio.
+        sample_rate: Sample rate in Hz (default: 24000 for Gemini)
+        channels: Number of audio channels (default: 1 for mono)
+        sample_width: Sample width in bytes (default: 2 for 16-bit)
+
+    Returns:
+        WAV header as bytes
+    """
+    data_size = min(data_size, 0xFFFFFFFF - 36)
+    byte_rate = sample_rate * channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", data_size + 36, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, byte_rate, channels * sample_width, sample_width * 8,
+        b"data", data_size,
+    )
+
+class WavFileWriter:
+    """
+    Write PCM into a WAV file incrementally
+
+    A header with an unknown length is written up front and patched with the
+    real sizes on close, so PCM never has to be held in memory. Writes and
+    close may come from different worker threads.
+    """
+
+    def __init__(self, path: Path, sample_rate: int = 24000, channels: int = 1, sample_width: int = 2):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.data_size = 0
+        self._timer = StageTimer("disk_write")
+        # A cancelled request can close the file while a worker thread is still writing to it
+        self._lock = threading.Lock()
+        with self._timer.measure():
+            self._file = open(self.path, "wb")
+            self._file.write(build_wav_header(0xFFFFFFFF, sample_rate, channels, sample_width))
+
+    def write(self, pcm: bytes):
+        with self._lock, self._timer.measure():
+            self._file.write(pcm)
+            self.data_size += len(pcm)
+
+    @property
+    def file_size(self) -> int:
+        return self.data_size + 44
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            with self._timer.measure():
+                self._file.seek(0)
+                self._file.write(build_wav_header(self.data_size, self.sample_rate, self.channels, self.sample_width))
+                self._file.close()
+        self._timer.observe()
+
+    def __enter__(self) -> "WavFileWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def assemble_wav_files(sources: List[Path], path: Path, pad_ms: int = 0, crossfade_ms: int = 0) -> Optional[int]:
+    """
+    Join 24 kHz 16-bit mono WAV files in order into a new WAV file
+
+    Args:
+        sources: WAV files in playback order
+        path: Destination WAV file
+        pad_ms: Silence inserted between files
+        crossfade_ms: Length of the fade applied at each join
+
+    Returns:
+        Size of the written file in bytes or None if a source is missing or unreadable
+    """
+    stitcher = PcmStitcher(pad_ms=pad_ms, crossfade_ms=crossfade_ms)
+    try:
+        with WavFileWriter(path) as writer:
+            for source in sources:
+                with wave.open(str(source), "rb") as wav_file:
+                    writer.write(stitcher.add(wav_file.readframes(wav_file.getnframes())))
+            writer.write(stitcher.finish())
+    except (OSError, EOFError, wave.Error) as e:
+        logger.error(f"Error assembling {path.name}: {e}")
+        Path(path).unlink(missing_ok=True)
+        return None
+    return writer.file_size
+
+
+class InlineDataDecoder:
+    """
+    Incrementally extract and decode the audio from a generateContent response
+
+    Scans the raw response bytes for the ``inlineData.data`` string and
+    base64-decodes it in fixed-size blocks as it arrives, passing PCM to
+    ``sink``. Only one block of base64 is buffered at a time, so memory use
+    does not depend on the length of the clip.
+    """
+
+    _MARKER = b'"inlineData"'
+    _DATA_KEY = re.compile(rb'"data"\s*:\s*"')
+    # Longest partial match kept between feeds while searching for the key
+    _SEARCH_TAIL = 256
+    # Bytes of the response kept for error reporting
+    _HEAD_SIZE = 2048
+
+    def __init__(self, sink: Callable[[bytes], None], block_size: int = DECODE_BLOCK_SIZE):
+        self.sink = sink
+        self.block_size = block_size
+        self.decoded_bytes = 0
+        self.head = bytearray()
+        self._state = "marker"
+        self._search = bytearray()
+        self._pending = bytearray()
+        self.timer = StageTimer("base64_decode")
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, data: bytes):
+        if len(self.head) < self._HEAD_SIZE:
+            self.head += data[:self._HEAD_SIZE - len(self.head)]
+        if self._state == "done":
+            return
+
+        if self._state != "data":
+            self._search += data
+            if self._state == "marker":
+                index = self._search.find(self._MARKER)
+                if index < 0:
+                    del self._search[:-len(self._MARKER)]
+                    return
+                del self._search[:index + len(self._MARKER)]
+                self._state = "key"
+
+            match = self._DATA_KEY.search(self._search)
+            if not match:
+                del self._search[:-self._SEARCH_TAIL]
+                return
+            data = bytes(self._search[match.end():])
+            self._search = bytearray()
+            self._state = "data"
+
+        end = data.find(b'"')
+        if end >= 0:
+            data = data[:end]
+        # Base64 never contains a backslash, so the only possible escape is "\/"
+        self._pending += data.replace(b"\\", b"")
+
+        if end >= 0:
+            self._decode(len(self._pending))
+            self._state = "done"
+        elif len(self._pending) >= self.block_size:
+            self._decode(len(self._pending) // 4 * 4)
+
+    def _decode(self, length: int):
+        if not length:
+            return
+        with self.timer.measure():
+            pcm = base64.b64decode(bytes(self._pending[:length]))
+            del self._pending[:length]
+        self.decoded_bytes += len(pcm)
+        self.sink(pcm)
+
+
 class VoiceName(str, Enum):
     """Available Gemini TTS voices"""
     ZEPHYR = "Zephyr"  # Bright
@@ -83,6 +299,8 @@ class VoiceName(str, Enum):
     SADALTAGER = "Sadaltager"  # Knowledgeable
     SULAFAR = "Sulafar"  # Warm
 
+VALID_VOICES = frozenset(v.value for v in VoiceName)
+
 # Voice descriptions for UI display
 VOICE_DESCRIPTIONS = {
     "Zephyr": "Bright",
@@ -121,38 +339,84 @@ def get_all_voices() -> Dict[str, str]:
     """Return all available voices with their descriptions"""
     return VOICE_DESCRIPTIONS
 
-def generate_tts(text: str, voice_name: str) -> Optional[bytes]:
+def get_http_client() -> httpx.AsyncClient:
     """
-    Generate text-to-speech audio using Gemini API
+    Return the shared upstream HTTP client for the running event loop
 
-    Args:
-        text: The text to convert to speech
-        voice_name: The name of the voice to use
+    The client keeps a pool of keep-alive connections to the Gemini API so
+    that requests do not pay for a new TCP/TLS handshake each time.
+    """
+    global _http_client, _http_semaphore, _http_loop
 
-    Returns:
-        Audio data as bytes or None if generation failed
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_loop is not loop or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(GEMINI_READ_TIMEOUT, connect=GEMINI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=GEMINI_MAX_CONNECTIONS,
+                max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+                keepalive_expiry=GEMINI_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _http_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+        _http_loop = loop
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared upstream HTTP client"""
+    global _http_client, _http_semaphore, _http_loop
+
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _http_semaphore = None
+    _http_loop = None
+
+
+def _run_sync(coroutine_fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Run an async generation function from synchronous code"""
+    async def runner():
+        try:
+            return await coroutine_fn()
+        finally:
+            await close_http_client()
+
+    return asyncio.run(runner())
+
+
+@register_adapter
+class GeminiAdapter(BackendAdapter):
     """
-    logger.info(f"generate_tts called with voice: '{voice_name}', text length: {len(text)}")
+    Gemini generateContent API; instances are ``.../v1beta/models`` base URLs
 
-    api_key = get_api_key()
-    if not api_key:
-        logger.error("GEMINI_API_KEY environment variable not set")
-        return None
+    Synthesis goes through the governed, chunked path of this module, which
+    also builds its request URLs with ``generate_url`` and ``stream_url``.
+    """
 
-    logger.info(f"Using Gemini API key: {api_key[:10]}...")
+    name = "gemini"
 
-    # Validate voice name
-    valid_voices = [v.value for v in VoiceName]
-    logger.info(f"Valid voices: {valid_voices}")
+    async def synthesize(self, text: str, voice: str, sink: Callable[[bytes], None]) -> bool:
+        return await synthesize_to_sink_async(text, voice, sink)
 
-    if voice_name not in valid_voices:
-        logger.error(f"Invalid voice name: '{voice_name}'. Valid voices: {valid_voices}")
-        return None
+    def generate_url(self, base_url: str, api_key: str, model: str = GEMINI_TTS_MODEL) -> str:
+        return f"{base_url}/{model}:generateContent?key={api_key}"
+
+    def stream_url(self, base_url: str, api_key: str) -> str:
+        return f"{base_url}/{GEMINI_TTS_MODEL}:streamGenerateContent?alt=sse&key={api_key}"
+
+    def probe_url(self, base_url: str, api_key: str) -> str:
+        # models.get is cheap and does not count against the generation quota
+        return f"{base_url}/{GEMINI_TTS_MODEL}?key={api_key}"
+
+
+# Instances of the upstream, balanced by outstanding requests with failover
+gemini_backends = BackendPool(GeminiAdapter(), GEMINI_API_URLS, lambda: get_http_client(), get_api_key)
 
-    # Prepare the request payload
-    url = f"{GEMINI_API_URL}/{GEMINI_TTS_MODEL}:generateContent?key={api_key}"
 
-    payload = {
+def build_tts_payload(text: str, voice_name: str) -> dict:
+    """Build the generateContent payload for a single-voice request"""
+    return {
         "contents": [{"parts": [{"text": text}]}],
         "generationConfig": {
             "responseModalities": ["AUDIO"],
@@ -166,58 +430,521 @@ def generate_tts(text: str, voice_name: str) -> Optional[bytes]:
         }
     }
 
+
+def build_multi_speaker_payload(text: str, speakers: Dict[str, str]) -> dict:
+    """Build the generateContent payload for a multi-speaker request"""
+    # Create speaker voice configs
+    speaker_voice_configs = []
+    for speaker, voice in speakers.items():
+        speaker_voice_configs.append({
+            "speaker": speaker,
+            "voiceConfig": {
+                "prebuiltVoiceConfig": {
+                    "voiceName": voice
+                }
+            }
+        })
+
+    return {
+        "contents": [{"parts": [{"text": text}]}],
+        "generationConfig": {
+            "responseModalities": ["AUDIO"],
+            "speechConfig": {
+                "multiSpeakerVoiceConfig": {
+                    "speakerVoiceConfigs": speaker_voice_configs
+                }
+            }
+        }
+    }
+
+
+def build_transcription_payload(wav: bytes, language: Optional[str] = None) -> dict:
+    """Build the generateContent payload asking for a verbatim transcript of a WAV clip"""
+    prompt = ("Transcribe the speech in this audio verbatim. Reply with the spoken words only, without "
+              "timestamps, speaker labels or commentary. Reply with nothing if there is no speech.")
+    if language:
+        prompt += f" The speech is in {language}."
+    return {
+        "contents": [{"parts": [
+            {"text": prompt},
+            {"inlineData": {"mimeType": "audio/wav", "data": base64.b64encode(wav).decode("ascii")}},
+        ]}],
+        "generationConfig": {
+            "temperature": 0
+        }
+    }
+
+
+def describe_payload(payload: dict) -> str:
+    """Summarize a generateContent payload for logs: text is shortened and inline audio reduced to its size"""
+    parts = []
+    for content in payload.get("contents", []):
+        for part in content.get("parts", []):
+            if "inlineData" in part:
+                parts.append(f"{part['inlineData'].get('mimeType')} ({len(part['inlineData'].get('data', ''))} "
+                             f"base64 chars)")
+            elif "text" in part:
+                text = part["text"]
+                parts.append(repr(text[:80] + "..." if len(text) > 80 else text))
+    return f"parts=[{', '.join(parts)}] generationConfig={json.dumps(payload.get('generationConfig', {}))}"
+
+
+def _admit(chars: int) -> float:
+    """Admit an upstream attempt through the governor, counting rejections"""
     try:
-        logger.info(f"Making request to Gemini API: {url}")
-        logger.info(f"Payload: {payload}")
+        return upstream_governor.admit(chars)
+    except UpstreamUnavailableError as e:
+        UPSTREAM_ERRORS.labels("circuit_open" if "circuit" in str(e) else "quota").inc()
+        raise
+
+
+def _count_upstream_error(reason: str):
+    UPSTREAM_REQUESTS.labels("error").inc()
+    UPSTREAM_ERRORS.labels(reason).inc()
+
+
+@asynccontextmanager
+async def _upstream_attempt(decoder: "InlineDataDecoder"):
+    """Time one upstream attempt and the base64 decoding done within it"""
+    try:
+        with stage("upstream_call"):
+            yield
+    finally:
+        decoder.timer.observe()
+
+
+class _Attempt:
+    """One upstream attempt on one backend instance and what it told us"""
 
-        response = requests.post(url, json=payload)
-        logger.info(f"Response status code: {response.status_code}")
+    def __init__(self, number: int, instance):
+        self.number = number
+        self.instance = instance
+        # Passed to the pool on release: None when the outcome says nothing about the instance
+        self.instance_ok: Optional[bool] = None
+        self.retry_after: Optional[float] = None
+        # Whether the circuit breaker has been told how the attempt went
+        self.recorded = False
 
-        response.raise_for_status()
+    def succeeded(self):
+        upstream_governor.record_success()
+        self.recorded = True
+        self.instance_ok = True
+        UPSTREAM_REQUESTS.labels("success").inc()
 
-        # Extract audio data from response
-        response_json = response.json()
-        logger.info(f"Response JSON keys: {list(response_json.keys())}")
+    def http_error(self, response: httpx.Response) -> bool:
+        """Record an HTTP error response and tell whether it is worth retrying"""
+        _count_upstream_error(str(response.status_code))
+        self.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if response.status_code == 429:
+            # Quota pushback is paced by Retry-After; it says nothing about upstream health or this instance
+            upstream_governor.record_rate_limited()
+            return True
+        self.recorded = True
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            # The upstream is healthy, the request is not
+            upstream_governor.record_success()
+            self.instance_ok = True
+            return False
+        upstream_governor.record_failure()
+        self.instance_ok = False
+        return True
 
-        if "candidates" in response_json and len(response_json["candidates"]) > 0:
-            candidate = response_json["candidates"][0]
-            logger.info(f"Candidate keys: {list(candidate.keys())}")
+    def transport_error(self):
+        self._failed("transport")
 
-            if "content" in candidate and "parts" in candidate["content"]:
-                parts = candidate["content"]["parts"]
-                logger.info(f"Found {len(parts)} parts in response")
+    def malformed_response(self):
+        self._failed("malformed")
 
-                if len(parts) > 0 and "inlineData" in parts[0]:
-                    inline_data = parts[0]["inlineData"]
-                    logger.info(f"Inline data keys: {list(inline_data.keys())}")
+    def _failed(self, reason: str):
+        _count_upstream_error(reason)
+        upstream_governor.record_failure()
+        self.recorded = True
+        self.instance_ok = False
 
-                    if "mimeType" in inline_data:
-                        logger.info(f"Audio MIME type: {inline_data['mimeType']}")
 
-                    if "data" in inline_data:
-                        # Decode base64 audio data
-                        raw_audio_data = base64.b64decode(inline_data["data"])
-                        logger.info(f"Successfully decoded raw audio data: {len(raw_audio_data)} bytes")
-                        logger.info(f"First 20 bytes: {[hex(b) for b in raw_audio_data[:20]]}")
+class _UpstreamCall:
+    """
+    The attempts of one upstream request
+
+    Each attempt is admitted by the shared upstream governor and sent to an
+    instance from the backend pool. Before a retry the call fails over to an
+    instance not tried yet if the last one failed, and otherwise backs off,
+    honouring Retry-After. Callers run attempts while any are left and
+    return from inside one as soon as the outcome is final::
+
+        call = _UpstreamCall("TTS", len(text))
+        while call.attempts_left():
+            async with call.attempt() as attempt:
+                ...
+        call.raise_if_rate_limited()
+    """
+
+    def __init__(self, label: str, chars: int = 0):
+        self.label = label
+        self.chars = chars
+        self.tried = set()
+        self.last: Optional[_Attempt] = None
+
+    def attempts_left(self) -> bool:
+        return self.last is None or self.last.number <= upstream_governor.max_retries
+
+    async def _wait_for_retry(self, number: int):
+        last = self.last
+        if last.instance_ok is False and gemini_backends.can_fail_over(self.tried):
+            logger.warning(f"Failing over {self.label} from {last.instance.url} (attempt {number})")
+            return
+        delay = upstream_governor.backoff(last.number - 1, last.retry_after)
+        logger.warning(f"Retrying {self.label} in {delay:.2f}s (attempt {number})")
+        await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def attempt(self) -> AsyncIterator[_Attempt]:
+        """
+        Admit and run the next attempt
+
+        Raises:
+            UpstreamUnavailableError: If the upstream is over quota or the circuit is open
+        """
+        number = 1 if self.last is None else self.last.number + 1
+        if self.last is not None:
+            await self._wait_for_retry(number)
+        delay = _admit(self.chars)
+        # A half-open breaker admits a single trial and waits for its outcome
+        trial = upstream_governor.breaker.state == "half_open"
+        attempt = None
+        try:
+            await asyncio.sleep(delay)
+            instance = gemini_backends.acquire(exclude=self.tried)
+            self.tried.add(instance)
+            attempt = self.last = _Attempt(number, instance)
+            try:
+                yield attempt
+            finally:
+                gemini_backends.release(instance, attempt.instance_ok)
+        finally:
+            if trial and (attempt is None or not attempt.recorded):
+                # Cancelled, closed early, rate limited or failed locally: let another request be the trial
+                upstream_governor.breaker.release_trial()
+
+    def raise_if_rate_limited(self):
+        """Raise if the last attempt was turned away with a Retry-After"""
+        if self.last is not None and self.last.retry_after is not None:
+            raise UpstreamUnavailableError("Upstream rate limit exceeded", self.last.retry_after)
 
-                        # Convert raw PCM to WAV format
-                        wav_audio_data = convert_pcm_to_wav(raw_audio_data)
-                        return wav_audio_data
 
-        logger.error(f"Failed to extract audio data from response: {response_json}")
+async def _stream_generate_pcm(payload: dict, sink: Callable[[bytes], None], label: str, chars: int = 0) -> bool:
+    """
+    Run a generateContent request, decoding the audio into sink as it downloads
+
+    Each attempt is admitted by the shared upstream governor. 429/5xx
+    responses and connection errors are retried with backoff as long as no
+    audio has reached the sink yet. The response is decoded, and sink
+    called, in a worker thread one block at a time.
+
+    Args:
+        payload: generateContent request payload
+        sink: Called from a worker thread with each block of decoded PCM
+        label: Short description used in log messages
+        chars: Input characters, charged against the character quota
+
+    Returns:
+        True if audio was decoded, False if generation failed
+
+    Raises:
+        UpstreamUnavailableError: If the upstream is over quota or the circuit is open
+    """
+    api_key = get_api_key()
+    if not api_key:
+        logger.error("GEMINI_API_KEY environment variable not set")
+        return False
+
+    call = _UpstreamCall(label, chars)
+    while call.attempts_left():
+        async with call.attempt() as attempt:
+            decoder = InlineDataDecoder(sink)
+            url = gemini_backends.adapter.generate_url(attempt.instance.url, api_key)
+            try:
+                if detail_enabled():
+                    logger.info(f"Requesting {label} from {attempt.instance.url} (attempt {attempt.number}): "
+                                f"{describe_payload(payload)}")
+
+                client = get_http_client()
+                async with _http_semaphore, _upstream_attempt(decoder):
+                    async with client.stream("POST", url, json=payload) as response:
+                        if response.status_code >= 400:
+                            body = await response.aread()
+                            logger.error(f"HTTP error generating {label}: {response.status_code}")
+                            logger.error(f"Response content: {body[:500]!r}")
+                            if not attempt.http_error(response):
+                                return False
+                        else:
+                            async for data in response.aiter_bytes(DECODE_BLOCK_SIZE):
+                                # Base64 decoding and the sink's disk writes stay off the event loop
+                                await asyncio.to_thread(decoder.feed, data)
+                                if decoder.done:
+                                    # Nothing after the audio is needed
+                                    break
+                            attempt.succeeded()
+
+                            if not decoder.done or not decoder.decoded_bytes:
+                                logger.error(f"No audio data in response starting {bytes(decoder.head[:200])!r}")
+                                return False
+
+                            if detail_enabled():
+                                logger.info(f"Decoded {decoder.decoded_bytes} bytes of {label} audio")
+                            return True
+
+            except httpx.TransportError as e:
+                logger.error(f"Error generating {label} on {attempt.instance.url}: {e!r}")
+                attempt.transport_error()
+                if decoder.decoded_bytes:
+                    # Part of the audio already reached the sink
+                    return False
+            except Exception as e:
+                logger.error(f"Error generating {label}: {e}")
+                return False
+
+    call.raise_if_rate_limited()
+    return False
+
+
+async def transcribe_pcm_async(pcm: bytes, sample_rate: int, language: Optional[str] = None,
+                               label: str = "STT") -> Optional[str]:
+    """
+    Transcribe a clip of 16-bit mono PCM with a single upstream request
+
+    Attempts go through the same governor, instance pool and retry policy as
+    synthesis requests.
+
+    Args:
+        pcm: Raw 16-bit mono PCM
+        sample_rate: Sample rate of ``pcm`` in Hz
+        language: Optional hint of the spoken language
+        label: Short description used in log messages
+
+    Returns:
+        The transcript (empty for silence) or None if transcription failed
+
+    Raises:
+        UpstreamUnavailableError: If the upstream is over quota or the circuit is open
+    """
+    api_key = get_api_key()
+    if not api_key:
+        logger.error("GEMINI_API_KEY environment variable not set")
+        return None
+
+    payload = build_transcription_payload(build_wav_header(len(pcm), sample_rate) + pcm, language)
+    call = _UpstreamCall(label)
+    while call.attempts_left():
+        async with call.attempt() as attempt:
+            url = gemini_backends.adapter.generate_url(attempt.instance.url, api_key, GEMINI_STT_MODEL)
+            try:
+                client = get_http_client()
+                async with _http_semaphore:
+                    with stage("upstream_call"):
+                        response = await client.post(url, json=payload)
+                if response.status_code >= 400:
+                    logger.error(f"HTTP error generating {label}: {response.status_code}")
+                    logger.error(f"Response content: {response.content[:500]!r}")
+                    if not attempt.http_error(response):
+                        return None
+                else:
+                    attempt.succeeded()
+                    try:
+                        candidates = response.json().get("candidates") or [{}]
+                        parts = candidates[0].get("content", {}).get("parts", [])
+                        return "".join(part.get("text", "") for part in parts).strip()
+                    except (ValueError, AttributeError, IndexError):
+                        logger.error(f"Failed to extract the transcript from response: {response.content[:500]!r}")
+                        return None
+            except httpx.TransportError as e:
+                logger.error(f"Error generating {label} on {attempt.instance.url}: {e!r}")
+                attempt.transport_error()
+            except Exception as e:
+                logger.error(f"Error generating {label}: {e}")
+                return None
+
+    call.raise_if_rate_limited()
+    return None
+
+
+def _validate_voices(voices: Dict[str, str]) -> bool:
+    for speaker, voice in voices.items():
+        if voice not in VALID_VOICES:
+            logger.error(f"Invalid voice name for {speaker}: '{voice}'")
+            return False
+    return True
+
+
+async def synthesize_pcm_async(text: str, voice_name: str) -> Optional[bytes]:
+    """
+    Synthesize text with a single upstream request
+
+    Args:
+        text: The text to convert to speech
+        voice_name: The name of the voice to use
+
+    Returns:
+        Raw 16-bit 24 kHz mono PCM or None if generation failed
+    """
+    if detail_enabled():
+        logger.info(f"generate_tts called with voice: '{voice_name}', text length: {len(text)}")
+
+    if not _validate_voices({"voice": voice_name}):
         return None
 
-    except requests.exceptions.HTTPError as e:
-        logger.error(f"HTTP error generating TTS: {e}")
-        logger.error(f"Response content: {response.text if 'response' in locals() else 'No response'}")
+    pcm = bytearray()
+    if not await _stream_generate_pcm(build_tts_payload(text, voice_name), pcm.extend, "TTS", len(text)):
         return None
+    return bytes(pcm)
+
+
+async def synthesize_to_sink_async(text: str, voice_name: str, sink: Callable[[bytes], None],
+                                   max_chars: int = TTS_CHUNK_CHARS, workers: int = TTS_CHUNK_WORKERS) -> bool:
+    """
+    Synthesize arbitrarily long text, passing PCM to sink in playback order
+
+    Short texts are a single upstream request decoded straight into sink.
+    Longer texts are split at paragraph and sentence boundaries into chunks of
+    at most max_chars characters and synthesized concurrently; transient
+    upstream errors are retried per chunk by the upstream governor, and any
+    other failure fails the whole text. At most ``workers`` chunks are in flight
+    or waiting to be written, which bounds memory use for long inputs.
+
+    Args:
+        text: The text to convert to speech
+        voice_name: The name of the voice to use
+        sink: Called from a worker thread with raw 16-bit 24 kHz mono PCM blocks
+        max_chars: Maximum characters per upstream request
+        workers: Maximum chunks in flight for this request
+
+    Returns:
+        True on success, False if generation (or any chunk) failed
+    """
+    chunks = split_text(text, max_chars)
+    if len(chunks) <= 1:
+        if detail_enabled():
+            logger.info(f"generate_tts called with voice: '{voice_name}', text length: {len(text)}")
+        if not _validate_voices({"voice": voice_name}):
+            return False
+        return await _stream_generate_pcm(build_tts_payload(text, voice_name), sink, "TTS", len(text))
+
+    logger.info(f"Synthesizing {len(chunks)} chunks of up to {max_chars} characters with {workers} workers")
+    # A slot is released once its chunk has been written, not when it finishes
+    window = asyncio.Semaphore(workers)
+
+    async def render(index: int, chunk: str) -> bytes:
+        await window.acquire()
+        # Retryable errors were already retried upstream; what is left would fail again
+        pcm = await synthesize_pcm_async(chunk, voice_name)
+        if not pcm:
+            raise RuntimeError(f"Chunk {index + 1}/{len(chunks)} failed")
+        return pcm
+
+    tasks = [asyncio.ensure_future(render(i, chunk)) for i, chunk in enumerate(chunks)]
+    stitcher = PcmStitcher(pad_ms=TTS_CHUNK_PAD_MS, crossfade_ms=TTS_CHUNK_CROSSFADE_MS)
+    try:
+        for task in tasks:
+            pcm = await task
+            await asyncio.to_thread(lambda: sink(stitcher.add(pcm)))
+            window.release()
+        await asyncio.to_thread(lambda: sink(stitcher.finish()))
+        return True
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
-        logger.error(f"Error generating TTS: {e}")
+        logger.error(f"Error generating chunked TTS: {e}")
+        return False
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def synthesize_long_pcm_async(text: str, voice_name: str, max_chars: int = TTS_CHUNK_CHARS,
+                                    workers: int = TTS_CHUNK_WORKERS) -> Optional[bytes]:
+    """
+    Synthesize arbitrarily long text into memory
+
+    See synthesize_to_sink_async for how long texts are split.
+
+    Returns:
+        Raw 16-bit 24 kHz mono PCM or None if generation failed
+    """
+    pcm = bytearray()
+    if not await synthesize_to_sink_async(text, voice_name, pcm.extend, max_chars, workers):
         return None
+    return bytes(pcm)
 
-def generate_multi_speaker_tts(text: str, speakers: Dict[str, str]) -> Optional[bytes]:
+
+async def generate_tts_async(text: str, voice_name: str) -> Optional[bytes]:
+    """
+    Generate text-to-speech audio using Gemini API without blocking the event loop
+
+    Texts longer than TTS_CHUNK_CHARS are split and synthesized in parallel.
+
+    Args:
+        text: The text to convert to speech
+        voice_name: The name of the voice to use
+
+    Returns:
+        Audio data as bytes or None if generation failed
+    """
+    pcm = await synthesize_long_pcm_async(text, voice_name)
+    if not pcm:
+        return None
+
+    # Convert raw PCM to WAV format
+    return convert_pcm_to_wav(pcm)
+
+
+async def generate_tts_to_file_async(text: str, voice_name: str, path: Path) -> Optional[int]:
+    """
+    Generate text-to-speech audio straight into a WAV file
+
+    The response is decoded incrementally and PCM is written as it arrives,
+    so peak memory stays roughly constant regardless of clip length. The
+    file is left in place only on success.
+
+    Args:
+        text: The text to convert to speech
+        voice_name: The name of the voice to use
+        path: Destination WAV file
+
+    Returns:
+        Size of the written file in bytes or None if generation failed
+    """
+    return await synthesize_to_file_async(gemini_backends.adapter, text, voice_name, path)
+
+
+async def synthesize_to_file_async(backend: BackendAdapter, text: str, voice: str, path: Path) -> Optional[int]:
+    """
+    Synthesize text with any backend straight into a WAV file
+
+    The file is left in place only on success.
+
+    Args:
+        backend: Adapter of the synthesis backend
+        text: The text to convert to speech
+        voice: The name of the voice, as the backend knows it
+        path: Destination WAV file
+
+    Returns:
+        Size of the written file in bytes or None if synthesis failed
+    """
+    writer = await asyncio.to_thread(WavFileWriter, path, backend.sample_rate)
+    try:
+        ok = await backend.synthesize(text, voice, writer.write)
+    finally:
+        await asyncio.to_thread(writer.close)
+    if not ok or not writer.data_size:
+        Path(path).unlink(missing_ok=True)
+        return None
+    return writer.file_size
+
+
+async def generate_multi_speaker_tts_async(text: str, speakers: Dict[str, str]) -> Optional[bytes]:
     """
-    Generate multi-speaker text-to-speech audio using Gemini API
+    Generate multi-speaker text-to-speech audio using Gemini API without blocking the event loop
 
     Args:
         text: The text to convert to speech (with speaker annotations)
@@ -226,70 +953,149 @@ def generate_multi_speaker_tts(text: str, speakers: Dict[str, str]) -> Optional[
     Returns:
         Audio data as bytes or None if generation failed
     """
-    api_key = get_api_key()
-    if not api_key:
-        logger.error("GEMINI_API_KEY environment variable not set")
+    if not _validate_voices({f"speaker {speaker}": voice for speaker, voice in speakers.items()}):
         return None
 
-    # Validate voice names
-    valid_voices = [v.value for v in VoiceName]
-    for speaker, voice in speakers.items():
-        if voice not in valid_voices:
-            logger.error(f"Invalid voice name for speaker {speaker}: {voice}")
-            return None
+    pcm = bytearray()
+    if not await _stream_generate_pcm(build_multi_speaker_payload(text, speakers), pcm.extend, "multi-speaker TTS",
+                                      len(text)):
+        return None
 
-    # Prepare the request payload
-    url = f"{GEMINI_API_URL}/{GEMINI_TTS_MODEL}:generateContent?key={api_key}"
+    # Convert raw PCM to WAV format
+    return convert_pcm_to_wav(bytes(pcm))
 
-    # Create speaker voice configs
-    speaker_voice_configs = []
-    for speaker, voice in speakers.items():
-        speaker_voice_configs.append({
-            "speaker": speaker,
-            "voiceConfig": {
-                "prebuiltVoiceConfig": {
-                    "voiceName": voice
-                }
-            }
-        })
 
-    payload = {
-        "contents": [{"parts": [{"text": text}]}],
-        "generationConfig": {
-            "responseModalities": ["AUDIO"],
-            "speechConfig": {
-                "multiSpeakerVoiceConfig": {
-                    "speakerVoiceConfigs": speaker_voice_configs
-                }
-            }
-        }
-    }
+async def generate_multi_speaker_tts_to_file_async(text: str, speakers: Dict[str, str], path: Path) -> Optional[int]:
+    """
+    Generate multi-speaker text-to-speech audio straight into a WAV file
 
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-
-        # Extract audio data from response
-        response_json = response.json()
-
-        if "candidates" in response_json and len(response_json["candidates"]) > 0:
-            candidate = response_json["candidates"][0]
-            if "content" in candidate and "parts" in candidate["content"]:
-                parts = candidate["content"]["parts"]
-                if len(parts) > 0 and "inlineData" in parts[0]:
-                    inline_data = parts[0]["inlineData"]
-                    if "data" in inline_data:
-                        # Decode base64 audio data
-                        raw_audio_data = base64.b64decode(inline_data["data"])
-                        logger.info(f"Successfully decoded raw multi-speaker audio data: {len(raw_audio_data)} bytes")
-
-                        # Convert raw PCM to WAV format
-                        wav_audio_data = convert_pcm_to_wav(raw_audio_data)
-                        return wav_audio_data
-
-        logger.error(f"Failed to extract audio data from response: {response_json}")
+    Args:
+        text: The text to convert to speech (with speaker annotations)
+        speakers: Dictionary mapping speaker names to voice names
+        path: Destination WAV file
+
+    Returns:
+        Size of the written file in bytes or None if generation failed
+    """
+    if not _validate_voices({f"speaker {speaker}": voice for speaker, voice in speakers.items()}):
         return None
 
-    except Exception as e:
-        logger.error(f"Error generating multi-speaker TTS: {e}")
+    writer = await asyncio.to_thread(WavFileWriter, path)
+    try:
+        ok = await _stream_generate_pcm(build_multi_speaker_payload(text, speakers), writer.write,
+                                        "multi-speaker TTS", len(text))
+    finally:
+        await asyncio.to_thread(writer.close)
+    if not ok:
+        Path(path).unlink(missing_ok=True)
         return None
+    return writer.file_size
+
+
+def _event_audio(data: str) -> List[bytes]:
+    """Decode the audio blocks of one streamGenerateContent event"""
+    event = json.loads(data)
+    if not isinstance(event, dict):
+        raise ValueError("Event is not a JSON object")
+    blocks = []
+    for candidate in (event.get("candidates") or [])[:1]:
+        for part in candidate.get("content", {}).get("parts", []):
+            inline = part.get("inlineData", {}).get("data")
+            if inline:
+                blocks.append(base64.b64decode(inline))
+    return blocks
+
+
+async def stream_tts_pcm(text: str, voice_name: str) -> AsyncIterator[bytes]:
+    """
+    Stream raw PCM audio from Gemini as it is synthesized
+
+    Uses the server-sent events flavour of streamGenerateContent and yields
+    each decoded audio chunk as soon as its event arrives.
+
+    Args:
+        text: The text to convert to speech
+        voice_name: The name of the voice to use
+
+    Yields:
+        Raw 16-bit 24 kHz mono PCM chunks
+
+    Raises:
+        RuntimeError: If the API key is missing or the upstream call fails
+        UpstreamUnavailableError: If the upstream is over quota or the circuit is open
+    """
+    api_key = get_api_key()
+    if not api_key:
+        raise RuntimeError("GEMINI_API_KEY environment variable not set")
+
+    payload = build_tts_payload(text, voice_name)
+    call = _UpstreamCall("streaming TTS", len(text))
+    while call.attempts_left():
+        async with call.attempt() as attempt:
+            yielded = False
+            started = time.perf_counter()
+            url = gemini_backends.adapter.stream_url(attempt.instance.url, api_key)
+            try:
+                client = get_http_client()
+                async with _http_semaphore:
+                    async with client.stream("POST", url, json=payload) as response:
+                        if response.status_code >= 400:
+                            body = await response.aread()
+                            message = (f"Gemini streaming request failed with status {response.status_code}: "
+                                       f"{body[:500]!r}")
+                            if not attempt.http_error(response):
+                                raise RuntimeError(message)
+                            logger.error(message)
+                        else:
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                try:
+                                    blocks = _event_audio(line[5:])
+                                except (ValueError, AttributeError, TypeError):
+                                    attempt.malformed_response()
+                                    raise RuntimeError(f"Gemini streaming request failed: malformed event "
+                                                       f"{line[:200]!r}")
+                                for pcm in blocks:
+                                    if not yielded:
+                                        yielded = True
+                                        observe_stage("upstream_first_audio", time.perf_counter() - started)
+                                    yield pcm
+                            attempt.succeeded()
+                            return
+            except httpx.TransportError as e:
+                attempt.transport_error()
+                if yielded:
+                    raise RuntimeError(f"Gemini stream interrupted: {e!r}")
+                logger.error(f"Error streaming TTS from {attempt.instance.url}: {e!r}")
+
+    call.raise_if_rate_limited()
+    raise RuntimeError("Gemini streaming request failed")
+
+
+def generate_tts(text: str, voice_name: str) -> Optional[bytes]:
+    """
+    Generate text-to-speech audio using Gemini API (blocking wrapper for scripts)
+
+    Args:
+        text: The text to convert to speech
+        voice_name: The name of the voice to use
+
+    Returns:
+        Audio data as bytes or None if generation failed
+    """
+    return _run_sync(lambda: generate_tts_async(text, voice_name))
+
+
+def generate_multi_speaker_tts(text: str, speakers: Dict[str, str]) -> Optional[bytes]:
+    """
+    Generate multi-speaker text-to-speech audio using Gemini API (blocking wrapper for scripts)
+
+    Args:
+        text: The text to convert to speech (with speaker annotations)
+        speakers: Dictionary mapping speaker names to voice names
+
+    Returns:
+        Audio data as bytes or None if generation failed
+    """
+    return _run_sync(lambda: generate_multi_speaker_tts_async(text, speakers))
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from shared_state import SharedStore, process_alive
+
+logger = logging.getLogger(__name__)
+
+# Idempotency configuration
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "./state/idempotency.db")  # Used when no shared store is configured
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))  # Seconds a key replays its response
+# Seconds after which a request still marked running is presumed lost and may run again
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "900"))
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", "0.25"))  # Waiting on another process
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class IdempotencyConflictError(Exception):
+    """Raised when a key is reused with a different request"""
+
+
+def request_fingerprint(endpoint: str, body: str) -> str:
+    """Hash the endpoint and canonical request body a key was first used with"""
+    return hashlib.sha256(f"{endpoint}\n{body}".encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Remembers the response of each request made with an Idempotency-Key.
+
+    The first request with a key runs and its response is stored in SQLite
+    for ``ttl`` seconds; repeats get that response back without doing the
+    work again. A repeat that arrives while the first is still running waits
+    for it, on the task itself in the same process or by polling the store
+    across processes. The work is shielded from client disconnects so the
+    retry that follows a timeout finds the finished result. Failed requests
+    release their key so a retry runs again.
+    """
+
+    def __init__(self, store: SharedStore, ttl: int = IDEMPOTENCY_TTL, lock_timeout: int = IDEMPOTENCY_LOCK_TIMEOUT,
+                 poll_interval: float = IDEMPOTENCY_POLL_INTERVAL):
+        self.store = store
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "executed": 0,
+            "replayed": 0,
+            "waited": 0,
+            "conflicts": 0,
+        }
+        self.store.executescript("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                status TEXT NOT NULL,
+                owner INTEGER,
+                created_at REAL NOT NULL,
+                response TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idempotency_keys_by_age ON idempotency_keys (created_at);
+        """)
+
+    def _claim(self, key: str, fingerprint: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Claim a key or report its state
+
+        Returns ("owner", None) when the caller should run the request,
+        ("running", None) when someone else is, and ("succeeded", response)
+        when it already finished. Callers in this process claim a key one at
+        a time, so a running row owned by this process is left over from a
+        request that was cancelled before it started.
+        """
+        now = time.time()
+        with self.store.transaction() as connection:
+            row = connection.execute(
+                "SELECT fingerprint, status, owner, created_at, response FROM idempotency_keys WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                stored_fingerprint, status, owner, created_at, response = row
+                expired = created_at < now - self.ttl
+                lost = status == "running" and (
+                    created_at < now - self.lock_timeout
+                    or not process_alive(owner)
+                    or owner == os.getpid()
+                )
+                if not expired and not lost:
+                    if stored_fingerprint != fingerprint:
+                        raise IdempotencyConflictError(key)
+                    return status, json.loads(response) if response else None
+            connection.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, status, owner, created_at, response) "
+                "VALUES (?, ?, 'running', ?, ?, NULL)",
+                (key, fingerprint, os.getpid(), now),
+            )
+        return "owner", None
+
+    def _complete(self, key: str, response: Dict[str, Any]):
+        self.store.execute("UPDATE idempotency_keys SET status = 'succeeded', owner = NULL, response = ? WHERE key = ?",
+                           (json.dumps(response), key))
+
+    def _release(self, key: str):
+        self.store.execute("DELETE FROM idempotency_keys WHERE key = ? AND status = 'running'", (key,))
+
+    async def forget(self, key: str):
+        """Drop a stored response, e.g. when the file it points to is gone"""
+        await asyncio.to_thread(self.store.execute, "DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+    async def run(self, key: str, fingerprint: str,
+                  fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """
+        Run ``fn`` once for a key
+
+        Returns:
+            The response and whether it was replayed rather than produced now
+
+        Raises:
+            IdempotencyConflictError: If the key was used with a different fingerprint
+        """
+        waited = False
+        while True:
+            pending = self._inflight.get(key)
+            if pending is not None:
+                # Claimed or running in this process: wait for it, then look at the key again
+                waited = True
+                try:
+                    await asyncio.shield(pending)
+                except Exception:
+                    # The original failed and released the key; claim it again
+                    pass
+                continue
+
+            # Registered before the claim runs in a thread, so requests in this process never race for it
+            claim = asyncio.get_running_loop().create_future()
+            self._inflight[key] = claim
+            try:
+                status, response = await asyncio.to_thread(self._claim, key, fingerprint)
+                if status == "owner":
+                    self.stats["executed"] += 1
+                    task = asyncio.ensure_future(self._execute(key, fn))
+                    self._inflight[key] = task
+                    task.add_done_callback(lambda done: self._forget_inflight(key, done))
+                    break
+            except IdempotencyConflictError:
+                self.stats["conflicts"] += 1
+                raise
+            finally:
+                self._forget_inflight(key, claim)
+                claim.set_result(None)
+
+            if status == "succeeded":
+                self.stats["waited" if waited else "replayed"] += 1
+                return response, True
+
+            # Running in another process
+            waited = True
+            await asyncio.sleep(self.poll_interval)
+
+        return await asyncio.shield(task), False
+
+    def _forget_inflight(self, key: str, future: "asyncio.Future"):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    async def _execute(self, key: str, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        try:
+            response = await fn()
+        except BaseException:
+            await asyncio.to_thread(self._release, key)
+            raise
+        await asyncio.to_thread(self._complete, key, response)
+        return response
+
+    def _expire(self) -> int:
+        with self.store.transaction() as connection:
+            return connection.execute("DELETE FROM idempotency_keys WHERE created_at < ? AND status = 'succeeded'",
+                                      (time.time() - self.ttl,)).rowcount
+
+    async def _reaper(self):
+        while True:
+            try:
+                expired = await asyncio.to_thread(self._expire)
+                if expired:
+                    logger.info(f"Expired {expired} idempotency keys")
+            except Exception as e:
+                logger.error(f"Idempotency key expiry failed: {e}", exc_info=True)
+            await asyncio.sleep(min(3600, max(1, self.ttl / 4)))
+
+    async def start(self):
+        self._task = asyncio.create_task(self._reaper())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> Dict[str, int]:
+        return {**self.stats, "in_flight": len(self._inflight)}
@@ -0,0 +1,347 @@
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from metrics import set_request_labels
+from shared_state import SharedStore, process_alive
+
+logger = logging.getLogger(__name__)
+
+# Job queue configuration
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))  # Seconds finished jobs stay queryable
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "20"))  # Seconds running jobs get to finish on shutdown
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.25"))  # Idle workers check the shared queue this often
+
+# Priority lanes, lowest value runs first
+JOB_PRIORITIES = {
+    "high": 0,
+    "normal": 1,
+    "low": 2,
+}
+
+JobHandler = Callable[[Any], Awaitable[Dict[str, Any]]]
+# Rebuilds a job request from its JSON form when jobs cross processes
+JobDecoder = Callable[[str], Any]
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    request: Any
+    priority: str
+    status: str = "queued"  # queued, running, succeeded, failed
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "type": self.kind,
+            "priority": self.priority,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs synthesis jobs on a fixed pool of worker tasks.
+
+    Jobs wait in a bounded priority queue; submitting to a full queue fails
+    immediately with a retry hint instead of piling up work. Finished jobs are
+    kept for ``result_ttl`` seconds so clients can poll for the result.
+    """
+
+    def __init__(self, handlers: Dict[str, JobHandler], workers: int = JOB_WORKERS,
+                 max_queue: int = JOB_QUEUE_SIZE, result_ttl: int = JOB_RESULT_TTL):
+        self.handlers = handlers
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks = []
+        self._running = 0
+        self._closing = False
+        self._sequence = itertools.count()
+        # Moving average of job run time, used for Retry-After
+        self._average_duration = 5.0
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+        logger.info(f"Job manager started with {self.workers} workers and a queue of {self.max_queue}")
+
+    async def stop(self, drain_timeout: float = JOB_DRAIN_TIMEOUT):
+        """Stop taking jobs, give running ones up to ``drain_timeout`` seconds, then cancel them"""
+        self._closing = True
+        deadline = time.monotonic() + drain_timeout
+        while self._running and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._running:
+            logger.warning(f"Cancelling {self._running} jobs still running after {drain_timeout}s")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, request: Any, priority: str = "normal") -> Job:
+        """
+        Queue a job
+
+        Raises:
+            QueueFullError: If the queue is at capacity
+        """
+        if self._queue is None:
+            raise RuntimeError("Job manager is not running")
+
+        job = Job(id=uuid.uuid4().hex, kind=kind, request=request, priority=priority)
+        try:
+            self._queue.put_nowait((JOB_PRIORITIES[priority], next(self._sequence), job))
+        except asyncio.QueueFull:
+            raise QueueFullError(self.retry_after())
+        self._jobs[job.id] = job
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def retry_after(self) -> int:
+        """Estimate how long until a queue slot frees up, in seconds"""
+        return max(1, math.ceil(self._average_duration / max(1, self.workers)))
+
+    def snapshot(self) -> Dict[str, int]:
+        counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {**counts, "queue_capacity": self.max_queue, "workers": self.workers}
+
+    async def _worker(self, index: int):
+        while not self._closing:
+            _, _, job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        self._running += 1
+        job.status = "running"
+        job.started_at = time.time()
+        set_request_labels(endpoint="/jobs", voice="none")
+        try:
+            job.result = await self.handlers[job.kind](job.request)
+            job.status = "succeeded"
+        except HTTPException as e:
+            job.error = str(e.detail)
+            job.status = "failed"
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            self._running -= 1
+            job.finished_at = time.time()
+            job.request = None
+            self._average_duration = 0.8 * self._average_duration + 0.2 * (job.finished_at - job.started_at)
+
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(min(60, max(1, self.result_ttl / 4)))
+            cutoff = time.time() - self.result_ttl
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+            if expired:
+                logger.info(f"Expired {len(expired)} finished jobs")
+
+
+class SharedJobManager(JobManager):
+    """
+    Job manager whose queue and results live in the shared SQLite store.
+
+    Any worker process can accept a job, and idle workers in every process
+    claim the next one in priority order, so jobs and their results are
+    visible whichever process a client reaches. Job requests are stored as
+    JSON and rebuilt with the ``decoders`` for their kind. Jobs interrupted by
+    a shutdown go back to the queue, as do jobs left running by a process
+    that died.
+    """
+
+    def __init__(self, store: SharedStore, handlers: Dict[str, JobHandler], decoders: Dict[str, JobDecoder],
+                 workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_SIZE, result_ttl: int = JOB_RESULT_TTL,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        super().__init__(handlers, workers, max_queue, result_ttl)
+        self.store = store
+        self.decoders = decoders
+        self.poll_interval = poll_interval
+        self.store.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                request TEXT,
+                priority TEXT NOT NULL,
+                lane INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                owner INTEGER,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                result TEXT,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, lane, seq);
+        """)
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+        logger.info(f"Shared job manager started with {self.workers} workers in pid {os.getpid()}")
+
+    async def submit(self, kind: str, request: Any, priority: str = "normal") -> Job:
+        job = Job(id=uuid.uuid4().hex, kind=kind, request=request, priority=priority)
+        await asyncio.to_thread(self._insert, job, request.model_dump_json())
+        return job
+
+    def _insert(self, job: Job, request_json: str):
+        with self.store.transaction() as connection:
+            queued, = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+            if queued >= self.max_queue:
+                raise QueueFullError(self.retry_after())
+            connection.execute(
+                "INSERT INTO jobs (id, kind, request, priority, lane, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, request_json, job.priority, JOB_PRIORITIES[job.priority], job.status,
+                 job.created_at),
+            )
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        rows = await asyncio.to_thread(
+            self.store.execute,
+            "SELECT id, kind, priority, status, created_at, started_at, finished_at, result, error "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        if not rows:
+            return None
+        job_id, kind, priority, status, created_at, started_at, finished_at, result, error = rows[0]
+        return Job(id=job_id, kind=kind, request=None, priority=priority, status=status, created_at=created_at,
+                   started_at=started_at, finished_at=finished_at, result=json.loads(result) if result else None,
+                   error=error)
+
+    def snapshot(self) -> Dict[str, int]:
+        counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+        for status, count in self.store.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        return {**counts, "queue_capacity": self.max_queue, "workers": self.workers}
+
+    def _claim(self) -> Optional[Job]:
+        """Take the next queued job, highest priority lane and oldest first"""
+        with self.store.transaction() as connection:
+            row = connection.execute(
+                "SELECT id, kind, request, priority, created_at FROM jobs WHERE status = 'queued' "
+                "ORDER BY lane, seq LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, kind, request_json, priority, created_at = row
+            connection.execute("UPDATE jobs SET status = 'running', owner = ? WHERE id = ?", (os.getpid(), job_id))
+
+        try:
+            request = self.decoders[kind](request_json)
+        except Exception as e:
+            logger.error(f"Job {job_id} has an unreadable request: {e}")
+            self._save(Job(id=job_id, kind=kind, request=None, priority=priority, status="failed",
+                           created_at=created_at, finished_at=time.time(), error="Invalid job request"))
+            return None
+        return Job(id=job_id, kind=kind, request=request, priority=priority, created_at=created_at)
+
+    def _save(self, job: Job):
+        self.store.execute(
+            "UPDATE jobs SET status = ?, started_at = ?, finished_at = ?, result = ?, error = ?, request = NULL "
+            "WHERE id = ?",
+            (job.status, job.started_at, job.finished_at, json.dumps(job.result) if job.result is not None else None,
+             job.error, job.id),
+        )
+
+    def _requeue(self, job_id: str):
+        self.store.execute("UPDATE jobs SET status = 'queued', owner = NULL, started_at = NULL WHERE id = ?",
+                           (job_id,))
+
+    async def _worker(self, index: int):
+        while not self._closing:
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                # Shutting down mid-job; let another worker pick it up
+                self._requeue(job.id)
+                logger.info(f"Returned interrupted job {job.id} to the queue")
+                raise
+            await asyncio.to_thread(self._save, job)
+
+    def _recover_orphans(self):
+        """Requeue jobs marked running by processes that no longer exist"""
+        rows = self.store.execute("SELECT id, owner FROM jobs WHERE status = 'running'")
+        orphans = [job_id for job_id, owner in rows if owner is None or not process_alive(owner)]
+        for job_id in orphans:
+            self._requeue(job_id)
+        if orphans:
+            logger.warning(f"Requeued {len(orphans)} jobs left running by exited workers")
+
+    def _expire(self) -> int:
+        with self.store.transaction() as connection:
+            return connection.execute("DELETE FROM jobs WHERE finished_at < ? AND status IN ('succeeded', 'failed')",
+                                      (time.time() - self.result_ttl,)).rowcount
+
+    async def _reaper(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._recover_orphans)
+                expired = await asyncio.to_thread(self._expire)
+                if expired:
+                    logger.info(f"Expired {expired} finished jobs")
+            except Exception as e:
+                logger.error(f"Job reaper pass failed: {e}", exc_info=True)
+            await asyncio.sleep(min(60, max(1, self.result_ttl / 4)))
+
+
+def create_job_manager(handlers: Dict[str, JobHandler], decoders: Dict[str, JobDecoder],
+                       store: Optional[SharedStore] = None) -> JobManager:
+    """Create a shared job manager when a store is given, an in-process one otherwise"""
+    if store is not None:
+        return SharedJobManager(store, handlers, decoders)
+    return JobManager(handlers)
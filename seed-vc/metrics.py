@@ -0,0 +1,279 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.routing import Match
+
+from observability import record_span
+
+logger = logging.getLogger(__name__)
+
+# Set by start_server.py for multi-process serving; each worker writes its samples here
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+SNAPSHOT_PUBLISH_INTERVAL = float(os.getenv("SNAPSHOT_PUBLISH_INTERVAL", "5"))  # Seconds between snapshot files
+
+# Endpoint and voice labels of the request being handled
+_request_labels: ContextVar[Tuple[str, str]] = ContextVar("metric_request_labels", default=("other", "none"))
+
+# Stage latencies span sub-millisecond decoding up to long upstream calls
+_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "tts_stage_duration_seconds",
+    "Time spent in each stage of a synthesis request",
+    ["stage", "endpoint", "voice"],
+    buckets=_STAGE_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency until the response starts",
+    ["endpoint", "method", "status"],
+    buckets=_STAGE_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being handled",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+UPSTREAM_REQUESTS = Counter(
+    "gemini_upstream_requests_total",
+    "Upstream generateContent attempts",
+    ["outcome"],
+)
+UPSTREAM_ERRORS = Counter(
+    "gemini_upstream_errors_total",
+    "Upstream failures by reason (HTTP status, transport, circuit_open, quota)",
+    ["reason"],
+)
+
+
+def set_request_labels(endpoint: Optional[str] = None, voice: Optional[str] = None):
+    """Set the endpoint and/or voice labels for stages observed in this context"""
+    current_endpoint, current_voice = _request_labels.get()
+    _request_labels.set((endpoint or current_endpoint, voice or current_voice))
+
+
+def observe_stage(stage: str, seconds: float):
+    endpoint, voice = _request_labels.get()
+    STAGE_SECONDS.labels(stage, endpoint, voice).observe(seconds)
+    record_span(stage, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+class StageTimer:
+    """Accumulate time for a stage that runs in many small steps, observed once"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def observe(self):
+        if self.seconds:
+            observe_stage(self.name, self.seconds)
+            self.seconds = 0.0
+
+
+class SnapshotCollector:
+    """
+    Export counters kept by other components as Prometheus metrics
+
+    Each source is a callable returning a flat dict; keys listed in
+    ``counters`` are exported as counters, other numeric values as gauges.
+    Sources marked ``shared`` read state common to all worker processes.
+    """
+
+    def __init__(self, prefix: str, source: Callable[[], Dict], counters=(), shared: bool = False):
+        self.prefix = prefix
+        self.source = source
+        self.counters = set(counters)
+        self.shared = shared
+
+    def values(self) -> Dict[str, float]:
+        return {key: value for key, value in self.source().items()
+                if not isinstance(value, bool) and isinstance(value, (int, float))}
+
+    def families(self, values: Dict[str, float]):
+        for key, value in values.items():
+            name = f"{self.prefix}_{key}"
+            if key in self.counters:
+                family = CounterMetricFamily(name, f"{self.prefix} {key.replace('_', ' ')}")
+            else:
+                family = GaugeMetricFamily(name, f"{self.prefix} {key.replace('_', ' ')}")
+            family.add_metric([], value)
+            yield family
+
+    def collect(self):
+        yield from self.families(self.values())
+
+
+_snapshots: List[SnapshotCollector] = []
+
+
+def register_snapshot(prefix: str, source: Callable[[], Dict], counters=(), shared: bool = False,
+                      registry: CollectorRegistry = REGISTRY):
+    collector = SnapshotCollector(prefix, source, counters, shared)
+    registry.register(collector)
+    _snapshots.append(collector)
+
+
+def _snapshot_file(pid: int) -> str:
+    return os.path.join(PROMETHEUS_MULTIPROC_DIR, f"snapshots_{pid}.json")
+
+
+def publish_snapshots():
+    """Write this process's per-process snapshot values where other workers can sum them"""
+    values = {collector.prefix: collector.values() for collector in _snapshots if not collector.shared}
+    path = _snapshot_file(os.getpid())
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(values, f)
+    os.replace(f"{path}.tmp", path)
+
+
+class AggregatedSnapshotCollector:
+    """Sum per-process snapshot values published by every live worker"""
+
+    def collect(self):
+        totals: Dict[str, Dict[str, float]] = {}
+        for path in glob.glob(os.path.join(PROMETHEUS_MULTIPROC_DIR, "snapshots_*.json")):
+            try:
+                with open(path) as f:
+                    published = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for prefix, values in published.items():
+                for key, value in values.items():
+                    totals.setdefault(prefix, {})
+                    totals[prefix][key] = totals[prefix].get(key, 0) + value
+
+        for collector in _snapshots:
+            if collector.shared:
+                yield from collector.collect()
+            elif collector.prefix in totals:
+                yield from collector.families(totals[collector.prefix])
+
+
+def render_metrics() -> bytes:
+    """
+    Render the metrics exposition
+
+    Under multi-process serving, samples are merged from every worker's files
+    so the scrape shows the whole server whichever worker answers it.
+    """
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest(REGISTRY)
+    publish_snapshots()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(AggregatedSnapshotCollector())
+    return generate_latest(registry)
+
+
+def mark_process_dead(pid: int):
+    """Drop the live gauges and snapshot file of a worker that exited (called by the launcher)"""
+    multiprocess.mark_process_dead(pid, PROMETHEUS_MULTIPROC_DIR)
+    try:
+        os.unlink(_snapshot_file(pid))
+    except FileNotFoundError:
+        pass
+
+
+class SnapshotPublisher:
+    """Periodically publish this worker's snapshot values under multi-process serving"""
+
+    def __init__(self, interval: float = SNAPSHOT_PUBLISH_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(publish_snapshots)
+            except Exception as e:
+                logger.warning(f"Could not publish metric snapshots: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if PROMETHEUS_MULTIPROC_DIR:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def route_template(scope) -> str:
+    """Return the path template of the route matching a request, e.g. /audio/{filename}"""
+    app = scope.get("app")
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware tracking in-flight requests, time to response start and
+    time spent sending the body
+
+    It also sets the endpoint label used by stage timings further down the
+    request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = route_template(scope)
+        _request_labels.set((endpoint, "none"))
+        in_flight = REQUESTS_IN_FLIGHT.labels(endpoint)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                REQUEST_SECONDS.labels(endpoint, scope["method"], str(message["status"])).observe(now - start)
+                start = now
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Time spent sending the body, e.g. files and streams
+                observe_stage("response_body", time.perf_counter() - start)
+
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini generateContent API
+
+Speaks the request/response shape used by gemini_api.py and returns a sine
+tone instead of speech, and a description of the clip instead of a
+transcript, so the API can be exercised without a real key or quota.
+Latency, failures, rate limiting and clip length are configurable so it can
+stand in for a loaded upstream in benchmarks/load_driver.py. Point the service
+at it with:
+
+    GEMINI_API_URL=http://localhost:9000/v1beta/models GEMINI_API_KEY=mock python api.py
+
+Run several on different MOCK_PORTs and list them in GEMINI_API_URLS to
+exercise the instance balancing and failover.
+"""
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import struct
+import time
+from collections import deque
+from functools import lru_cache
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Mock behaviour
+MOCK_LATENCY = float(os.getenv("MOCK_LATENCY", "0.2"))  # Seconds before the first byte (median for lognormal)
+MOCK_LATENCY_DIST = os.getenv("MOCK_LATENCY_DIST", "fixed")  # fixed, uniform or lognormal
+MOCK_LATENCY_SPREAD = float(os.getenv("MOCK_LATENCY_SPREAD", "0.5"))  # Uniform half-width ratio, lognormal sigma
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))  # Fraction of requests failing with a 500
+MOCK_RATE_LIMIT_RATE = float(os.getenv("MOCK_RATE_LIMIT_RATE", "0"))  # Fraction of requests rejected with a 429
+MOCK_MAX_RPS = float(os.getenv("MOCK_MAX_RPS", "0"))  # Requests per second before answering 429, 0 unlimited
+MOCK_RETRY_AFTER = int(os.getenv("MOCK_RETRY_AFTER", "1"))  # Retry-After sent with 429 responses
+MOCK_AUDIO_SECONDS = float(os.getenv("MOCK_AUDIO_SECONDS", "0"))  # Fixed clip length, 0 scales with the text
+MOCK_CHUNK_DELAY = float(os.getenv("MOCK_CHUNK_DELAY", "0.1"))  # Seconds between streamed chunks
+MOCK_CHUNK_SECONDS = float(os.getenv("MOCK_CHUNK_SECONDS", "0.5"))  # Audio per streamed chunk
+MOCK_SECONDS_PER_CHAR = float(os.getenv("MOCK_SECONDS_PER_CHAR", "0.06"))  # Audio length per input character
+
+SAMPLE_RATE = 24000
+
+app = FastAPI(title="Mock Gemini API")
+
+# Arrival times within the last second, for MOCK_MAX_RPS
+_recent_requests: deque = deque()
+
+
+@lru_cache(maxsize=1)
+def _tone_period(frequency: float) -> bytes:
+    frames = SAMPLE_RATE // math.gcd(SAMPLE_RATE, int(frequency))
+    samples = (int(8000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE)) for i in range(frames))
+    return struct.pack(f"<{frames}h", *samples)
+
+
+def synthesize_tone(seconds: float, frequency: float = 220.0) -> bytes:
+    """Return 16-bit mono PCM of a sine tone"""
+    size = max(1, int(seconds * SAMPLE_RATE)) * 2
+    # Tile one period so generating audio never dominates a benchmark
+    period = _tone_period(frequency)
+    return (period * (size // len(period) + 1))[:size]
+
+
+def sample_latency() -> float:
+    """Draw a time to first byte from the configured distribution"""
+    if MOCK_LATENCY_DIST == "uniform":
+        spread = MOCK_LATENCY * MOCK_LATENCY_SPREAD
+        return random.uniform(max(0.0, MOCK_LATENCY - spread), MOCK_LATENCY + spread)
+    if MOCK_LATENCY_DIST == "lognormal":
+        return random.lognormvariate(math.log(max(MOCK_LATENCY, 1e-6)), MOCK_LATENCY_SPREAD)
+    return MOCK_LATENCY
+
+
+def rate_limited() -> bool:
+    if MOCK_RATE_LIMIT_RATE and random.random() < MOCK_RATE_LIMIT_RATE:
+        return True
+    if MOCK_MAX_RPS > 0:
+        now = time.monotonic()
+        while _recent_requests and now - _recent_requests[0] > 1:
+            _recent_requests.popleft()
+        if len(_recent_requests) >= MOCK_MAX_RPS:
+            return True
+        _recent_requests.append(now)
+    return False
+
+
+def error_response(status_code: int, message: str, status: str, headers=None) -> JSONResponse:
+    """An error in the google.rpc.Status shape the real API returns"""
+    return JSONResponse({"error": {"code": status_code, "message": message, "status": status}},
+                        status_code=status_code, headers=headers)
+
+
+def request_text(payload: dict) -> str:
+    try:
+        return "".join(part.get("text", "") for part in payload["contents"][0]["parts"])
+    except (KeyError, IndexError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid generateContent payload")
+
+
+def request_audio(payload: dict):
+    """Return the inline audio of a transcription request, None for a synthesis request"""
+    try:
+        for part in payload["contents"][0]["parts"]:
+            if "inlineData" in part:
+                return base64.b64decode(part["inlineData"]["data"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid generateContent payload")
+    return None
+
+
+def transcript_response(wav: bytes) -> dict:
+    """Describe the clip instead of transcribing it, so each window's text is recognisable"""
+    sample_rate = struct.unpack_from("<I", wav, 24)[0] if len(wav) >= 44 else SAMPLE_RATE
+    seconds = max(0, len(wav) - 44) / 2 / sample_rate
+    return {
+        "candidates": [{
+            "content": {"role": "model", "parts": [{"text": f"Mock transcript of {seconds:.1f} seconds of audio."}]},
+            "finishReason": "STOP",
+        }]
+    }
+
+
+def audio_response(pcm: bytes) -> dict:
+    return {
+        "candidates": [{
+            "content": {
+                "role": "model",
+                "parts": [{
+                    "inlineData": {
+                        "mimeType": f"audio/L16;codec=pcm;rate={SAMPLE_RATE}",
+                        "data": base64.b64encode(pcm).decode("ascii"),
+                    }
+                }]
+            },
+            "finishReason": "STOP",
+        }]
+    }
+
+
+@app.get("/v1beta/models/{model}")
+async def get_model(model: str):
+    """models.get, used by the API's health probes"""
+    return {"name": f"models/{model}", "supportedGenerationMethods": ["generateContent", "streamGenerateContent"]}
+
+
+@app.post("/v1beta/models/{model_action}")
+async def generate_content(model_action: str, request: Request):
+    model, _, action = model_action.partition(":")
+    payload = await request.json()
+    text = request_text(payload)
+    seconds = MOCK_AUDIO_SECONDS or max(0.1, len(text) * MOCK_SECONDS_PER_CHAR)
+
+    if rate_limited():
+        return error_response(429, "Resource has been exhausted (e.g. check quota).", "RESOURCE_EXHAUSTED",
+                              headers={"Retry-After": str(MOCK_RETRY_AFTER)})
+
+    await asyncio.sleep(sample_latency())
+
+    if MOCK_ERROR_RATE and random.random() < MOCK_ERROR_RATE:
+        return error_response(500, "An internal error has occurred.", "INTERNAL")
+
+    if action == "generateContent":
+        audio = request_audio(payload)
+        if audio is not None:
+            return transcript_response(audio)
+        return audio_response(synthesize_tone(seconds))
+
+    if action == "streamGenerateContent":
+        async def events():
+            remaining = seconds
+            while remaining > 0:
+                chunk_seconds = min(MOCK_CHUNK_SECONDS, remaining)
+                remaining -= chunk_seconds
+                yield f"data: {json.dumps(audio_response(synthesize_tone(chunk_seconds)))}\r\n\r\n"
+                if remaining > 0:
+                    await asyncio.sleep(MOCK_CHUNK_DELAY)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    raise HTTPException(status_code=404, detail=f"Unknown action: {action}")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("MOCK_PORT", "9000")))
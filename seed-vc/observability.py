@@ -0,0 +1,287 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared_state import API_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Logging configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json or text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # Records waiting for the writer thread before dropping
+LOG_ACCESS = os.getenv("LOG_ACCESS", "true").lower() not in ("0", "false", "no")  # One line per HTTP request
+# Share of requests that log per-request detail (payload summaries, upstream attempts, ...)
+LOG_DETAIL_SAMPLE_RATE = float(os.getenv("LOG_DETAIL_SAMPLE_RATE", "0.01"))
+
+# Request tracing: span timings of slow, failed and sampled requests go to a local JSON lines file
+TRACE_FILE = os.getenv("TRACE_FILE", "./state/traces.jsonl")
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.getenv("TRACE_FILE_BACKUPS", "3"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))  # Requests at least this slow are always written
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))  # Share of the other requests written too
+TRACE_MAX_SPANS = 500  # Spans kept per request, so a runaway loop cannot grow a trace without bound
+
+# Environment variables whose values never appear in logs
+SECRET_ENV_VARS = ("API_KEY", "GEMINI_API_KEY", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN")
+REDACTED = "[REDACTED]"
+
+_SECRET_PATTERNS = [
+    # Query parameters carrying keys and signatures (Gemini ?key=, presigned S3 URLs, WebSocket ?api_key=)
+    (re.compile(r"([?&](?:key|api_key|token|X-Amz-Signature|X-Amz-Credential|X-Amz-Security-Token)=)[^&\s\"'<>]+",
+                re.IGNORECASE), rf"\1{REDACTED}"),
+    (re.compile(r"(Bearer\s+)[A-Za-z0-9._~+/=-]+", re.IGNORECASE), rf"\1{REDACTED}"),
+    # Google API keys wherever they appear
+    (re.compile(r"AIza[0-9A-Za-z_\-]{35}"), REDACTED),
+]
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{8,64}$")
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+_trace_logger = logging.getLogger("traces")
+_access_logger = logging.getLogger("access")
+
+
+def redact(text: str) -> str:
+    """Mask credentials in a log line"""
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    for name in SECRET_ENV_VARS:
+        # Read on every call: some keys are only set after startup
+        value = os.getenv(name)
+        if value and len(value) >= 8 and value in text:
+            text = text.replace(value, REDACTED)
+    return text
+
+
+class Trace:
+    """Span timings of one request, collected in memory and written out only if worth keeping"""
+
+    def __init__(self, trace_id: str, detail: bool):
+        self.trace_id = trace_id
+        self.detail = detail
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def add_span(self, name: str, seconds: float):
+        if len(self.spans) < TRACE_MAX_SPANS:
+            end = time.perf_counter() - self.start
+            self.spans.append((name, round((end - seconds) * 1000, 2), round(seconds * 1000, 2)))
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+
+def current_trace_id() -> str:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else ""
+
+
+def detail_enabled() -> bool:
+    """Tell whether the current request was sampled for detailed logging"""
+    trace = _current_trace.get()
+    return trace is not None and trace.detail
+
+
+def record_span(name: str, seconds: float):
+    """Add a finished span to the current request's trace, if any"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, seconds)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to the writer thread with as little work as possible
+
+    Only what cannot wait is done on the calling thread: merging the message
+    with its arguments and capturing the trace id from the request context.
+    Formatting, redaction and I/O happen in the listener thread. When the
+    queue is full, records are dropped and counted rather than blocking.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        record.trace_id = current_trace_id()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with credentials masked"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": redact(record.getMessage()),
+        }
+        trace_id = getattr(record, "trace_id", "")
+        if trace_id:
+            entry["trace_id"] = trace_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain text lines for local development, with credentials masked"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "trace_id"):
+            record.trace_id = ""
+        return redact(super().format(record))
+
+
+class TraceFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.fields, ensure_ascii=False, default=str)
+
+
+def _only(name: str):
+    return lambda record: record.name == name
+
+
+def _except(name: str):
+    return lambda record: record.name != name
+
+
+def trace_file_path() -> Path:
+    path = Path(TRACE_FILE)
+    if API_WORKERS > 1:
+        # Rotation is not safe across processes, so each worker keeps its own file
+        path = path.with_name(f"{path.stem}.{os.getpid()}{path.suffix}")
+    return path
+
+
+def configure_logging():
+    """
+    Route all logging through a queue to a writer thread
+
+    Replaces any handlers already on the root logger. Console output is JSON
+    (or text with LOG_FORMAT=text); traces go to their own rotating file.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    console.addFilter(_except(_trace_logger.name))
+
+    path = trace_file_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    traces = logging.handlers.RotatingFileHandler(path, maxBytes=TRACE_FILE_MAX_BYTES,
+                                                  backupCount=TRACE_FILE_BACKUPS, delay=True)
+    traces.setFormatter(TraceFormatter())
+    traces.addFilter(_only(_trace_logger.name))
+
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(ContextQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+    _trace_logger.setLevel(logging.INFO)
+    # httpx logs every upstream request at INFO, URL and all
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, console, traces, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def dropped_log_records() -> int:
+    return sum(getattr(handler, "dropped", 0) for handler in logging.getLogger().handlers)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware giving every HTTP request a trace id and span timings
+
+    The id comes from a valid X-Request-ID header or is generated, and is
+    returned in the X-Request-ID response header and attached to every log
+    record of the request. Stage timings recorded while handling it become
+    spans. The trace is written to the trace file when the request is slow
+    (TRACE_SLOW_MS), fails, was sampled for detailed logging, or falls in
+    the TRACE_SAMPLE_RATE sample, so slow requests can be reconstructed
+    without verbose logs for every request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = ""
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                trace_id = value.decode("latin-1")
+                break
+        if not _REQUEST_ID_PATTERN.match(trace_id):
+            trace_id = uuid.uuid4().hex[:16]
+        trace = Trace(trace_id, random.random() < LOG_DETAIL_SAMPLE_RATE)
+        token = _current_trace.set(trace)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", trace_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = round(trace.elapsed_ms(), 2)
+            if LOG_ACCESS:
+                _access_logger.info(f"{scope['method']} {scope['path']} {status} {duration_ms:.0f}ms",
+                                    extra={"fields": {"status": status, "duration_ms": duration_ms}})
+            if (duration_ms >= TRACE_SLOW_MS or status >= 500 or trace.detail
+                    or random.random() < TRACE_SAMPLE_RATE):
+                _trace_logger.info("trace", extra={"fields": {
+                    "trace_id": trace_id,
+                    "ts": round(trace.started_at, 3),
+                    "pid": os.getpid(),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": duration_ms,
+                    "spans": [{"name": name, "start_ms": start, "duration_ms": length}
+                              for name, start, length in trace.spans],
+                }})
+            _current_trace.reset(token)
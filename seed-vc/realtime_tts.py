@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from audio_encoding import encode_pcm_stream
+from chunking import take_sentences
+from upstream_governor import UpstreamUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# Session configuration
+WS_TTS_MAX_SENTENCE_CHARS = int(os.getenv("WS_TTS_MAX_SENTENCE_CHARS", "400"))  # Longer text is split early
+WS_TTS_PIPELINE_DEPTH = int(os.getenv("WS_TTS_PIPELINE_DEPTH", "2"))  # Segments synthesized ahead of playback
+WS_TTS_MAX_PENDING = int(os.getenv("WS_TTS_MAX_PENDING", "32"))  # Queued segments before text is refused
+WS_TTS_IDLE_TIMEOUT = float(os.getenv("WS_TTS_IDLE_TIMEOUT", "300"))  # Seconds without a message before closing
+
+# Synthesizes one segment: (text, voice) -> 16-bit 24 kHz mono PCM chunks
+SegmentSynthesizer = Callable[[str, str], AsyncIterator[bytes]]
+
+
+class Segment:
+    """A sentence queued for synthesis and playback"""
+
+    def __init__(self, segment_id: int, text: str, voice: str):
+        self.id = segment_id
+        self.text = text
+        self.voice = voice
+        # Audio chunks, then None at the end or the exception that stopped synthesis
+        self.chunks: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+        self.holds_slot = False
+
+
+class TtsSession:
+    """
+    One client's real-time synthesis session over a WebSocket.
+
+    Text fragments are buffered until a sentence is complete, and each
+    sentence becomes a segment. Up to ``pipeline_depth`` segments are
+    synthesized ahead of the one being sent, so the next sentence is usually
+    ready when the current one ends. Audio goes out as binary frames in
+    segment order, framed by JSON ``segment_start`` / ``segment_end`` events.
+
+    With a ``window``, at most that many sent segments may be unacknowledged
+    before the session stops sending; acks come back as ``{"type": "ack",
+    "segment": id}``. ``{"type": "cancel"}`` drops the buffered text and every
+    queued or playing segment, stopping their upstream requests.
+    """
+
+    def __init__(self, websocket: WebSocket, synthesize: SegmentSynthesizer, voices: Dict[str, str], voice: str,
+                 audio_format: str = "pcm", bitrate: Optional[str] = None, window: int = 0,
+                 pipeline_depth: int = WS_TTS_PIPELINE_DEPTH):
+        self.websocket = websocket
+        self.synthesize = synthesize
+        self.voices = voices
+        self.voice = voice
+        self.format = audio_format
+        self.bitrate = bitrate
+        self.window = window
+
+        self._buffer = ""
+        self._ids = itertools.count(1)
+        self._segments: asyncio.Queue = asyncio.Queue()
+        self._active: Dict[int, Segment] = {}
+        self._slots = asyncio.Semaphore(max(1, pipeline_depth))
+        self._unacked: Set[int] = set()
+        self._credit = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+
+    async def send_event(self, **event):
+        async with self._send_lock:
+            await self.websocket.send_json(event)
+
+    async def run(self):
+        """Serve the session until the client ends it or disconnects"""
+        sender = asyncio.create_task(self._sender())
+        try:
+            await self.send_event(type="ready", voice=self.voice, format=self.format, sample_rate=24000)
+            while True:
+                raw = await asyncio.wait_for(self.websocket.receive_text(), WS_TTS_IDLE_TIMEOUT)
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    await self.send_event(type="error", detail="Messages must be JSON")
+                    continue
+                if not await self._handle(message):
+                    break
+
+            # Let everything queued play out before saying goodbye
+            self._segments.put_nowait(None)
+            await sender
+            await self.send_event(type="done")
+            await self.websocket.close()
+        except (WebSocketDisconnect, asyncio.TimeoutError):
+            pass
+        finally:
+            self._cancel_all()
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+
+    async def _handle(self, message) -> bool:
+        """Act on one client message; return False once the client has ended the session"""
+        kind = message.get("type") if isinstance(message, dict) else None
+        if kind == "text":
+            text = message.get("text")
+            if not isinstance(text, str):
+                await self.send_event(type="error", detail="text must be a string")
+            elif len(self._active) >= WS_TTS_MAX_PENDING:
+                await self.send_event(type="error", detail="Too many segments pending, wait for playback or cancel")
+            else:
+                self._buffer += text
+                await self._take(flush=False)
+        elif kind == "flush":
+            await self._take(flush=True)
+        elif kind == "end":
+            await self._take(flush=True)
+            return False
+        elif kind == "cancel":
+            self._buffer = ""
+            await self.send_event(type="cancelled", segments=self._cancel_all())
+        elif kind == "ack":
+            segment_id = message.get("segment")
+            if isinstance(segment_id, int):
+                self._unacked = {i for i in self._unacked if i > segment_id}
+                self._credit.set()
+        elif kind == "voice":
+            voice = message.get("voice")
+            if voice in self.voices:
+                # Applies to text taken from here on
+                await self._take(flush=True)
+                self.voice = voice
+            else:
+                await self.send_event(type="error", detail=f"Voice not supported. Choose from: {', '.join(self.voices)}")
+        else:
+            await self.send_event(type="error", detail=f"Unknown message type: {kind}")
+        return True
+
+    async def _take(self, flush: bool):
+        sentences, self._buffer = take_sentences(self._buffer, WS_TTS_MAX_SENTENCE_CHARS, flush)
+        for sentence in sentences:
+            segment = Segment(next(self._ids), sentence, self.voice)
+            segment.task = asyncio.create_task(self._synthesize(segment))
+            self._active[segment.id] = segment
+            self._segments.put_nowait(segment)
+            await self.send_event(type="queued", segment=segment.id, text=sentence)
+
+    async def _synthesize(self, segment: Segment):
+        try:
+            await self._slots.acquire()
+            segment.holds_slot = True
+            chunks = self.synthesize(segment.text, segment.voice)
+            if self.format != "pcm":
+                chunks = encode_pcm_stream(chunks, self.format, self.bitrate)
+            async for chunk in chunks:
+                segment.chunks.put_nowait(chunk)
+            segment.chunks.put_nowait(None)
+        except asyncio.CancelledError:
+            segment.chunks.put_nowait(None)
+            raise
+        except Exception as e:
+            logger.error(f"Error synthesizing session segment {segment.id}: {e}")
+            segment.chunks.put_nowait(e)
+
+    async def _sender(self):
+        while True:
+            segment = await self._segments.get()
+            if segment is None:
+                return
+            try:
+                await self._send_segment(segment)
+            finally:
+                if segment.holds_slot:
+                    segment.holds_slot = False
+                    self._slots.release()
+                self._active.pop(segment.id, None)
+
+    async def _send_segment(self, segment: Segment):
+        while self.window and len(self._unacked) >= self.window and not segment.cancelled:
+            self._credit.clear()
+            await self._credit.wait()
+        if segment.cancelled:
+            return
+
+        await self.send_event(type="segment_start", segment=segment.id, format=self.format, sample_rate=24000)
+        size = 0
+        while True:
+            item = await segment.chunks.get()
+            if segment.cancelled:
+                return
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                detail = "Upstream unavailable" if isinstance(item, UpstreamUnavailableError) \
+                    else "Failed to generate audio"
+                await self.send_event(type="error", segment=segment.id, detail=detail)
+                return
+            async with self._send_lock:
+                await self.websocket.send_bytes(item)
+            size += len(item)
+
+        self._unacked.add(segment.id)
+        await self.send_event(type="segment_end", segment=segment.id, bytes=size)
+
+    def _cancel_all(self) -> List[int]:
+        """Cancel every queued or playing segment and return their ids"""
+        cancelled = []
+        for segment in self._active.values():
+            if segment.cancelled:
+                continue
+            segment.cancelled = True
+            segment.task.cancel()
+            cancelled.append(segment.id)
+        # Wake the sender if it is waiting for acks
+        self._credit.set()
+        return cancelled
@@ -0,0 +1,443 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from shared_state import SHARED_STATE_EPOCH, SharedStore
+
+logger = logging.getLogger(__name__)
+
+# Janitor configuration
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "60"))  # Seconds between janitor passes
+RETENTION_TMP_MAX_AGE = int(os.getenv("RETENTION_TMP_MAX_AGE", "3600"))  # Abandoned .tmp files are removed after this
+RETENTION_FLUSH_INTERVAL = float(os.getenv("RETENTION_FLUSH_INTERVAL", "1"))  # Seconds between shared index writes
+
+# Files unlinked per worker thread call, so one pass never holds a thread for long
+_UNLINK_BATCH = 500
+
+
+def shard_path(directory: Path, filename: str, create: bool = False) -> Path:
+    """
+    Return where a file lives in a sharded directory
+
+    Files are spread over two levels of subdirectories taken from the first
+    four characters of the name (``ab/cd/abcd...``), which keeps directories
+    small for content-addressed and UUID names alike. Names that do not start
+    with four alphanumerics go to a ``_`` catch-all shard.
+
+    Raises:
+        ValueError: If the filename is not a plain file name
+    """
+    if not filename or "/" in filename or "\\" in filename or filename.startswith("."):
+        raise ValueError(f"Invalid filename '{filename}'")
+    head = filename[:4].lower()
+    if len(head) == 4 and head.isalnum() and head.isascii():
+        shard = Path(directory) / head[:2] / head[2:]
+    else:
+        shard = Path(directory) / "_"
+    if create:
+        shard.mkdir(parents=True, exist_ok=True)
+    return shard / filename
+
+
+def migrate_flat_files(directory: Path) -> int:
+    """Move files from the old flat layout into their shards, returning how many moved"""
+    moved = 0
+    for entry in os.scandir(directory):
+        if not entry.is_file() or entry.name.startswith("."):
+            continue
+        try:
+            os.replace(entry.path, shard_path(directory, entry.name, create=True))
+            moved += 1
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not move {entry.path} into its shard: {e}")
+    if moved:
+        logger.info(f"Moved {moved} files in {directory} to the sharded layout")
+    return moved
+
+
+@dataclass
+class RetentionPolicy:
+    name: str  # Short name used in metrics, e.g. "outputs"
+    directory: Path
+    max_bytes: int = 0  # 0 disables the quota
+    ttl: int = 0  # Seconds since last access, 0 disables expiry
+
+
+@dataclass
+class IndexedFile:
+    size: int
+    last_access: float
+
+
+@dataclass
+class PrefixIndex:
+    """Size and last access time of every file under one prefix, least recently used first"""
+    policy: RetentionPolicy
+    files: "OrderedDict[str, IndexedFile]" = field(default_factory=OrderedDict)
+    total_bytes: int = 0
+    stats: Dict[str, int] = field(default_factory=lambda: {"evictions": 0, "expirations": 0, "tmp_removed": 0})
+
+
+class RetentionManager:
+    """
+    Tracks files under each storage prefix and keeps them within quota.
+
+    The index lives in memory and is updated as files are written and served,
+    so request handling never scans the disk. A background janitor evicts the
+    least recently used files once a prefix exceeds its byte quota, and any
+    file not accessed within the prefix TTL. Picking victims only touches the
+    index; both it and unlinking happen in worker threads.
+    """
+
+    def __init__(self, policies: Dict[str, RetentionPolicy], interval: float = RETENTION_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._indexes = {prefix: PrefixIndex(policy) for prefix, policy in policies.items()}
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+        for index in self._indexes.values():
+            self._load(index)
+
+    def path_for(self, prefix: str, filename: str, create: bool = False) -> Path:
+        """Return the sharded path of a file under a prefix"""
+        return shard_path(self._indexes[prefix].policy.directory, filename, create)
+
+    def on_evict(self, listener: Callable[[str, str], None]):
+        """Register a callback invoked with (prefix, filename) after a file is removed"""
+        self._listeners.append(listener)
+
+    def _scan(self, directory: Path) -> List[Tuple[str, IndexedFile]]:
+        """List the files under a directory, least recently used first"""
+        entries = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                # atime is unreliable on noatime mounts, never report older than mtime
+                entries.append((name, IndexedFile(stat.st_size, max(stat.st_atime, stat.st_mtime))))
+        return sorted(entries, key=lambda item: item[1].last_access)
+
+    def _load(self, index: PrefixIndex):
+        """Index files already on disk, moving flat files into shards first"""
+        directory = index.policy.directory
+        directory.mkdir(parents=True, exist_ok=True)
+        migrate_flat_files(directory)
+
+        for name, entry in self._scan(directory):
+            index.files[name] = entry
+            index.total_bytes += entry.size
+        logger.info(f"Retention indexed {len(index.files)} {index.policy.name} files ({index.total_bytes} bytes)")
+
+    def add(self, prefix: str, filename: str, size: int):
+        """Record a newly written file"""
+        with self._lock:
+            index = self._indexes[prefix]
+            previous = index.files.pop(filename, None)
+            if previous is not None:
+                index.total_bytes -= previous.size
+            index.files[filename] = IndexedFile(size, time.time())
+            index.total_bytes += size
+
+    def add_path(self, prefix: str, path: Path):
+        """Record a file produced elsewhere (e.g. an encoded variant) unless already indexed"""
+        with self._lock:
+            if path.name in self._indexes[prefix].files:
+                return
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return
+        self.add(prefix, path.name, size)
+
+    def touch(self, prefix: str, filename: str):
+        """Mark a file as just accessed"""
+        with self._lock:
+            entry = self._indexes[prefix].files.get(filename)
+            if entry is not None:
+                entry.last_access = time.time()
+                self._indexes[prefix].files.move_to_end(filename)
+
+    def _select_victims(self, prefix: str, now: float) -> List[Tuple[str, IndexedFile]]:
+        """Take files to remove out of the index, least recently used first"""
+        index = self._indexes[prefix]
+        policy = index.policy
+        victims = []
+        with self._lock:
+            while index.files:
+                name, entry = next(iter(index.files.items()))
+                if policy.ttl > 0 and now - entry.last_access > policy.ttl:
+                    index.stats["expirations"] += 1
+                elif policy.max_bytes > 0 and index.total_bytes > policy.max_bytes:
+                    index.stats["evictions"] += 1
+                else:
+                    break
+                del index.files[name]
+                index.total_bytes -= entry.size
+                victims.append((name, entry))
+        return victims
+
+    def _remove_files(self, directory: Path, names: List[str]):
+        for name in names:
+            try:
+                shard_path(directory, name).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to remove {name}: {e}")
+
+    def _remove_stale_temporaries(self, index: PrefixIndex, now: float):
+        """Remove .tmp files left behind by interrupted writes"""
+        for root, _, names in os.walk(index.policy.directory):
+            for name in names:
+                if not name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if now - os.stat(path).st_mtime > RETENTION_TMP_MAX_AGE:
+                        os.unlink(path)
+                        self._count(index, "tmp_removed")
+                except OSError:
+                    continue
+
+    def _count(self, index: PrefixIndex, name: str, amount: int = 1):
+        with self._lock:
+            index.stats[name] += amount
+
+    async def sweep(self, include_temporaries: bool = False):
+        """Run one janitor pass over every prefix"""
+        now = time.time()
+        for prefix, index in self._indexes.items():
+            victims = await asyncio.to_thread(self._select_victims, prefix, now)
+            names = [name for name, _ in victims]
+            for start in range(0, len(names), _UNLINK_BATCH):
+                await asyncio.to_thread(self._remove_files, index.policy.directory, names[start:start + _UNLINK_BATCH])
+            if victims:
+                freed = sum(entry.size for _, entry in victims)
+                logger.info(f"Retention removed {len(victims)} {index.policy.name} files ({freed} bytes)")
+            for name in names:
+                for listener in self._listeners:
+                    listener(prefix, name)
+            if include_temporaries:
+                await asyncio.to_thread(self._remove_stale_temporaries, index, now)
+
+    async def _run(self):
+        passes = 0
+        while True:
+            try:
+                # Walking the tree for temporaries is the only scan; do it rarely
+                await self.sweep(include_temporaries=passes % 60 == 0)
+            except Exception as e:
+                logger.error(f"Retention pass failed: {e}", exc_info=True)
+            passes += 1
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self, prefix: str) -> Dict[str, int]:
+        with self._lock:
+            index = self._indexes[prefix]
+            return {
+                **index.stats,
+                "files": len(index.files),
+                "bytes": index.total_bytes,
+                "max_bytes": index.policy.max_bytes,
+            }
+
+
+class SharedRetentionManager(RetentionManager):
+    """
+    Retention index kept in the shared SQLite store for multi-process serving.
+
+    Every worker process writes to and serves from the same directories, so
+    sizes and access times have to be pooled for quotas to mean anything.
+    Writes and touches are buffered in memory and flushed in one transaction
+    every ``RETENTION_FLUSH_INTERVAL`` seconds, keeping SQLite off the request
+    path. Victims are picked and removed from the index inside a write
+    transaction, so janitors running in several processes never evict the
+    same file twice or overshoot the quota together.
+    """
+
+    def __init__(self, store: SharedStore, policies: Dict[str, RetentionPolicy],
+                 interval: float = RETENTION_INTERVAL, flush_interval: float = RETENTION_FLUSH_INTERVAL):
+        self.store = store
+        self.flush_interval = flush_interval
+        # (prefix, filename) -> (size or None for a touch, last access)
+        self._pending: Dict[Tuple[str, str], Tuple[Optional[int], float]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.store.executescript("""
+            CREATE TABLE IF NOT EXISTS retention_files (
+                prefix TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (prefix, name)
+            );
+            CREATE INDEX IF NOT EXISTS retention_files_by_access ON retention_files (prefix, last_access);
+            CREATE TABLE IF NOT EXISTS retention_stats (
+                prefix TEXT NOT NULL,
+                name TEXT NOT NULL,
+                value INTEGER NOT NULL,
+                PRIMARY KEY (prefix, name)
+            );
+            CREATE TABLE IF NOT EXISTS retention_indexed (
+                prefix TEXT PRIMARY KEY,
+                indexed_at REAL NOT NULL
+            );
+        """)
+        super().__init__(policies, interval)
+
+    def _load(self, index: PrefixIndex):
+        """Index the files on disk once per launch; the first worker to start does it for all"""
+        directory = index.policy.directory
+        directory.mkdir(parents=True, exist_ok=True)
+        prefix = self._prefix_of(index)
+        with self.store.transaction() as connection:
+            row = connection.execute("SELECT indexed_at FROM retention_indexed WHERE prefix = ?", (prefix,)).fetchone()
+            if row is not None and row[0] >= SHARED_STATE_EPOCH:
+                return
+            migrate_flat_files(directory)
+            entries = self._scan(directory)
+            connection.execute("DELETE FROM retention_files WHERE prefix = ?", (prefix,))
+            connection.executemany(
+                "INSERT INTO retention_files (prefix, name, size, last_access) VALUES (?, ?, ?, ?)",
+                ((prefix, name, entry.size, entry.last_access) for name, entry in entries),
+            )
+            connection.execute("INSERT OR REPLACE INTO retention_indexed (prefix, indexed_at) VALUES (?, ?)",
+                               (prefix, time.time()))
+        logger.info(f"Retention indexed {len(entries)} {index.policy.name} files into {self.store.path}")
+
+    def _prefix_of(self, index: PrefixIndex) -> str:
+        return next(prefix for prefix, candidate in self._indexes.items() if candidate is index)
+
+    def add(self, prefix: str, filename: str, size: int):
+        with self._lock:
+            self._pending[(prefix, filename)] = (size, time.time())
+
+    def add_path(self, prefix: str, path: Path):
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return
+        self.add(prefix, path.name, size)
+
+    def touch(self, prefix: str, filename: str):
+        with self._lock:
+            size, _ = self._pending.get((prefix, filename), (None, 0.0))
+            self._pending[(prefix, filename)] = (size, time.time())
+
+    def flush(self):
+        """Write buffered additions and touches to the shared index (blocking)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        added = [(prefix, name, size, last_access) for (prefix, name), (size, last_access) in pending.items()
+                 if size is not None]
+        touched = [(last_access, prefix, name) for (prefix, name), (size, last_access) in pending.items()
+                   if size is None]
+        with self.store.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO retention_files (prefix, name, size, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (prefix, name) DO UPDATE SET size = excluded.size, "
+                "last_access = MAX(last_access, excluded.last_access)",
+                added,
+            )
+            connection.executemany(
+                "UPDATE retention_files SET last_access = MAX(last_access, ?) WHERE prefix = ? AND name = ?",
+                touched,
+            )
+
+    def _select_victims(self, prefix: str, now: float) -> List[Tuple[str, IndexedFile]]:
+        policy = self._indexes[prefix].policy
+        victims = []
+        expirations = 0
+        with self.store.transaction() as connection:
+            if policy.ttl > 0:
+                for name, size, last_access in connection.execute(
+                        "SELECT name, size, last_access FROM retention_files WHERE prefix = ? AND last_access < ?",
+                        (prefix, now - policy.ttl)):
+                    victims.append((name, IndexedFile(size, last_access)))
+                expirations = len(victims)
+
+            if policy.max_bytes > 0:
+                total, = connection.execute("SELECT COALESCE(SUM(size), 0) FROM retention_files WHERE prefix = ?",
+                                            (prefix,)).fetchone()
+                total -= sum(entry.size for _, entry in victims)
+                if total > policy.max_bytes:
+                    expired = {name for name, _ in victims}
+                    for name, size, last_access in connection.execute(
+                            "SELECT name, size, last_access FROM retention_files WHERE prefix = ? "
+                            "ORDER BY last_access", (prefix,)):
+                        if total <= policy.max_bytes:
+                            break
+                        if name in expired:
+                            continue
+                        victims.append((name, IndexedFile(size, last_access)))
+                        total -= size
+
+            connection.executemany("DELETE FROM retention_files WHERE prefix = ? AND name = ?",
+                                   ((prefix, name) for name, _ in victims))
+            self._bump(connection, prefix, "expirations", expirations)
+            self._bump(connection, prefix, "evictions", len(victims) - expirations)
+        return victims
+
+    def _bump(self, connection, prefix: str, name: str, amount: int):
+        if amount:
+            connection.execute(
+                "INSERT INTO retention_stats (prefix, name, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (prefix, name) DO UPDATE SET value = value + excluded.value",
+                (prefix, name, amount),
+            )
+
+    def _count(self, index: PrefixIndex, name: str, amount: int = 1):
+        with self.store.transaction() as connection:
+            self._bump(connection, self._prefix_of(index), name, amount)
+
+    async def sweep(self, include_temporaries: bool = False):
+        await asyncio.to_thread(self.flush)
+        await super().sweep(include_temporaries)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Retention index flush failed: {e}", exc_info=True)
+
+    async def start(self):
+        await super().start()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await super().stop()
+        await asyncio.to_thread(self.flush)
+
+    def snapshot(self, prefix: str) -> Dict[str, int]:
+        stats = {"evictions": 0, "expirations": 0, "tmp_removed": 0}
+        stats.update(self.store.execute("SELECT name, value FROM retention_stats WHERE prefix = ?", (prefix,)))
+        files, total = self.store.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM retention_files WHERE prefix = ?", (prefix,))[0]
+        return {**stats, "files": files, "bytes": total, "max_bytes": self._indexes[prefix].policy.max_bytes}
@@ -0,0 +1,92 @@
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Multi-process serving (set by start_server.py when it runs several workers)
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "")  # SQLite file shared by the workers, unset for one process
+API_WORKERS = max(1, int(os.getenv("API_WORKERS", "1")))  # Worker processes serving the API
+# When the launcher started; state indexed before this is rebuilt, state written after survives reloads
+SHARED_STATE_EPOCH = float(os.getenv("SHARED_STATE_EPOCH", "0"))
+
+# How long a statement waits for another process's write lock
+SQLITE_BUSY_TIMEOUT = 30
+
+
+class SharedStore:
+    """
+    SQLite database shared by the worker processes on one host
+
+    Each process holds one connection in WAL mode, so readers never block the
+    writer and writers queue on the database lock for up to
+    ``SQLITE_BUSY_TIMEOUT`` seconds. Calls block; run them in a worker thread
+    from async code.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode, transactions are opened explicitly
+        self._connection = sqlite3.connect(str(self.path), timeout=SQLITE_BUSY_TIMEOUT,
+                                           isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def executescript(self, script: str):
+        with self._lock:
+            self._connection.executescript(script)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Hold the database write lock for a read-modify-write sequence
+
+        Yields the connection; changes are committed on exit and rolled back
+        if the block raises.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def executemany(self, sql: str, rows: Iterable[Sequence[Any]]):
+        with self.transaction() as connection:
+            connection.executemany(sql, rows)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_shared_store(path: str = SHARED_STATE_DB) -> Optional[SharedStore]:
+    """Open the shared state database, or return None when running as a single process"""
+    if not path:
+        return None
+    store = SharedStore(path)
+    logger.info(f"Sharing cache index and job queue through {path} (pid {os.getpid()}, {API_WORKERS} workers)")
+    return store
+
+
+def process_alive(pid: int) -> bool:
+    """Tell whether a process on this host is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from observability import detail_enabled
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls into one.
+
+    The first caller for a key starts the work as its own task; callers that
+    arrive while it is running wait on the same result. The work is shielded,
+    so it still completes (and lands in the cache) if the caller that started
+    it disconnects.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Future"] = {}
+        self.stats = {
+            "leaders": 0,
+            "coalesced": 0,
+        }
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            if detail_enabled():
+                logger.info(f"Coalesced request onto in-flight synthesis {key[:12]}")
+        else:
+            self.stats["leaders"] += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {**self.stats, "in_flight": len(self._calls)}
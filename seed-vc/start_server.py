@@ -1,19 +1,121 @@
 #!/usr/bin/env python3
 """
-Simple script to start the FastAPI server
+Start the FastAPI server
+
+By default this runs a single uvicorn process. With more workers (--workers
+or API_WORKERS), gunicorn supervises a pool of uvicorn worker processes
+sharing the listening socket:
+
+  SIGHUP     graceful reload: new workers start on fresh code, old ones
+             finish their requests and exit
+  SIGTERM    drain: stop accepting, let in-flight requests and running jobs
+             finish for up to --graceful-timeout seconds, then exit
+  SIGTTIN/SIGTTOU  add or remove a worker
+
+Workers share the output cache index, the retention index and the job queue
+through a SQLite file, and /metrics merges samples from all of them.
+
+Usage:
+    python start_server.py --workers 4 --port 8000
 """
-import uvicorn
-from api import app
+import argparse
+import os
+import shutil
+import time
+from pathlib import Path
+
+# Launcher configuration
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))  # More than one needs gunicorn
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))  # Seconds workers get to drain on reload/shutdown
+STATE_DIR = Path(os.getenv("STATE_DIR", "./state"))  # Shared SQLite store and metric files
+WORKER_MAX_REQUESTS = int(os.getenv("WORKER_MAX_REQUESTS", "0"))  # Recycle workers after this many requests, 0 never
+
+
+def prepare_shared_state(workers: int):
+    """Point the workers at the shared store and a clean metrics directory (before any of them start)"""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    metrics_dir = STATE_DIR / "metrics"
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    metrics_dir.mkdir()
+
+    os.environ["API_WORKERS"] = str(workers)
+    os.environ.setdefault("SHARED_STATE_DB", str(STATE_DIR / "shared.db"))
+    os.environ["SHARED_STATE_EPOCH"] = str(time.time())
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(metrics_dir)
+
+
+def run_single(host: str, port: int, graceful_timeout: int):
+    import uvicorn
+    from api import app
+
+    # The app routes logging through its own queue and writes access lines itself
+    uvicorn.run(app, host=host, port=port, log_config=None, access_log=False,
+                timeout_graceful_shutdown=graceful_timeout)
+
+
+def run_workers(host: str, port: int, workers: int, graceful_timeout: int):
+    try:
+        from gunicorn.app.base import BaseApplication
+        from uvicorn.workers import UvicornWorker
+    except ImportError:
+        raise SystemExit("Running several workers requires gunicorn (pip install gunicorn)")
+
+    class ApiWorker(UvicornWorker):
+        # Close idle keep-alive connections and stop waiting on stragglers before gunicorn kills us
+        CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "timeout_graceful_shutdown": max(1, graceful_timeout - 5),
+                         "access_log": False}
+
+    def child_exit(server, worker):
+        # Imported lazily: prometheus_client reads PROMETHEUS_MULTIPROC_DIR on import
+        from metrics import mark_process_dead
+        mark_process_dead(worker.pid)
+
+    class ApiApplication(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": ApiWorker,
+                "graceful_timeout": graceful_timeout,
+                "timeout": 120,
+                "keepalive": 5,
+                "max_requests": WORKER_MAX_REQUESTS,
+                "max_requests_jitter": WORKER_MAX_REQUESTS // 10,
+                "child_exit": child_exit,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Each worker imports the app itself so no state is inherited across fork
+            from api import app
+            return app
+
+    ApiApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="Worker processes (default: 1)")
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT,
+                        help="Seconds to drain requests and jobs on reload or shutdown")
+    args = parser.parse_args()
 
-if __name__ == "__main__":
     print("Starting Voice API server...")
-    print("Server will be available at: http://localhost:8000")
-    print("API documentation at: http://localhost:8000/docs")
+    print(f"Server will be available at: http://localhost:{args.port}")
+    print(f"API documentation at: http://localhost:{args.port}/docs")
     print("Press Ctrl+C to stop the server")
-    
-    uvicorn.run(
-        app, 
-        host="0.0.0.0", 
-        port=8000,
-        log_level="info"
-    )
+
+    if args.workers <= 1:
+        run_single(args.host, args.port, args.graceful_timeout)
+        return
+
+    print(f"Running {args.workers} workers (SIGHUP reloads, SIGTERM drains)")
+    prepare_shared_state(args.workers)
+    run_workers(args.host, args.port, args.workers, args.graceful_timeout)
+
+
+if __name__ == "__main__":
+    main()
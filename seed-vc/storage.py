@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import shutil
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Optional
+
+from observability import detail_enabled
+from retention import shard_path
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # Only needed for the S3 driver
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# Storage configuration
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local or s3
+
+# S3-compatible object store (AWS S3, MinIO, ...)
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # e.g. http://minio:9000, unset for AWS
+S3_PUBLIC_ENDPOINT_URL = os.getenv("S3_PUBLIC_ENDPOINT_URL") or None  # Host clients use in presigned URLs
+S3_REGION = os.getenv("AWS_REGION", "us-east-1")
+S3_PRESIGN_EXPIRY = int(os.getenv("S3_PRESIGN_EXPIRY", "3600"))  # Seconds presigned URLs stay valid
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))  # Bytes
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))  # Bytes per part
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "4"))  # Parts uploaded in parallel
+
+
+class StorageError(Exception):
+    """Raised when an object cannot be stored or located"""
+
+
+class Storage(ABC):
+    """
+    Where uploads and outputs are published
+
+    Keys look like ``<prefix>/<filename>``. ``direct_urls`` tells whether
+    ``url_for`` hands out URLs that bypass the API process entirely.
+    """
+
+    direct_urls = False
+
+    @abstractmethod
+    async def put_file(self, key: str, path: Path, content_type: str, move: bool = False):
+        """Store a local file; with ``move`` the file may be consumed instead of copied"""
+
+    @abstractmethod
+    async def get_file(self, key: str, path: Path):
+        """Copy an object to a local file"""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Tell whether an object is stored under a key"""
+
+    @abstractmethod
+    async def url_for(self, key: str, expires: int = S3_PRESIGN_EXPIRY) -> str:
+        """Return a URL clients can download the object from"""
+
+
+class LocalStorage(Storage):
+    """
+    Stores objects on the local disk, one sharded directory per key prefix
+
+    URLs point at the API itself, which serves the directories under /files.
+    """
+
+    def __init__(self, directories: Dict[str, Path], base_url: str):
+        self.directories = {prefix: Path(directory) for prefix, directory in directories.items()}
+        self.base_url = base_url.rstrip("/")
+
+    def path_for(self, key: str, create: bool = False) -> Path:
+        """Return the file backing a key"""
+        prefix, _, filename = key.rpartition("/")
+        directory = self.directories.get(prefix)
+        if directory is None:
+            raise StorageError(f"Invalid key '{key}'")
+        try:
+            return shard_path(directory, filename, create)
+        except ValueError:
+            raise StorageError(f"Invalid key '{key}'")
+
+    async def put_file(self, key: str, path: Path, content_type: str, move: bool = False):
+        destination = self.path_for(key, create=True)
+        if Path(path).resolve() == destination.resolve():
+            return
+        if move:
+            try:
+                os.replace(path, destination)
+                return
+            except OSError:
+                # Another filesystem, fall back to copying
+                pass
+        await asyncio.to_thread(shutil.copyfile, path, destination)
+
+    async def get_file(self, key: str, path: Path):
+        try:
+            await asyncio.to_thread(shutil.copyfile, self.path_for(key), path)
+        except FileNotFoundError:
+            raise StorageError(f"Object {key} not found")
+
+    async def exists(self, key: str) -> bool:
+        try:
+            return self.path_for(key).is_file()
+        except StorageError:
+            return False
+
+    async def url_for(self, key: str, expires: int = S3_PRESIGN_EXPIRY) -> str:
+        return f"{self.base_url}/files/{key}"
+
+
+class S3Storage(Storage):
+    """
+    Stores objects in an S3-compatible bucket
+
+    Large objects go up as multipart uploads with parts sent in parallel, and
+    URLs are genuine presigned GETs so clients download straight from the
+    object store.
+    """
+
+    direct_urls = True
+
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+                 public_endpoint_url: Optional[str] = S3_PUBLIC_ENDPOINT_URL, region: str = S3_REGION):
+        if boto3 is None:
+            raise RuntimeError("The S3 storage backend requires boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("S3_BUCKET must be set for the S3 storage backend")
+
+        self.bucket = bucket
+        # Path-style addressing works with MinIO and other stand-ins as well as AWS
+        config = BotoConfig(signature_version="s3v4", s3={"addressing_style": "path"},
+                            max_pool_connections=max(10, S3_UPLOAD_CONCURRENCY * 2))
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region, config=config)
+        # Presign against the address clients can reach, which may differ from ours
+        self.presign_client = self.client
+        if public_endpoint_url:
+            self.presign_client = boto3.client("s3", endpoint_url=public_endpoint_url, region_name=region,
+                                               config=config)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_UPLOAD_CONCURRENCY,
+        )
+
+    async def put_file(self, key: str, path: Path, content_type: str, move: bool = False):
+        try:
+            await asyncio.to_thread(self.client.upload_file, str(path), self.bucket, key,
+                                    ExtraArgs={"ContentType": content_type}, Config=self.transfer_config)
+        except Exception as e:
+            raise StorageError(f"Error uploading {key}: {e}") from e
+        if detail_enabled():
+            logger.info(f"Uploaded {key} to s3://{self.bucket}")
+
+    async def get_file(self, key: str, path: Path):
+        try:
+            await asyncio.to_thread(self.client.download_file, self.bucket, key, str(path), Config=self.transfer_config)
+        except Exception as e:
+            raise StorageError(f"Error downloading {key}: {e}") from e
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise StorageError(f"Error looking up {key}: {e}") from e
+
+    async def url_for(self, key: str, expires: int = S3_PRESIGN_EXPIRY) -> str:
+        # Signing is local computation, no request is made
+        return self.presign_client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=expires
+        )
+
+
+def create_storage(directories: Dict[str, Path], base_url: str, backend: str = STORAGE_BACKEND) -> Storage:
+    """Create the configured storage backend"""
+    if backend == "s3":
+        logger.info(f"Using S3 storage in bucket {S3_BUCKET} ({S3_ENDPOINT_URL or 'AWS'})")
+        return S3Storage()
+    if backend != "local":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND '{backend}'. Choose from: local, s3")
+    return LocalStorage(directories, base_url)
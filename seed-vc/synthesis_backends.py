@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import tempfile
+import wave
+from abc import abstractmethod
+from pathlib import Path
+from typing import Callable, Dict, List
+from urllib.parse import urljoin
+
+import httpx
+
+from backend_router import BackendAdapter, BackendInstance, BackendPool, get_adapter, register_adapter
+from gemini_api import gemini_backends, get_http_client
+
+logger = logging.getLogger(__name__)
+
+# Backends besides Gemini that /tts can route to, e.g. "styletts2,make-an-audio".
+# Each lists its instances in <NAME>_URLS, e.g. STYLETTS2_URLS=http://styletts2-a:8000,http://styletts2-b:8000
+SYNTHESIS_BACKENDS = [name.strip() for name in os.getenv("SYNTHESIS_BACKENDS", "").split(",") if name.strip()]
+BACKEND_API_KEY = os.getenv("BACKEND_API_KEY", "")  # Sent as the Authorization header to those backends
+
+# Frames of PCM passed to the sink at a time
+READ_FRAMES = 32 * 1024
+
+
+class BackendRequestError(Exception):
+    """Raised when a backend instance rejects a request; ``instance_ok`` tells whether to blame the instance"""
+
+    def __init__(self, message: str, instance_ok: bool):
+        super().__init__(message)
+        self.instance_ok = instance_ok
+
+
+class GeneratedFileAdapter(BackendAdapter):
+    """
+    A backend service answering ``POST /generate`` with the URL of a WAV file
+
+    This is the protocol of the services in docker-compose.yml: the response
+    is ``{"audio_url": ..., "s3_key": ...}``. The WAV is downloaded to a
+    temporary file and its PCM handed to the sink in blocks from a worker
+    thread. Connection errors and 5xx responses fail over to an instance not
+    tried yet; once audio has reached the sink the request is not retried.
+    """
+
+    path = "/generate"
+
+    @abstractmethod
+    def payload(self, text: str, voice: str) -> dict:
+        """Body of the generate request"""
+
+    async def synthesize(self, text: str, voice: str, sink: Callable[[bytes], None]) -> bool:
+        tried = set()
+        while len(tried) < len(self.pool.instances):
+            instance = self.pool.acquire(exclude=tried)
+            tried.add(instance)
+            instance_ok = False
+            try:
+                await self._synthesize_on(instance, text, voice, sink)
+                instance_ok = True
+                return True
+            except BackendRequestError as e:
+                logger.error(f"{self.name} request failed on {instance.url}: {e}")
+                instance_ok = e.instance_ok
+                if instance_ok:
+                    return False
+            except httpx.TransportError as e:
+                logger.error(f"{self.name} request failed on {instance.url}: {e!r}")
+            except (OSError, EOFError, wave.Error) as e:
+                logger.error(f"Unreadable {self.name} audio from {instance.url}: {e}")
+                return False
+            finally:
+                self.pool.release(instance, instance_ok)
+        return False
+
+    async def _synthesize_on(self, instance: BackendInstance, text: str, voice: str, sink: Callable[[bytes], None]):
+        client = self.pool.client_factory()
+        headers = {"Authorization": self.pool.api_key() or ""}
+        response = await client.post(f"{instance.url}{self.path}", json=self.payload(text, voice), headers=headers)
+        self._check(response)
+        try:
+            audio_url = urljoin(f"{instance.url}/", response.json()["audio_url"])
+        except (ValueError, KeyError, TypeError):
+            raise BackendRequestError(f"No audio_url in response {response.content[:200]!r}", instance_ok=False)
+
+        fd, name = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        path = Path(name)
+        try:
+            async with client.stream("GET", audio_url, headers=headers) as download:
+                self._check(download)
+                with open(path, "wb") as f:
+                    async for data in download.aiter_bytes(READ_FRAMES * 2):
+                        await asyncio.to_thread(f.write, data)
+            await asyncio.to_thread(self._read_pcm, path, sink)
+        finally:
+            path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _check(response: httpx.Response):
+        if response.status_code >= 500:
+            raise BackendRequestError(f"HTTP {response.status_code}", instance_ok=False)
+        if response.status_code >= 400:
+            # The instance is serving; the request is what it refused
+            raise BackendRequestError(f"HTTP {response.status_code}", instance_ok=True)
+
+    def _read_pcm(self, path: Path, sink: Callable[[bytes], None]):
+        with wave.open(str(path), "rb") as wav_file:
+            if (wav_file.getsampwidth(), wav_file.getnchannels(), wav_file.getframerate()) != (2, 1, self.sample_rate):
+                raise wave.Error(f"expected 16-bit mono {self.sample_rate} Hz, got {wav_file.getsampwidth() * 8}-bit "
+                                 f"{wav_file.getnchannels()} channel {wav_file.getframerate()} Hz")
+            while True:
+                pcm = wav_file.readframes(READ_FRAMES)
+                if not pcm:
+                    return
+                sink(pcm)
+
+
+@register_adapter
+class StyleTTS2Adapter(GeneratedFileAdapter):
+    """StyleTTS 2 speech synthesis"""
+
+    name = "styletts2"
+    sample_rate = 24000
+
+    def payload(self, text: str, voice: str) -> dict:
+        return {"text": text, "target_voice": voice}
+
+
+@register_adapter
+class MakeAnAudioAdapter(GeneratedFileAdapter):
+    """Make-An-Audio sound effects; the text is the prompt and there is no voice"""
+
+    name = "make-an-audio"
+    sample_rate = 16000
+
+    def payload(self, text: str, voice: str) -> dict:
+        return {"prompt": text}
+
+
+def backend_urls(name: str) -> List[str]:
+    """Instance URLs of a backend, from the comma separated <NAME>_URLS"""
+    variable = f"{name.upper().replace('-', '_')}_URLS"
+    return [url.strip() for url in os.getenv(variable, "").split(",") if url.strip()]
+
+
+def create_backends(names: List[str] = SYNTHESIS_BACKENDS) -> Dict[str, BackendAdapter]:
+    """
+    Build the configured synthesis backends by name, Gemini always included
+
+    Raises:
+        ValueError: If a backend is unknown or has no instances configured
+    """
+    backends: Dict[str, BackendAdapter] = {gemini_backends.adapter.name: gemini_backends.adapter}
+    for name in names:
+        if name not in backends:
+            adapter = get_adapter(name)
+            BackendPool(adapter, backend_urls(name), get_http_client, lambda: BACKEND_API_KEY)
+            backends[name] = adapter
+    return backends
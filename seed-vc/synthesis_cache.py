@@ -0,0 +1,262 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from retention import migrate_flat_files, shard_path
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+CACHE_MEMORY_ENTRIES = int(os.getenv("TTS_CACHE_MEMORY_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))  # 2 GiB
+CACHE_MAX_AGE = int(os.getenv("TTS_CACHE_MAX_AGE", str(7 * 24 * 3600)))  # 7 days
+
+# Bump when the cached audio for a given request would change
+CACHE_KEY_VERSION = 2
+
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_HORIZONTAL_WHITESPACE = re.compile(r"[^\S\n]+")
+_LINE_EDGE_SPACE = re.compile(r" ?\n ?")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text so that trivially different prompts share a cache entry
+
+    Runs of spaces and tabs collapse to one space, but line breaks are kept:
+    they delimit speaker turns and paragraphs and change what is rendered.
+    """
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = _HORIZONTAL_WHITESPACE.sub(" ", text)
+    return _LINE_EDGE_SPACE.sub("\n", text).strip()
+
+
+def make_cache_key(kind: str, text: str, model: str, audio_format: str = "wav", **params) -> str:
+    """
+    Build a content-addressed key for a synthesis request
+
+    Args:
+        kind: Request kind ("tts" or "multi-speaker")
+        text: The text to synthesize (normalized before hashing)
+        model: Upstream model name
+        audio_format: Output audio format
+        **params: Remaining request parameters (voice, speaker map, ...)
+
+    Returns:
+        Hex encoded SHA-256 of the canonical request
+    """
+    canonical = json.dumps(
+        {
+            "version": CACHE_KEY_VERSION,
+            "kind": kind,
+            "text": normalize_text(text),
+            "model": model,
+            "format": audio_format,
+            "params": params,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    filename: str
+    size: int
+    created_at: float
+
+
+class SynthesisCache:
+    """
+    Two tier cache of synthesized audio files.
+
+    The memory tier is an LRU of entry metadata so that hot hits never touch
+    the filesystem. The disk tier is the sharded output directory itself:
+    cached files are named after their key, and are evicted oldest first once
+    the total size exceeds ``max_bytes`` or an entry is older than ``max_age``
+    seconds. Set both to 0 when a RetentionManager owns the directory.
+
+    With ``shared`` set, other processes write to and evict from the same
+    directory: a key missing from the index is looked up on disk before
+    counting as a miss, and memory hits are checked against the filesystem.
+    """
+
+    def __init__(self, directory: Path, suffix: str = ".wav", memory_entries: int = CACHE_MEMORY_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES, max_age: int = CACHE_MAX_AGE, shared: bool = False):
+        self.directory = Path(directory)
+        self.suffix = suffix
+        self.shared = shared
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # Disk index ordered oldest first
+        self._disk: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._disk_bytes = 0
+
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+        self._load_disk_index()
+
+    def filename_for(self, key: str) -> str:
+        """Return the output filename used for a cache key"""
+        return f"{key}{self.suffix}"
+
+    def path_for(self, entry: CacheEntry) -> Path:
+        return shard_path(self.directory, entry.filename)
+
+    def _load_disk_index(self):
+        """Index cached files already present in the directory"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        migrate_flat_files(self.directory)
+        entries = []
+        for path in self.directory.glob(f"*/*/*{self.suffix}"):
+            key = path.name[:-len(self.suffix)]
+            if not _KEY_PATTERN.match(key):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append(CacheEntry(key, path.name, stat.st_size, stat.st_mtime))
+
+        for entry in sorted(entries, key=lambda e: e.created_at):
+            self._disk[entry.key] = entry
+            self._disk_bytes += entry.size
+
+        logger.info(f"Synthesis cache indexed {len(self._disk)} files ({self._disk_bytes} bytes) in {self.directory}")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Look up a cache entry, returning None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry, now) and \
+                    (not self.shared or self.path_for(entry).exists()):
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry
+
+            entry = self._disk.get(key)
+            if entry is not None:
+                if self._expired(entry, now):
+                    self._evict(key)
+                    self.stats["expirations"] += 1
+                elif self.path_for(entry).exists():
+                    self._remember(entry)
+                    self.stats["disk_hits"] += 1
+                    return entry
+                else:
+                    # File removed behind our back
+                    self._forget(key)
+            elif self.shared:
+                # Possibly written by another process since we indexed
+                entry = self._adopt(key)
+                if entry is not None and not self._expired(entry, now):
+                    self.stats["disk_hits"] += 1
+                    return entry
+
+            self.stats["misses"] += 1
+            return None
+
+    def _adopt(self, key: str) -> Optional[CacheEntry]:
+        filename = self.filename_for(key)
+        try:
+            stat = shard_path(self.directory, filename).stat()
+        except OSError:
+            return None
+        entry = CacheEntry(key, filename, stat.st_size, stat.st_mtime)
+        self._disk[key] = entry
+        self._disk_bytes += entry.size
+        self._remember(entry)
+        return entry
+
+    def put(self, key: str, size: int) -> CacheEntry:
+        """Register a file written to the shard path of ``filename_for(key)``"""
+        entry = CacheEntry(key, self.filename_for(key), size, time.time())
+        with self._lock:
+            self._forget(key)
+            self._disk[key] = entry
+            self._disk_bytes += size
+            self._remember(entry)
+            self._enforce_limits(entry.created_at)
+        return entry
+
+    def discard(self, filename: str):
+        """Forget the entry for a file that was removed by someone else"""
+        if not filename.endswith(self.suffix):
+            return
+        with self._lock:
+            self._forget(filename[:-len(self.suffix)])
+
+    def snapshot(self) -> Dict[str, int]:
+        """Return counters and current occupancy"""
+        with self._lock:
+            return {
+                **self.stats,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return self.max_age > 0 and now - entry.created_at > self.max_age
+
+    def _remember(self, entry: CacheEntry):
+        self._memory[entry.key] = entry
+        self._memory.move_to_end(entry.key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _forget(self, key: str):
+        self._memory.pop(key, None)
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self._disk_bytes -= entry.size
+
+    def _evict(self, key: str):
+        entry = self._disk.get(key)
+        self._forget(key)
+        if entry is None:
+            return
+        try:
+            self.path_for(entry).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove cached file {entry.filename}: {e}")
+
+    def _enforce_limits(self, now: float):
+        # Oldest entries sit at the front of the disk index
+        while self._disk:
+            key, entry = next(iter(self._disk.items()))
+            if self._expired(entry, now):
+                self.stats["expirations"] += 1
+            elif self.max_bytes > 0 and self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                self.stats["evictions"] += 1
+            else:
+                break
+            logger.info(f"Evicting cached audio {entry.filename} ({entry.size} bytes)")
+            self._evict(key)
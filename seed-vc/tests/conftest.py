@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The service modules live at the top level of seed-vc, next to api.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip("starlette")
+
+from audio_delivery import AudioFile, audio_response, parse_range
+
+ETAG = '"abc-123"'
+
+
+def audio(size: int = 1000) -> AudioFile:
+    return AudioFile(path=None, size=size, etag=ETAG, last_modified="Wed, 21 Oct 2015 07:28:00 GMT",
+                     data=b"\0" * size)
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=0-9,20-29", None),
+    ("bytes=20-10", None),
+    ("items=0-9", None),
+    ("bytes=-", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
+
+
+def test_range_request_gets_partial_content():
+    response = audio_response(audio(), {"range": "bytes=10-19"}, "audio/wav")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 10-19/1000"
+    assert response.headers["content-length"] == "10"
+
+
+def test_unsatisfiable_range_gets_416():
+    response = audio_response(audio(), {"range": "bytes=2000-"}, "audio/wav")
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1000"
+
+
+def test_stale_if_range_gets_the_whole_file():
+    response = audio_response(audio(), {"range": "bytes=10-19", "if-range": '"old"'}, "audio/wav")
+    assert response.status_code == 200
+    assert response.headers["content-length"] == "1000"
+
+
+def test_matching_if_range_gets_the_range():
+    response = audio_response(audio(), {"range": "bytes=10-19", "if-range": ETAG}, "audio/wav")
+    assert response.status_code == 206
+
+
+def test_matching_etag_is_not_modified():
+    assert audio_response(audio(), {"if-none-match": ETAG}, "audio/wav").status_code == 304
+    assert audio_response(audio(), {"if-none-match": '"other"'}, "audio/wav").status_code == 200
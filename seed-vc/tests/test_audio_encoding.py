@@ -0,0 +1,34 @@
+import pytest
+
+from audio_encoding import negotiate_format
+
+FIREFOX_MEDIA = "audio/webm,audio/ogg,audio/wav,audio/*;q=0.9,application/ogg;q=0.7,video/*;q=0.6,*/*;q=0.5"
+
+
+@pytest.mark.parametrize("accept", [
+    None,
+    "",
+    "*/*",
+    "audio/*",
+    FIREFOX_MEDIA,
+    "audio/ogg, audio/wav;q=0.1",
+    "audio/x-wav",
+    "audio/mpeg, */*;q=0.1",
+])
+def test_stored_wav_is_kept_whenever_it_is_accepted(accept):
+    assert negotiate_format(accept) is None
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("audio/mpeg", "mp3"),
+    ("audio/ogg", "opus"),
+    ("audio/flac;q=0.5, audio/mpeg;q=0.8", "mp3"),
+    ("audio/*, audio/wav;q=0", "mp3"),
+    ("audio/flac, audio/wav;q=0", "flac"),
+])
+def test_other_formats_only_when_wav_is_refused(accept, expected):
+    assert negotiate_format(accept) == expected
+
+
+def test_nothing_acceptable_serves_the_stored_file():
+    assert negotiate_format("text/html") is None
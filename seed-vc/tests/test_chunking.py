@@ -0,0 +1,52 @@
+import pytest
+
+from chunking import split_text, split_turns
+
+
+def test_short_text_is_one_chunk():
+    assert split_text("  Hello there.  ", 100) == ["Hello there."]
+    assert split_text("   ", 100) == []
+
+
+def test_sentences_are_packed_up_to_the_limit():
+    text = "One two. Three four. Five six."
+    assert split_text(text, 20) == ["One two. Three four.", "Five six."]
+
+
+def test_paragraphs_start_new_chunks():
+    text = "First paragraph.\n\nSecond paragraph that is longer."
+    assert split_text(text, 40) == ["First paragraph.", "Second paragraph that is longer."]
+
+
+def test_oversized_sentences_split_at_clauses_then_words():
+    chunks = split_text("alpha beta gamma, delta epsilon zeta eta theta iota", 20)
+    assert all(len(chunk) <= 20 for chunk in chunks)
+    assert " ".join(chunks).replace(",", "") == "alpha beta gamma delta epsilon zeta eta theta iota"
+
+
+def test_chunks_keep_every_word_in_order():
+    text = " ".join(f"Sentence number {i} is here." for i in range(50))
+    chunks = split_text(text, 120)
+    assert all(len(chunk) <= 120 for chunk in chunks)
+    assert " ".join(chunks) == text
+
+
+def test_turns_follow_line_breaks():
+    speakers = {"A": "Kore", "B": "Puck"}
+    assert split_turns("A: hi\nB: yo", speakers) == [("A", "hi"), ("B", "yo")]
+    assert split_turns("A: hi B: yo", speakers) == [("A", "hi B: yo")]
+
+
+def test_unannotated_lines_continue_the_turn():
+    assert split_turns("A: hello\nthere\n\nB: hi", ["A", "B"]) == [("A", "hello there"), ("B", "hi")]
+
+
+def test_longer_names_are_not_shadowed():
+    assert split_turns("Ann: one\nAnna: two", ["Ann", "Anna"]) == [("Ann", "one"), ("Anna", "two")]
+
+
+def test_text_before_the_first_turn_is_rejected():
+    with pytest.raises(ValueError):
+        split_turns("Narrator text\nA: hi", ["A"])
+    with pytest.raises(ValueError):
+        split_turns("", ["A"])
@@ -0,0 +1,169 @@
+import asyncio
+import base64
+import functools
+import json
+import threading
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("prometheus_client")
+
+import gemini_api
+from gemini_api import InlineDataDecoder
+from upstream_governor import UpstreamGovernor
+
+
+def response_body(pcm: bytes) -> bytes:
+    return json.dumps({
+        "candidates": [{
+            "content": {"parts": [{"inlineData": {"mimeType": "audio/L16;codec=pcm;rate=24000",
+                                                  "data": base64.b64encode(pcm).decode("ascii")}}]},
+            "finishReason": "STOP",
+        }]
+    }).encode("utf-8")
+
+
+@pytest.mark.parametrize("feed_size", [1, 3, 7, 64, 1000, 100000])
+def test_decoder_handles_any_feed_boundaries(feed_size):
+    pcm = bytes(range(256)) * 40
+    body = response_body(pcm)
+    decoded = bytearray()
+    decoder = InlineDataDecoder(decoded.extend, block_size=64)
+    for start in range(0, len(body), feed_size):
+        decoder.feed(body[start:start + feed_size])
+    assert decoder.done
+    assert bytes(decoded) == pcm
+    assert decoder.decoded_bytes == len(pcm)
+
+
+def test_decoder_unescapes_slashes():
+    pcm = b"\xff" * 30
+    body = response_body(pcm).replace(b"/", b"\\/")
+    decoded = bytearray()
+    decoder = InlineDataDecoder(decoded.extend)
+    decoder.feed(body)
+    assert bytes(decoded) == pcm
+
+
+def test_decoder_without_audio_is_not_done():
+    decoder = InlineDataDecoder(lambda pcm: None)
+    decoder.feed(b'{"candidates": [{"finishReason": "SAFETY"}]}')
+    assert not decoder.done
+    assert decoder.decoded_bytes == 0
+
+
+@pytest.fixture
+def governor(monkeypatch):
+    governor = UpstreamGovernor(requests_per_minute=0)
+    monkeypatch.setattr(gemini_api, "upstream_governor", governor)
+    return governor
+
+
+def half_open(governor: UpstreamGovernor):
+    for _ in range(governor.breaker.threshold):
+        governor.breaker.record_failure()
+    governor.breaker.opened_at = time.monotonic() - governor.breaker.reset_timeout
+
+
+def test_cancelled_trial_is_released(governor):
+    half_open(governor)
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def attempt():
+            call = gemini_api._UpstreamCall("test")
+            async with call.attempt():
+                started.set()
+                await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(attempt())
+        await started.wait()
+        assert not governor.breaker.allow()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert governor.breaker.state == "half_open"
+    assert governor.breaker.allow()
+
+
+def test_trial_closed_early_by_a_generator_is_released(governor):
+    half_open(governor)
+
+    async def stream():
+        call = gemini_api._UpstreamCall("test")
+        async with call.attempt():
+            yield b"pcm"
+            yield b"more pcm"
+
+    async def scenario():
+        chunks = stream()
+        await chunks.__anext__()
+        await chunks.aclose()
+
+    asyncio.run(scenario())
+    assert governor.breaker.allow()
+
+
+def test_rate_limited_attempt_neither_opens_nor_holds_the_circuit(governor):
+    half_open(governor)
+
+    async def scenario():
+        call = gemini_api._UpstreamCall("test")
+        async with call.attempt() as attempt:
+            assert attempt.http_error(httpx.Response(429, headers={"Retry-After": "2"}))
+        return call
+
+    call = asyncio.run(scenario())
+    assert call.last.retry_after == 2
+    assert governor.breaker.state == "half_open"
+    assert governor.breaker.allow()
+    assert governor.stats["rate_limited"] == 1
+
+
+def test_client_errors_are_not_retried(governor):
+    async def scenario():
+        call = gemini_api._UpstreamCall("test")
+        async with call.attempt() as attempt:
+            return attempt.http_error(httpx.Response(400))
+
+    assert asyncio.run(scenario()) is False
+    assert governor.breaker.failures == 0
+
+
+def test_server_errors_count_towards_opening_the_circuit(governor):
+    async def scenario():
+        call = gemini_api._UpstreamCall("test")
+        async with call.attempt() as attempt:
+            return attempt.http_error(httpx.Response(503))
+
+    assert asyncio.run(scenario()) is True
+    assert governor.breaker.failures == 1
+
+
+def test_audio_is_decoded_and_written_off_the_event_loop(governor, monkeypatch, tmp_path):
+    pcm = bytes(range(256)) * 1000
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=response_body(pcm)))
+    monkeypatch.setattr(httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=transport))
+    monkeypatch.setenv("GEMINI_API_KEY", "mock")
+    threads = set()
+    write = gemini_api.WavFileWriter.write
+
+    def recording_write(self, data: bytes):
+        threads.add(threading.get_ident())
+        write(self, data)
+
+    monkeypatch.setattr(gemini_api.WavFileWriter, "write", recording_write)
+
+    async def scenario():
+        try:
+            return await gemini_api.generate_tts_to_file_async("Hello there.", "Kore", tmp_path / "out.wav")
+        finally:
+            await gemini_api.close_http_client()
+
+    assert asyncio.run(scenario()) == 44 + len(pcm)
+    assert (tmp_path / "out.wav").read_bytes()[44:] == pcm
+    assert threads and threading.get_ident() not in threads
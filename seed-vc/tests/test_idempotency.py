@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyConflictError, IdempotencyStore
+from shared_state import SharedStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(SharedStore(str(tmp_path / "idempotency.db")), poll_interval=0.01)
+
+
+def test_repeat_replays_the_first_response(store):
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return {"audio_url": "/audio/a.wav"}
+
+    async def scenario():
+        first = await store.run("key", "fingerprint", work)
+        second = await store.run("key", "fingerprint", work)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == ({"audio_url": "/audio/a.wav"}, False)
+    assert second == ({"audio_url": "/audio/a.wav"}, True)
+    assert len(calls) == 1
+    assert store.stats["replayed"] == 1
+
+
+def test_reusing_a_key_with_another_request_conflicts(store):
+    async def work():
+        return {"ok": True}
+
+    async def scenario():
+        await store.run("key", "fingerprint", work)
+        await store.run("key", "other", work)
+
+    with pytest.raises(IdempotencyConflictError):
+        asyncio.run(scenario())
+    assert store.stats["conflicts"] == 1
+
+
+def test_concurrent_repeats_in_one_process_run_once(store):
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    async def scenario():
+        return await asyncio.gather(*(store.run("key", "fingerprint", work) for _ in range(10)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert sum(1 for _, replayed in results if not replayed) == 1
+    assert all(response == {"ok": True} for response, _ in results)
+
+
+def test_failed_request_releases_its_key(store):
+    attempts = []
+
+    async def work():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("upstream failed")
+        return {"ok": True}
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await store.run("key", "fingerprint", work)
+        return await store.run("key", "fingerprint", work)
+
+    assert asyncio.run(scenario()) == ({"ok": True}, False)
+    assert len(attempts) == 2
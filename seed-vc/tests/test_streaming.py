@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import socket
+import threading
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("fastapi")
+pytest.importorskip("prometheus_client")
+uvicorn = pytest.importorskip("uvicorn")
+
+import gemini_api
+import mock_gemini
+from backend_router import BackendInstance
+from upstream_governor import UpstreamGovernor
+
+CLIP_SECONDS = 1.0
+CHUNK_SECONDS = 0.25
+CHUNK_DELAY = 0.05
+CLIP_BYTES = int(CLIP_SECONDS * mock_gemini.SAMPLE_RATE) * 2
+
+
+@pytest.fixture(scope="module")
+def mock_server():
+    """Serve the mock Gemini app over real HTTP, so streamed chunks arrive as they are sent"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(mock_gemini.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "mock Gemini server did not start"
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/v1beta/models"
+    server.should_exit = True
+    thread.join(timeout=10)
+
+
+@pytest.fixture
+def upstream(mock_server, monkeypatch):
+    """Send upstream calls to the mock server, which streams a one second clip in four paced chunks"""
+    monkeypatch.setenv("GEMINI_API_KEY", "mock")
+    monkeypatch.setattr(mock_gemini, "MOCK_LATENCY", 0)
+    monkeypatch.setattr(mock_gemini, "MOCK_AUDIO_SECONDS", CLIP_SECONDS)
+    monkeypatch.setattr(mock_gemini, "MOCK_CHUNK_SECONDS", CHUNK_SECONDS)
+    monkeypatch.setattr(mock_gemini, "MOCK_CHUNK_DELAY", CHUNK_DELAY)
+    monkeypatch.setattr(gemini_api, "upstream_governor", UpstreamGovernor(requests_per_minute=0))
+    monkeypatch.setattr(gemini_api.gemini_backends, "instances", [BackendInstance(mock_server)])
+
+
+def test_audio_is_relayed_chunk_by_chunk(upstream):
+    async def scenario():
+        started = time.perf_counter()
+        arrivals = []
+        try:
+            async for pcm in gemini_api.stream_tts_pcm("Hello there.", "Kore"):
+                arrivals.append((time.perf_counter() - started, len(pcm)))
+        finally:
+            await gemini_api.close_http_client()
+        return arrivals
+
+    arrivals = asyncio.run(scenario())
+    assert len(arrivals) == CLIP_SECONDS / CHUNK_SECONDS
+    assert sum(size for _, size in arrivals) == CLIP_BYTES
+    # The first chunk is not held back until the whole clip is synthesized
+    assert arrivals[-1][0] - arrivals[0][0] >= (len(arrivals) - 1) * CHUNK_DELAY * 0.8
+
+
+def test_malformed_event_fails_the_attempt(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "mock")
+    governor = UpstreamGovernor(requests_per_minute=0)
+    monkeypatch.setattr(gemini_api, "upstream_governor", governor)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text="data: {not json\r\n\r\n"))
+    monkeypatch.setattr(httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=transport))
+
+    async def scenario():
+        try:
+            async for _ in gemini_api.stream_tts_pcm("Hello there.", "Kore"):
+                pass
+        finally:
+            await gemini_api.close_http_client()
+
+    with pytest.raises(RuntimeError, match="malformed event"):
+        asyncio.run(scenario())
+    assert governor.breaker.failures == 1
+
+
+def test_tts_stream_endpoint_streams_and_persists(upstream, monkeypatch, tmp_path):
+    # api.py keeps its files relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    api = pytest.importorskip("api")
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=api.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.post("/tts/stream", json={"text": "Hello there.", "voice": "Kore"},
+                                         headers={"Authorization": api.API_KEY})
+        finally:
+            await gemini_api.close_http_client()
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "audio/wav"
+    assert response.content[:4] == b"RIFF"
+    assert len(response.content) == 44 + CLIP_BYTES
+
+    key = response.headers["X-Audio-Key"]
+    assert key.startswith(f"{api.OUTPUTS_PREFIX}/")
+    persisted = api.output_path(key.split("/")[-1])
+    assert persisted.stat().st_size == 44 + CLIP_BYTES
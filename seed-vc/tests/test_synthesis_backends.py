@@ -0,0 +1,93 @@
+import asyncio
+import functools
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("prometheus_client")
+
+import gemini_api
+from backend_router import BackendAdapter
+from synthesis_backends import StyleTTS2Adapter, create_backends
+
+PCM = bytes(range(256)) * 100
+WAV = gemini_api.build_wav_header(len(PCM)) + PCM
+
+
+def install(monkeypatch, handler):
+    monkeypatch.setattr(httpx, "AsyncClient",
+                        functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler)))
+
+
+def synthesize(adapter, text="Hello there.", voice="amy"):
+    async def scenario():
+        pcm = bytearray()
+        try:
+            ok = await adapter.synthesize(text, voice, pcm.extend)
+        finally:
+            await gemini_api.close_http_client()
+        return ok, bytes(pcm)
+
+    return asyncio.run(scenario())
+
+
+def test_adapters_must_implement_synthesize():
+    with pytest.raises(TypeError):
+        BackendAdapter()
+
+
+def test_backends_come_from_configuration(monkeypatch):
+    monkeypatch.setenv("STYLETTS2_URLS", "http://a:8000, http://b:8000")
+    backends = create_backends(["styletts2"])
+    assert set(backends) == {"gemini", "styletts2"}
+    assert [i.url for i in backends["styletts2"].pool.instances] == ["http://a:8000", "http://b:8000"]
+
+    with pytest.raises(ValueError):
+        create_backends(["no-such-backend"])
+
+
+def test_failed_instance_fails_over(monkeypatch):
+    monkeypatch.setenv("STYLETTS2_URLS", "http://a,http://b")
+    adapter = create_backends(["styletts2"])["styletts2"]
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append((request.method, request.url.host, request.url.path))
+        if request.url.host == "a":
+            return httpx.Response(503)
+        if request.method == "POST":
+            assert json.loads(request.read()) == {"text": "Hello there.", "target_voice": "amy"}
+            return httpx.Response(200, json={"audio_url": "/audio/clip.wav", "s3_key": "outputs/clip.wav"})
+        return httpx.Response(200, content=WAV)
+
+    install(monkeypatch, handler)
+    # Start on the failing instance
+    adapter.pool.instances[1].outstanding = 1
+    assert synthesize(adapter) == (True, PCM)
+    assert requests == [("POST", "a", "/generate"), ("POST", "b", "/generate"), ("GET", "b", "/audio/clip.wav")]
+    assert adapter.pool.instances[0].failures == 1
+
+
+def test_rejected_request_is_not_retried(monkeypatch):
+    monkeypatch.setenv("STYLETTS2_URLS", "http://a,http://b")
+    adapter = create_backends(["styletts2"])["styletts2"]
+    install(monkeypatch, lambda request: httpx.Response(422))
+    assert synthesize(adapter) == (False, b"")
+    assert sum(i.requests for i in adapter.pool.instances) == 1
+    assert sum(i.failures for i in adapter.pool.instances) == 0
+
+
+def test_audio_in_another_format_is_refused(monkeypatch):
+    monkeypatch.setenv("STYLETTS2_URLS", "http://a")
+    adapter = create_backends(["styletts2"])["styletts2"]
+    wav = gemini_api.build_wav_header(len(PCM), sample_rate=44100) + PCM
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            return httpx.Response(200, json={"audio_url": "http://a/clip.wav"})
+        return httpx.Response(200, content=wav)
+
+    install(monkeypatch, handler)
+    assert isinstance(adapter, StyleTTS2Adapter)
+    assert synthesize(adapter) == (False, b"")
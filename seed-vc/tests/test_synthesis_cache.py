@@ -0,0 +1,27 @@
+from synthesis_cache import make_cache_key, normalize_text
+
+
+def test_normalize_collapses_horizontal_whitespace():
+    assert normalize_text("  Hello \t  world  ") == "Hello world"
+
+
+def test_normalize_keeps_line_breaks():
+    assert normalize_text("A: hi \r\n\tB: yo") == "A: hi\nB: yo"
+
+
+def test_trivially_different_text_shares_a_key():
+    assert make_cache_key("tts", "Hello  world ", "model", voice="Kore") == \
+        make_cache_key("tts", "Hello world", "model", voice="Kore")
+
+
+def test_scripts_differing_in_line_breaks_get_different_keys():
+    speakers = {"A": "Kore", "B": "Puck"}
+    assert make_cache_key("multi-speaker", "A: hi\nB: yo", "model", speakers=speakers) != \
+        make_cache_key("multi-speaker", "A: hi B: yo", "model", speakers=speakers)
+
+
+def test_parameters_change_the_key():
+    assert make_cache_key("tts", "Hello", "model", voice="Kore") != \
+        make_cache_key("tts", "Hello", "model", voice="Puck")
+    assert make_cache_key("tts", "Hello", "model", "wav", voice="Kore") != \
+        make_cache_key("tts", "Hello", "model", "mp3", voice="Kore")
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from transcription import make_transcript_key, merge_overlap, plan_windows, transcribe_windows
+
+
+def test_windows_overlap_and_cover_the_audio():
+    windows = plan_windows(100, sample_rate=1, window=40, overlap=5)
+    assert windows == [(0, 40), (35, 75), (70, 100)]
+
+
+def test_short_audio_is_one_window():
+    assert plan_windows(10, sample_rate=1, window=40, overlap=5) == [(0, 10)]
+
+
+def test_merge_drops_the_repeated_words():
+    previous = "and then we went down to the river"
+    assert merge_overlap(previous, "To the river, where the boats were") == "where the boats were"
+
+
+def test_merge_keeps_text_without_overlap():
+    assert merge_overlap("the end of one window", "something else entirely") == "something else entirely"
+
+
+def test_merge_never_removes_more_than_half():
+    text = "Mock transcript of 30.0 seconds of audio."
+    assert merge_overlap(text, text)
+
+
+def test_transcript_key_depends_on_the_model_and_language():
+    key = make_transcript_key("a" * 64, "model")
+    assert key != make_transcript_key("a" * 64, "other")
+    assert key != make_transcript_key("a" * 64, "model", language="de")
+
+
+def test_windows_are_yielded_in_order(tmp_path):
+    pcm_path = tmp_path / "audio.pcm"
+    pcm_path.write_bytes(b"\0\0" * 100)
+
+    async def transcribe(pcm: bytes):
+        # Later windows finish first
+        await asyncio.sleep(0.001 * (300 - len(pcm)))
+        return f"window of {len(pcm) // 2} samples"
+
+    async def scenario():
+        return [segment async for segment in transcribe_windows(pcm_path, transcribe, sample_rate=1, window=40,
+                                                                overlap=5, workers=3)]
+
+    segments = asyncio.run(scenario())
+    assert [segment["index"] for segment in segments] == [0, 1, 2]
+    assert [(segment["start"], segment["end"]) for segment in segments] == [(0, 40), (40, 75), (75, 100)]
+
+
+def test_failed_window_fails_the_transcript(tmp_path):
+    pcm_path = tmp_path / "audio.pcm"
+    pcm_path.write_bytes(b"\0\0" * 100)
+
+    async def transcribe(pcm: bytes):
+        return None
+
+    async def scenario():
+        return [segment async for segment in transcribe_windows(pcm_path, transcribe, sample_rate=1, window=40,
+                                                                overlap=5)]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(scenario())
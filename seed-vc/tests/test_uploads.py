@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("multipart")
+
+from uploads import UploadOffsetError, UploadSessions, UploadTooLargeError
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    return UploadSessions(tmp_path, limit=1024)
+
+
+def test_append_advances_the_offset(sessions):
+    upload_id = sessions.create(6)["upload_id"]
+
+    async def scenario():
+        await sessions.append(upload_id, 0, stream(b"abc"))
+        return await sessions.append(upload_id, 3, stream(b"def"))
+
+    assert asyncio.run(scenario())["offset"] == 6
+    assert sessions.status(upload_id)["offset"] == 6
+
+
+def test_append_at_the_wrong_offset_reports_the_current_one(sessions):
+    upload_id = sessions.create(6)["upload_id"]
+
+    async def scenario():
+        await sessions.append(upload_id, 0, stream(b"abc"))
+        await sessions.append(upload_id, 1, stream(b"bcd"))
+
+    with pytest.raises(UploadOffsetError) as error:
+        asyncio.run(scenario())
+    assert error.value.offset == 3
+
+
+def test_chunk_past_the_declared_length_is_dropped(sessions):
+    upload_id = sessions.create(4)["upload_id"]
+
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(sessions.append(upload_id, 0, stream(b"abc", b"def")))
+    assert sessions.status(upload_id)["offset"] == 0
+
+
+def test_session_over_the_limit_is_refused(sessions):
+    with pytest.raises(UploadTooLargeError):
+        sessions.create(2048)
+
+
+def test_concurrent_appends_are_serialized(sessions):
+    upload_id = sessions.create(9)["upload_id"]
+
+    async def scenario():
+        results = await asyncio.gather(*(sessions.append(upload_id, 0, stream(b"abc")) for _ in range(3)),
+                                       return_exceptions=True)
+        return results
+
+    results = asyncio.run(scenario())
+    assert sum(1 for result in results if isinstance(result, dict)) == 1
+    assert all(isinstance(result, UploadOffsetError) for result in results if not isinstance(result, dict))
+    assert sessions.status(upload_id)["offset"] == 3
+    assert sessions.snapshot()["appending"] == 0
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from upstream_governor import CircuitBreaker, UpstreamGovernor, UpstreamUnavailableError, parse_retry_after
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def wait_out(breaker: CircuitBreaker):
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+
+def test_half_open_breaker_admits_a_single_trial():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    wait_out(breaker)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+
+def test_trial_outcome_closes_or_reopens_the_breaker():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    wait_out(breaker)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    wait_out(breaker)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_released_trial_lets_the_next_request_through():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    wait_out(breaker)
+    assert breaker.allow()
+    # The trial was cancelled before it had an outcome
+    breaker.release_trial()
+    assert breaker.allow()
+
+
+def test_rate_limits_never_open_the_circuit():
+    governor = UpstreamGovernor(requests_per_minute=0)
+    for _ in range(governor.breaker.threshold * 3):
+        governor.admit(0)
+        governor.record_rate_limited()
+    assert governor.breaker.state == "closed"
+    assert governor.snapshot()["rate_limited"] == governor.breaker.threshold * 3
+
+
+def test_quota_rejection_gives_the_trial_back():
+    governor = UpstreamGovernor(requests_per_minute=0, max_wait=1)
+    open_breaker(governor.breaker)
+    wait_out(governor.breaker)
+    governor.blocked_until = time.monotonic() + 60
+    with pytest.raises(UpstreamUnavailableError):
+        governor.admit(0)
+    governor.blocked_until = 0
+    assert governor.admit(0) == 0
+
+
+def test_open_circuit_rejects_with_retry_after():
+    governor = UpstreamGovernor(requests_per_minute=0)
+    open_breaker(governor.breaker)
+    with pytest.raises(UpstreamUnavailableError) as error:
+        governor.admit(0)
+    assert error.value.retry_after >= 1
+
+
+def test_backoff_honours_retry_after():
+    governor = UpstreamGovernor(requests_per_minute=0, base_delay=0.1)
+    assert governor.backoff(0, retry_after=5) >= 5
+    assert governor.blocked_until > time.monotonic() + 4
+
+
+def test_retry_after_in_seconds_or_as_a_date():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
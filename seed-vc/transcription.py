@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from shared_state import SharedStore
+
+logger = logging.getLogger(__name__)
+
+# Windowing of long audio
+STT_SAMPLE_RATE = 16000  # Audio is decoded to 16 kHz mono before it is sent upstream
+STT_WINDOW_SECONDS = float(os.getenv("STT_WINDOW_SECONDS", "30"))  # Audio per upstream request
+STT_WINDOW_OVERLAP_SECONDS = float(os.getenv("STT_WINDOW_OVERLAP_SECONDS", "2"))  # Shared by adjacent windows
+STT_WINDOW_WORKERS = int(os.getenv("STT_WINDOW_WORKERS", "4"))  # Windows transcribed concurrently per request
+# Longest run of words looked for where adjacent window transcripts overlap
+STT_MERGE_MAX_WORDS = 40
+
+# Transcript cache
+STT_CACHE_DB = os.getenv("STT_CACHE_DB", "./state/transcripts.db")  # Used when no shared store is configured
+STT_CACHE_TTL = int(os.getenv("STT_CACHE_TTL", str(30 * 24 * 3600)))
+
+# Bump when the transcript for given audio would change
+TRANSCRIPT_KEY_VERSION = 1
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# Transcribes one window: 16-bit mono PCM -> text, or None on failure
+WindowTranscriber = Callable[[bytes], Awaitable[Optional[str]]]
+
+
+def make_transcript_key(audio_sha256: str, model: str, language: Optional[str] = None,
+                        window: float = STT_WINDOW_SECONDS, overlap: float = STT_WINDOW_OVERLAP_SECONDS) -> str:
+    """Build a content-addressed key for the transcript of some audio"""
+    canonical = json.dumps(
+        {
+            "version": TRANSCRIPT_KEY_VERSION,
+            "audio": audio_sha256,
+            "model": model,
+            "language": language,
+            "window": window,
+            "overlap": overlap,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def plan_windows(samples: int, sample_rate: int = STT_SAMPLE_RATE, window: float = STT_WINDOW_SECONDS,
+                 overlap: float = STT_WINDOW_OVERLAP_SECONDS) -> List[Tuple[int, int]]:
+    """
+    Split ``samples`` of audio into overlapping windows
+
+    Returns:
+        (start, end) sample offsets; every window but the first begins
+        ``overlap`` seconds before the previous one ends
+    """
+    length = max(1, int(window * sample_rate))
+    shared = min(int(overlap * sample_rate), length // 2)
+    windows = []
+    start = 0
+    while True:
+        end = min(samples, start + length)
+        windows.append((start, end))
+        if end >= samples:
+            return windows
+        start = end - shared
+
+
+def _normalize_words(text: str) -> List[str]:
+    return [word.lower() for word in _WORD.findall(text)]
+
+
+def merge_overlap(previous: str, text: str, max_words: int = STT_MERGE_MAX_WORDS) -> str:
+    """
+    Drop the start of ``text`` that repeats the end of ``previous``
+
+    Adjacent windows share some audio, so the words spoken in it usually
+    appear at the end of one transcript and the start of the next. The
+    longest run of at least two words found both ways is removed from
+    ``text``; punctuation and case are ignored when comparing. The overlap
+    is a small part of a window, so at most half of ``text`` is removed.
+    """
+    tail = _normalize_words(previous)[-max_words:]
+    tokens = list(_WORD.finditer(text))
+    head = [match.group().lower() for match in tokens[:max_words]]
+    for size in range(min(len(tail), len(head), len(tokens) // 2), 1, -1):
+        if tail[-size:] == head[:size]:
+            return text[tokens[size - 1].end():].lstrip(" ,.;:!?-").strip()
+    return text.strip()
+
+
+def _read_pcm(path: Path, start: int, end: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start * 2)
+        return f.read((end - start) * 2)
+
+
+async def transcribe_windows(pcm_path: Path, transcribe: WindowTranscriber, sample_rate: int = STT_SAMPLE_RATE,
+                             window: float = STT_WINDOW_SECONDS, overlap: float = STT_WINDOW_OVERLAP_SECONDS,
+                             workers: int = STT_WINDOW_WORKERS) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Transcribe a raw 16-bit mono PCM file window by window
+
+    Windows are transcribed concurrently and yielded in order as soon as
+    they and every earlier window are done. Each segment covers the audio
+    after the previous one, with the words repeated from the overlap
+    removed. At most ``workers`` windows are in flight or waiting to be
+    yielded.
+
+    Yields:
+        Segments with ``index``, ``start`` and ``end`` in seconds, and ``text``
+
+    Raises:
+        RuntimeError: If a window fails
+        UpstreamUnavailableError: If the upstream is over quota or the circuit is open
+    """
+    samples = pcm_path.stat().st_size // 2
+    windows = plan_windows(samples, sample_rate, window, overlap)
+    logger.info(f"Transcribing {samples / sample_rate:.1f}s of audio in {len(windows)} windows with {workers} workers")
+    # A slot is released once its window has been yielded, not when it finishes
+    slots = asyncio.Semaphore(workers)
+
+    async def run(index: int, start: int, end: int) -> str:
+        await slots.acquire()
+        pcm = await asyncio.to_thread(_read_pcm, pcm_path, start, end)
+        # The transcriber retries transient upstream errors itself
+        text = await transcribe(pcm)
+        if text is None:
+            raise RuntimeError(f"Window {index + 1}/{len(windows)} failed")
+        return text
+
+    tasks = [asyncio.ensure_future(run(i, start, end)) for i, (start, end) in enumerate(windows)]
+    previous = ""
+    covered = 0
+    try:
+        for index, task in enumerate(tasks):
+            text = await task
+            slots.release()
+            merged = merge_overlap(previous, text) if index else text.strip()
+            previous = text
+            end = windows[index][1]
+            yield {
+                "index": index,
+                "start": round(covered / sample_rate, 3),
+                "end": round(end / sample_rate, 3),
+                "text": merged,
+            }
+            covered = end
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def join_segments(segments: List[Dict[str, Any]]) -> str:
+    return " ".join(segment["text"] for segment in segments if segment["text"])
+
+
+class TranscriptCache:
+    """
+    Transcripts stored by the content hash of their audio, in SQLite.
+
+    Transcripts are small, so they are kept as JSON rows rather than files and
+    live for ``ttl`` seconds from when they were last used. With a shared
+    store every worker process sees every transcript.
+    """
+
+    def __init__(self, store: SharedStore, ttl: int = STT_CACHE_TTL):
+        self.store = store
+        self.ttl = ttl
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+        }
+        self.store.executescript("""
+            CREATE TABLE IF NOT EXISTS transcripts (
+                key TEXT PRIMARY KEY,
+                last_access REAL NOT NULL,
+                response TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS transcripts_by_access ON transcripts (last_access);
+        """)
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self.store.transaction() as connection:
+            row = connection.execute("SELECT response FROM transcripts WHERE key = ? AND last_access >= ?",
+                                     (key, now - self.ttl)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE transcripts SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        transcript = await asyncio.to_thread(self._get, key)
+        self.stats["hits" if transcript is not None else "misses"] += 1
+        return transcript
+
+    async def put(self, key: str, transcript: Dict[str, Any]):
+        await asyncio.to_thread(
+            self.store.execute,
+            "INSERT OR REPLACE INTO transcripts (key, last_access, response) VALUES (?, ?, ?)",
+            (key, time.time(), json.dumps(transcript, ensure_ascii=False)),
+        )
+
+    def _expire(self) -> int:
+        with self.store.transaction() as connection:
+            return connection.execute("DELETE FROM transcripts WHERE last_access < ?",
+                                      (time.time() - self.ttl,)).rowcount
+
+    async def _reaper(self):
+        while True:
+            try:
+                expired = await asyncio.to_thread(self._expire)
+                if expired:
+                    logger.info(f"Expired {expired} cached transcripts")
+            except Exception as e:
+                logger.error(f"Transcript expiry failed: {e}", exc_info=True)
+            await asyncio.sleep(min(3600, max(1, self.ttl / 4)))
+
+    async def start(self):
+        self._task = asyncio.create_task(self._reaper())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.stats)
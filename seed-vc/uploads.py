@@ -0,0 +1,427 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# Upload configuration
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(200 * 1024 * 1024)))  # Largest accepted file
+UPLOAD_WRITE_CHUNK = 1024 * 1024  # Bytes buffered before each disk write
+# Resumable uploads in progress; kept outside the uploads directory so retention never indexes them
+UPLOAD_SESSION_DIR = Path(os.getenv("UPLOAD_SESSION_DIR", "./upload_sessions"))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))  # Idle sessions are dropped after this
+UPLOAD_SESSION_SWEEP_INTERVAL = 600
+DEFAULT_UPLOAD_EXTENSION = ".wav"
+
+_EXTENSION_PATTERN = re.compile(r"^\.[a-z0-9]{1,8}$")
+_SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+_CONTENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_EXTENSIONS_BY_TYPE = {
+    "audio/wav": ".wav",
+    "audio/x-wav": ".wav",
+    "audio/wave": ".wav",
+    "audio/mpeg": ".mp3",
+    "audio/mp3": ".mp3",
+    "audio/ogg": ".ogg",
+    "audio/opus": ".opus",
+    "audio/flac": ".flac",
+    "audio/mp4": ".m4a",
+    "audio/webm": ".webm",
+}
+
+
+class UploadError(Exception):
+    """Raised when an upload request is malformed"""
+
+
+class UploadTooLargeError(UploadError):
+    """Raised as soon as an upload is known to exceed the size limit"""
+
+
+class UploadOffsetError(UploadError):
+    """Raised when a resumable chunk does not start where the upload left off"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadNotFoundError(UploadError):
+    """Raised for an unknown or expired resumable upload"""
+
+
+def upload_extension(filename: Optional[str], content_type: Optional[str] = None) -> str:
+    """Pick the stored file extension from the client's filename, falling back to its media type"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if _EXTENSION_PATTERN.match(extension):
+        return extension
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return _EXTENSIONS_BY_TYPE.get(media_type, DEFAULT_UPLOAD_EXTENSION)
+
+
+def content_hash_of(filename: str) -> Optional[str]:
+    """Return the SHA-256 a content-addressed upload is named after, None for other names"""
+    stem = os.path.splitext(filename)[0]
+    return stem if _CONTENT_HASH_PATTERN.match(stem) else None
+
+
+def _write(f, digest, data: bytes):
+    f.write(data)
+    if digest is not None:
+        digest.update(data)
+
+
+async def write_stream(chunks: AsyncIterator[bytes], f, limit: int, digest=None) -> int:
+    """
+    Copy an async byte stream into an open file, hashing it on the way
+
+    Chunks are batched into writes of ``UPLOAD_WRITE_CHUNK`` bytes made on the
+    threadpool, so neither the disk nor the hash blocks the event loop.
+
+    Raises:
+        UploadTooLargeError: As soon as more than ``limit`` bytes arrive
+    """
+    size = 0
+    buffer = bytearray()
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > limit:
+            raise UploadTooLargeError(f"Upload exceeds {limit} bytes")
+        buffer += chunk
+        if len(buffer) >= UPLOAD_WRITE_CHUNK:
+            await asyncio.to_thread(_write, f, digest, bytes(buffer))
+            buffer.clear()
+    if buffer:
+        await asyncio.to_thread(_write, f, digest, bytes(buffer))
+    return size
+
+
+class MultipartFileReader:
+    """
+    Streams one file field out of a multipart/form-data body
+
+    Starlette's form parsing spools the whole body before the handler sees
+    it; this feeds the raw body through the multipart parser instead and
+    yields the file's bytes as they arrive. ``filename`` and ``content_type``
+    are filled in once the part's headers have been read.
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes], content_type: str, field: str = "file"):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise UploadError("Multipart body has no boundary")
+        self.stream = stream
+        self.field = field
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.found = False
+
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._done = False
+        self._pending: List[bytes] = []
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("latin-1")
+        # Only the first part with the field name is taken, later ones are skipped
+        self._in_file = name == self.field and not self.found
+        if self._in_file:
+            self.found = True
+            filename = options.get(b"filename")
+            self.filename = filename.decode("utf-8", "replace") if filename else None
+            part_type = self._headers.get(b"content-type")
+            self.content_type = part_type.decode("latin-1") if part_type else None
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._pending.append(data[start:end])
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._done = True
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        async for data in self.stream:
+            try:
+                self._parser.write(data)
+            except MultipartParseError as e:
+                raise UploadError(f"Malformed multipart body: {e}")
+            for piece in self._pending:
+                yield piece
+            self._pending.clear()
+            if self._done:
+                # The rest of the body is other fields, nothing worth reading
+                return
+        self._parser.finalize()
+        if not self.found:
+            raise UploadError(f"No '{self.field}' file in the form")
+        if not self._done:
+            raise UploadError("Multipart body ended inside the file")
+
+
+class ReceivedUpload:
+    """A complete upload on local disk, identified by its content hash"""
+
+    def __init__(self, path: Path, sha256: str, size: int, extension: str = DEFAULT_UPLOAD_EXTENSION,
+                 content_type: Optional[str] = None):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.extension = extension
+        self.content_type = content_type
+
+    @property
+    def filename(self) -> str:
+        # Content-addressed, so identical uploads map to one stored file
+        return f"{self.sha256}{self.extension}"
+
+
+async def receive_upload(chunks: AsyncIterator[bytes], directory: Path,
+                         limit: int = UPLOAD_MAX_FILE_BYTES) -> ReceivedUpload:
+    """
+    Stream an upload into a temporary file in ``directory``
+
+    The caller owns the returned file and must remove it once stored, and
+    sets its extension and media type, which for a multipart body are only
+    known once the part headers have been read. The temporary name ends in .tmp so the retention janitor clears
+    any left behind by a crash.
+    """
+    path = directory / f"{uuid.uuid4().hex}.upload.tmp"
+    digest = hashlib.sha256()
+    try:
+        with open(path, "wb") as f:
+            size = await write_stream(chunks, f, limit, digest)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return ReceivedUpload(path, digest.hexdigest(), size)
+
+
+def hash_file(path: Path) -> str:
+    """SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(UPLOAD_WRITE_CHUNK)
+            if not data:
+                return digest.hexdigest()
+            digest.update(data)
+
+
+class UploadSessions:
+    """
+    Resumable uploads of large source audio.
+
+    A session is created with the total size, then its bytes arrive in any
+    number of requests, each starting at the offset the previous one reached.
+    An interrupted client asks for the current offset and carries on from
+    there instead of starting over. Sessions live as a ``.json`` description
+    and a ``.part`` file in ``directory``, so any worker process can continue
+    one another worker started; the offset is the size of the part file.
+    Once stored, a session remembers its key so a client that lost the final
+    response can still look it up. Sessions idle for ``ttl`` seconds are
+    removed.
+    """
+
+    def __init__(self, directory: Path = UPLOAD_SESSION_DIR, limit: int = UPLOAD_MAX_FILE_BYTES,
+                 ttl: int = UPLOAD_SESSION_TTL):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.limit = limit
+        self.ttl = ttl
+        # Per-session append locks and how many appends hold or wait for each
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._appenders: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "created": 0,
+            "completed": 0,
+            "expired": 0,
+        }
+
+    def _paths(self, upload_id: str) -> Tuple[Path, Path]:
+        if not _SESSION_ID_PATTERN.match(upload_id):
+            raise UploadNotFoundError(upload_id)
+        return self.directory / f"{upload_id}.json", self.directory / f"{upload_id}.part"
+
+    @staticmethod
+    def _status(upload_id: str, meta: Dict, offset: int) -> Dict:
+        status = {"upload_id": upload_id, "offset": offset, "length": meta["length"]}
+        if "s3_key" in meta:
+            status["s3_key"] = meta["s3_key"]
+        return status
+
+    def create(self, length: int, filename: Optional[str] = None, content_type: Optional[str] = None) -> Dict:
+        """Start a session for ``length`` bytes and return its status"""
+        if length < 0:
+            raise UploadError("Upload length must not be negative")
+        if length > self.limit:
+            raise UploadTooLargeError(f"Upload exceeds {self.limit} bytes")
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+        meta = {
+            "length": length,
+            "extension": upload_extension(filename, content_type),
+            "content_type": content_type,
+            "created_at": time.time(),
+        }
+        part_path.touch()
+        meta_path.write_text(json.dumps(meta))
+        self.stats["created"] += 1
+        return self._status(upload_id, meta, 0)
+
+    def _load(self, upload_id: str) -> Tuple[Dict, Path, int]:
+        meta_path, part_path = self._paths(upload_id)
+        try:
+            meta = json.loads(meta_path.read_text())
+            offset = meta["length"] if "s3_key" in meta else part_path.stat().st_size
+        except (OSError, ValueError):
+            raise UploadNotFoundError(upload_id)
+        return meta, part_path, offset
+
+    def status(self, upload_id: str) -> Dict:
+        meta, _, offset = self._load(upload_id)
+        return self._status(upload_id, meta, offset)
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict:
+        """
+        Append a chunk that starts at ``offset`` and return the new status
+
+        Raises:
+            UploadOffsetError: If ``offset`` is not where the upload stands
+            UploadTooLargeError: As soon as the chunk runs past the declared length
+        """
+        # Appends within this process are serialized; across processes the offset check catches overlap
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        self._appenders[upload_id] = self._appenders.get(upload_id, 0) + 1
+        try:
+            async with lock:
+                meta, part_path, current = await asyncio.to_thread(self._load, upload_id)
+                if offset != current:
+                    raise UploadOffsetError(current)
+                if "s3_key" in meta:
+                    # A retry of the final chunk; it was already stored
+                    return self._status(upload_id, meta, current)
+                with open(part_path, "ab") as f:
+                    try:
+                        written = await write_stream(chunks, f, meta["length"] - current)
+                    except UploadTooLargeError:
+                        # Drop the oversized chunk entirely so the client can resend it correctly
+                        f.flush()
+                        f.truncate(current)
+                        raise
+                # A disconnect keeps the bytes that arrived, and the next chunk resumes after them
+                for path in self._paths(upload_id):
+                    os.utime(path)
+                return self._status(upload_id, meta, current + written)
+        finally:
+            # Dropped only by the last append, so one waiting for the lock never gets a fresh one
+            self._appenders[upload_id] -= 1
+            if not self._appenders[upload_id]:
+                del self._appenders[upload_id]
+                del self._locks[upload_id]
+
+    async def complete(self, upload_id: str) -> ReceivedUpload:
+        """
+        Hash a fully received upload and hand its file over
+
+        The part file is renamed out of the session, so the caller owns it and
+        must remove it once stored, then record the key with ``stored``.
+        """
+        meta, part_path, offset = await asyncio.to_thread(self._load, upload_id)
+        if offset != meta["length"] or "s3_key" in meta:
+            raise UploadOffsetError(offset)
+        digest = await asyncio.to_thread(hash_file, part_path)
+        path = part_path.with_suffix(".done")
+        os.replace(part_path, path)
+        return ReceivedUpload(path, digest, offset, meta["extension"], meta["content_type"])
+
+    def stored(self, upload_id: str, s3_key: str) -> Dict:
+        """Record the key a completed upload was stored under and return the final status"""
+        meta_path, _ = self._paths(upload_id)
+        meta = json.loads(meta_path.read_text())
+        meta["s3_key"] = s3_key
+        tmp_path = meta_path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(meta))
+        os.replace(tmp_path, meta_path)
+        self.stats["completed"] += 1
+        return self._status(upload_id, meta, meta["length"])
+
+    def discard(self, upload_id: str):
+        for path in self._paths(upload_id):
+            path.unlink(missing_ok=True)
+
+    def _expire(self) -> int:
+        cutoff = time.time() - self.ttl
+        expired = 0
+        for path in self.directory.iterdir():
+            try:
+                if path.stat().st_mtime >= cutoff:
+                    continue
+                path.unlink()
+            except OSError:
+                continue
+            if path.suffix == ".json":
+                expired += 1
+        return expired
+
+    async def _reaper(self):
+        while True:
+            try:
+                expired = await asyncio.to_thread(self._expire)
+                if expired:
+                    logger.info(f"Expired {expired} resumable uploads")
+                    self.stats["expired"] += expired
+            except Exception as e:
+                logger.error(f"Resumable upload expiry failed: {e}", exc_info=True)
+            await asyncio.sleep(UPLOAD_SESSION_SWEEP_INTERVAL)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._reaper())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> Dict[str, int]:
+        return {**self.stats, "appending": len(self._locks)}
@@ -0,0 +1,233 @@
+import logging
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from shared_state import API_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Quotas (0 disables a bucket); they apply to the API key, so each worker process paces itself to its share
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60")) / API_WORKERS
+GEMINI_CHARS_PER_MINUTE = float(os.getenv("GEMINI_CHARS_PER_MINUTE", "0")) / API_WORKERS
+# Longest a request may wait for quota before failing fast
+GEMINI_MAX_QUOTA_WAIT = float(os.getenv("GEMINI_MAX_QUOTA_WAIT", "30"))
+
+# Retries
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "30"))
+
+# Circuit breaker
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))  # Consecutive failures to open
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))  # Seconds before a trial request
+
+# Upstream statuses worth retrying
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised when the upstream is over quota or failing and the request should not be attempted"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations instead of blocking.
+
+    ``reserve`` always succeeds and returns how long the caller must wait
+    before its tokens are available; the balance may go negative, which keeps
+    waiters in arrival order without needing a lock.
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, per_minute / 6)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        if not self.enabled:
+            return 0.0
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount: float):
+        if self.enabled:
+            self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+    def available(self) -> float:
+        if not self.enabled:
+            return float("inf")
+        self._refill()
+        return self.tokens
+
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream failures, then lets a single trial request through"""
+
+    def __init__(self, threshold: int = GEMINI_BREAKER_THRESHOLD, reset_timeout: float = GEMINI_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return max(1.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def release_trial(self):
+        """Give back a trial slot whose request ended without an outcome"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("Upstream circuit closed")
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                logger.warning(f"Upstream circuit opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class UpstreamGovernor:
+    """
+    Shared admission control for upstream requests.
+
+    Every attempt first passes the circuit breaker, then reserves one request
+    token and one token per input character. Requests are paced to the quota
+    ceiling up front rather than being fired and rejected, and retries back
+    off exponentially with full jitter while honouring Retry-After. Only
+    server errors and connection failures count towards opening the
+    circuit; quota pushback (429) is paced, not treated as an outage.
+    """
+
+    def __init__(self, requests_per_minute: float = GEMINI_REQUESTS_PER_MINUTE,
+                 chars_per_minute: float = GEMINI_CHARS_PER_MINUTE, max_wait: float = GEMINI_MAX_QUOTA_WAIT,
+                 max_retries: int = GEMINI_MAX_RETRIES, base_delay: float = GEMINI_RETRY_BASE_DELAY,
+                 max_delay: float = GEMINI_RETRY_MAX_DELAY):
+        self.requests = TokenBucket(requests_per_minute)
+        self.chars = TokenBucket(chars_per_minute)
+        self.breaker = CircuitBreaker()
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Earliest time the upstream asked us to come back (from Retry-After)
+        self.blocked_until = 0.0
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "throttled": 0,
+            "rejected": 0,
+            "failures": 0,
+            "rate_limited": 0,
+        }
+
+    def admit(self, chars: int) -> float:
+        """
+        Admit one attempt and return how long to wait before sending it
+
+        Raises:
+            UpstreamUnavailableError: If the circuit is open or the quota wait
+                would exceed max_wait
+        """
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise UpstreamUnavailableError("Upstream circuit is open", self.breaker.retry_after())
+
+        delay = max(
+            self.requests.reserve(1),
+            self.chars.reserve(chars),
+            self.blocked_until - time.monotonic(),
+        )
+        if delay > self.max_wait:
+            self.requests.refund(1)
+            self.chars.refund(chars)
+            self.breaker.release_trial()
+            self.stats["rejected"] += 1
+            raise UpstreamUnavailableError("Upstream quota exhausted", delay)
+
+        self.stats["requests"] += 1
+        if delay > 0:
+            self.stats["throttled"] += 1
+        return max(0.0, delay)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Return the delay before retry number ``attempt`` (0 based)"""
+        self.stats["retries"] += 1
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            # Everyone waits for the upstream's window; jitter spreads the restart
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            delay = max(delay, retry_after + random.uniform(0, self.base_delay))
+        return delay
+
+    def record_success(self):
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.stats["failures"] += 1
+        self.breaker.record_failure()
+
+    def record_rate_limited(self):
+        """Count a 429; it is paced through Retry-After and never opens the circuit"""
+        self.stats["rate_limited"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "request_tokens": None if not self.requests.enabled else round(self.requests.available(), 2),
+            "char_tokens": None if not self.chars.enabled else round(self.chars.available(), 2),
+            "blocked_for": max(0.0, round(self.blocked_until - time.monotonic(), 2)),
+        }